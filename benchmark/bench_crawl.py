@@ -0,0 +1,388 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import re
+import resource
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import types
+import zlib
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import yaml
+
+import fixtures
+
+sys.path.insert(0, fixtures.ROOT)
+
+"""
+    抓取的端到端基准测试，不访问网络: 本地 HTTP 服务代替央视的接口，返回新闻联播每天的列表页、每一节的页面、
+    栏目列表的 JSONP 和视频信息 (标签) 的 JSON，每个请求按 --latency、--jitter 延迟后返回；
+    用临时配置文件把 xwlb / jrsf / jdft / video_info 的地址指向本地服务，执行真实的抓取代码:
+        xwlb  每天调用 xwlb.get_sections
+        jrsf  jrsf.get_content 获取最新一期，jrsf.get_contents 获取指定的一天 (main.py 的抓取阶段) 和翻页获取 --column-days 天
+        jdft  同 jrsf
+    每个程序在单独的进程中运行 --repeat 次，输出耗时、请求数/秒、进程 CPU、解析 CPU 和内存峰值 (RSS)，
+    解析 CPU 是 HTML 解析、XPath 提取、JSONP 和视频信息 JSON 解码的线程 CPU 时间之和；
+    指定 --save-baseline 时保存结果，之后的运行与保存的结果对比，超过 --tolerance 的指标标记为变慢，退出码为 1
+    用法 (在 benchmark 目录下执行):
+        python bench_crawl.py --days 7 --latency 50 --jitter 20 --save-baseline
+        python bench_crawl.py --days 7 --latency 50 --jitter 20
+        python bench_crawl.py --pages ./20240413       新闻联播使用 bench_extract.py --fetch 保存的真实页面
+"""
+
+PROGRAMS = ("xwlb", "jrsf", "jdft")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "crawl_baseline.json")
+# 与基准对比的指标，数值越大越差
+METRICS = ("wall_s", "cpu_ms", "parse_cpu_ms", "peak_rss_mb")
+
+_href_pattern = re.compile(r'<a href="(https?://[^"]+)"')
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_dates(days: int, end: str) -> List[str]:
+    last = datetime.strptime(end, "%Y%m%d")
+    return [(last - timedelta(days=i)).strftime("%Y%m%d") for i in range(days - 1, -1, -1)]
+
+
+def video_info(pid: str, tags: str) -> bytes:
+    # getHttpVideoInfo.do 的响应，只保留 video_info.extract_info 用到的字段
+    return json.dumps({"tag": tags, "title": pid, "image": "", "play_channel": "CCTV-1",
+                       "column": "", "f_pgmtime": "", "video": {"totalLength": "1800"}},
+                      ensure_ascii=False).encode("utf-8")
+
+
+def build_routes(args, base: str) -> Dict[str, Tuple[str, bytes]]:
+    """
+    生成本地服务返回的所有内容: {路径: (Content-Type, 内容)}，栏目列表另外按 id 保存在 "column:<id>" 中。
+    """
+    routes = {}
+    html_type, json_type = "text/html; charset=utf-8", "application/json; charset=utf-8"
+    dates = make_dates(args.days, args.end)
+
+    if args.pages:
+        # 保存的真实页面: 每天返回同一个列表页，链接按出现顺序对应 section_XX.html
+        pages = fixtures.load_pages(args.pages)
+        urls = list(dict.fromkeys(_href_pattern.findall(pages["day.html"])))
+        day = pages["day.html"]
+        for i, url in enumerate(urls):
+            local = base + urlsplit(url).path
+            day = day.replace(url, local)
+            routes[urlsplit(url).path] = (html_type, pages["section_{:02d}.html".format(i)].encode("utf-8"))
+        for date in dates:
+            routes["/lm/xwlb/day/{}.shtml".format(date)] = (html_type, day.encode("utf-8"))
+        for path, (_, body) in list(routes.items()):
+            match = re.search(rb'var guid = "(.*?)";', body)
+            if match:
+                pid = match.group(1).decode()
+                routes["/api/getHttpVideoInfo.do?pid=" + pid] = (json_type, video_info(pid, "新闻联播"))
+    else:
+        # 按新闻联播页面的结构生成，每一节的 guid 不同，标签需要逐个请求
+        for date, records in fixtures.make_corpus(args.days, args.per_day, dates[0], args.seed):
+            for record in records:
+                pid = "VIDE{}{:04d}".format(date, record["id"])
+                path = "/{}/{}/{}/{}.shtml".format(date[:4], date[4:6], date[6:], pid)
+                record["video_url"] = base + path
+                routes[path] = (html_type, fixtures.section_page(record).encode("utf-8"))
+                routes["/api/getHttpVideoInfo.do?pid=" + pid] = (json_type, video_info(pid, record["tags"]))
+            routes["/lm/xwlb/day/{}.shtml".format(date)] = (html_type, fixtures.day_page(records).encode("utf-8"))
+
+    # 今日说法、焦点访谈的栏目列表，按时间倒序，每天一期
+    column_dates = make_dates(args.column_days, args.end)
+    for program in ("jrsf", "jdft"):
+        entries = []
+        for date, records in fixtures.make_corpus(args.column_days, 1, column_dates[0], args.seed + 1):
+            pid = "{}{}".format(program, date)
+            record = records[0]
+            entries.append({
+                "guid": pid,
+                "title": "{} {}".format(program, record["abstract"][:20]),
+                "image": record["image_url"],
+                "brief": record["content"][:600],
+                "url": "https://tv.cctv.com/{}/{}/{}/{}.shtml".format(date[:4], date[4:6], date[6:], pid),
+                "time": "{}-{}-{} 19:30:00".format(date[:4], date[4:6], date[6:]),
+            })
+            routes["/api/getHttpVideoInfo.do?pid=" + pid] = (json_type, video_info(pid, record["tags"]))
+        entries.reverse()
+        routes["column:" + args.top_ids[program]] = ("", json.dumps(entries, ensure_ascii=False).encode("utf-8"))
+    return routes
+
+
+def serve(routes: Dict[str, Tuple[str, bytes]], port: int, latency: float, jitter: float, seed: int,
+          ready: multiprocessing.Queue) -> None:
+    """
+    在单独的进程中运行，不占用被测进程的 CPU；每个请求延迟 latency ± jitter 毫秒 (按路径和请求次数确定)。
+    """
+    columns = {key[len("column:"):]: json.loads(body) for key, (_, body) in routes.items()
+               if key.startswith("column:")}
+    counts: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def column_page(query: Dict[str, List[str]]) -> bytes:
+        entries = columns.get(query["id"][0], [])
+        n, p = int(query["n"][0]), int(query["p"][0])
+        callback = (query.get("cb") or query.get("callback"))[0]
+        data = {"data": {"list": entries[(p - 1) * n:p * n], "total": len(entries)}}
+        return "{}({});".format(callback, json.dumps(data, ensure_ascii=False)).encode("utf-8")
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            with lock:
+                counts[self.path] = counts.get(self.path, 0) + 1
+                rng = random.Random(zlib.crc32(self.path.encode()) + counts[self.path] + seed)
+            time.sleep(max(latency + rng.uniform(-jitter, jitter), 0) / 1000)
+            url = urlsplit(self.path)
+            if url.path == "/NewVideo/getVideoListByColumn":
+                content_type, body = "application/javascript; charset=utf-8", column_page(parse_qs(url.query))
+            else:
+                content_type, body = routes.get(self.path, ("text/plain", None))
+            self.send_response(200 if body is not None else 404)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body or b"")))
+            self.end_headers()
+            self.wfile.write(body or b"")
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    ready.put(port)
+    server.serve_forever()
+
+
+def write_config(base: str, directory: str, workers: int) -> str:
+    """
+    复制 config/config.yaml 到 directory，把接口地址指向本地服务，视频信息缓存放在 directory 中 (每次运行都是空的)，
+    关闭 HTTP 磁盘缓存。
+    """
+    with open(os.path.join(fixtures.ROOT, "config", "config.yaml"), "r") as f:
+        config = yaml.safe_load(f)
+    config["xwlb"]["day_url"] = base + "/lm/xwlb/day/{}.shtml"
+    if workers:
+        config["xwlb"]["workers"] = workers
+    for program in ("jrsf", "jdft"):
+        config[program]["day_url"] = re.sub(r"^https?://[^/]+", base, config[program]["day_url"])
+    config["video_info"]["url"] = re.sub(r"^https?://[^/]+", base, config["video_info"]["url"])
+    config["video_info"]["db"] = os.path.join(directory, "video_info.db")
+    config["http_cache"]["enabled"] = False
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "config.yaml")
+    with open(path, "w") as f:
+        yaml.safe_dump(config, f, allow_unicode=True)
+    return path
+
+
+def run_program(program: str, config_path: str, dates: List[str], column_dates: List[str],
+                per_day: int, result: multiprocessing.Queue) -> None:
+    """
+    在新进程中执行一个程序的抓取，RSS 峰值只包含这个程序。
+    """
+    from lxml import etree
+
+    from common import config, http_client, jsonp, parse_html
+    from common import video_info as video_info_module
+
+    # 所有模块读取默认配置文件时使用临时配置
+    config._configs[config.config_file_name] = config.Config(config_path)
+
+    parse_cpu = [0.0]
+    requests_count = [0]
+    lock = threading.Lock()
+
+    def timed(func: Callable) -> Callable:
+        def wrapper(*args, **kwargs):
+            begin = time.thread_time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.thread_time() - begin
+                with lock:
+                    parse_cpu[0] += elapsed
+        return wrapper
+
+    def counted(func: Callable) -> Callable:
+        def wrapper(*args, **kwargs):
+            with lock:
+                requests_count[0] += 1
+            return func(*args, **kwargs)
+        return wrapper
+
+    http_client.request = counted(http_client.request)
+    parse_html.etree = types.SimpleNamespace(HTML=timed(etree.HTML))
+    jsonp.parse_jsonp = timed(jsonp.parse_jsonp)
+    video_info_module.json = types.SimpleNamespace(loads=timed(json.loads), dumps=json.dumps)
+
+    errors = []
+    cpu_begin, wall_begin = time.process_time(), time.perf_counter()
+    if program == "xwlb":
+        from xwlb import xwlb
+        for name in ("extract_items", "extract_section", "extract_guid"):
+            setattr(xwlb, name, timed(getattr(xwlb, name)))
+        for date in dates:
+            sections = xwlb.get_sections(date, skip_failed=False)
+            if len(sections) != per_day or not all(section["tags"] for section in sections):
+                errors.append("{} 获取 {} 节，没有标签的 {} 节".format(
+                    date, len(sections), sum(1 for section in sections if not section["tags"])))
+    else:
+        module = __import__("{0}.{0}".format(program), fromlist=[program])
+        # get_content 把最新一期记为传入的日期，用 guid 判断取到的是哪一期: 本地服务中 guid 为 栏目名 + 播出日期
+        latest = module.get_content(column_dates[-1])
+        if latest["guid"] != program + column_dates[-1] or not latest["tags"]:
+            errors.append("最新一期不正确: {}".format(latest["guid"]))
+        day = column_dates[len(column_dates) // 2]
+        records = module.get_contents(day, day)
+        if [record["guid"] for record in records] != [program + day]:
+            errors.append("{} 获取到 {}".format(day, ", ".join(record["guid"] for record in records) or "0 期"))
+        records = module.get_contents(column_dates[0], column_dates[-1])
+        if len(records) != len(column_dates) or not all(record["tags"] for record in records):
+            errors.append("批量获取 {} 期，应为 {} 期".format(len(records), len(column_dates)))
+    wall = time.perf_counter() - wall_begin
+    result.put({
+        "wall_s": wall,
+        "requests": requests_count[0],
+        "req_per_s": requests_count[0] / wall,
+        "cpu_ms": (time.process_time() - cpu_begin) * 1000,
+        "parse_cpu_ms": parse_cpu[0] * 1000,
+        # Linux 上 ru_maxrss 的单位是 KB
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "errors": errors,
+    })
+
+
+def measure(context, program: str, base: str, directory: str, args) -> Dict:
+    runs = []
+    for i in range(args.repeat):
+        config_path = write_config(base, os.path.join(directory, "{}_{}".format(program, i)), args.workers)
+        result = context.Queue()
+        process = context.Process(target=run_program, args=(
+            program, config_path, make_dates(args.days, args.end),
+            make_dates(args.column_days, args.end), args.per_day, result))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise SystemExit("{} 运行失败，退出码 {}".format(program, process.exitcode))
+        runs.append(result.get())
+    # 耗时和 CPU 取中位数，内存取最大值
+    summary = {key: statistics.median(run[key] for run in runs)
+               for key in ("wall_s", "requests", "req_per_s", "cpu_ms", "parse_cpu_ms")}
+    summary["peak_rss_mb"] = max(run["peak_rss_mb"] for run in runs)
+    summary["errors"] = sorted({error for run in runs for error in run["errors"]})
+    return summary
+
+
+def compare(results: Dict[str, Dict], baseline: Dict, tolerance: float) -> List[str]:
+    """
+    返回比基准差超过 tolerance 的指标；运行参数不同时不对比。
+    """
+    regressions = []
+    for program, result in results.items():
+        expected = baseline["results"].get(program)
+        if not expected:
+            continue
+        for metric in METRICS:
+            if expected[metric] > 0 and result[metric] > expected[metric] * (1 + tolerance):
+                regressions.append("{} {}: {:.2f} -> {:.2f} (+{:.0%})".format(
+                    program, metric, expected[metric], result[metric], result[metric] / expected[metric] - 1))
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="抓取端到端基准测试")
+    parser.add_argument("--programs", nargs="+", choices=PROGRAMS, default=list(PROGRAMS))
+    parser.add_argument("--days", type=int, default=7, help="新闻联播抓取的天数")
+    parser.add_argument("--per-day", type=int, default=16, help="新闻联播每天的节数")
+    parser.add_argument("--column-days", type=int, default=365, help="今日说法、焦点访谈批量获取的天数")
+    parser.add_argument("--end", default="20240430", help="最后一天 yyyymmdd")
+    parser.add_argument("--pages", default=None, help="新闻联播使用保存的页面 (day.html 和 section_*.html)")
+    parser.add_argument("--latency", type=float, default=50, help="每个请求的延迟 (毫秒)")
+    parser.add_argument("--jitter", type=float, default=20, help="延迟的随机浮动 (毫秒)")
+    parser.add_argument("--workers", type=int, default=0, help="xwlb.workers，0 表示使用配置文件")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基准结果文件")
+    parser.add_argument("--save-baseline", action="store_true", help="把这次的结果保存为基准")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="比基准差多少算变慢")
+    args = parser.parse_args()
+
+    if args.pages:
+        with open(os.path.join(args.pages, "day.html"), encoding="utf-8") as f:
+            args.per_day = len(dict.fromkeys(_href_pattern.findall(f.read())))
+    with open(os.path.join(fixtures.ROOT, "config", "config.yaml"), "r") as f:
+        config = yaml.safe_load(f)
+    args.top_ids = {program: config[program]["top_id"] for program in ("jrsf", "jdft")}
+
+    # spawn: 子进程不继承本进程的内存，RSS 只包含被测程序
+    context = multiprocessing.get_context("spawn")
+    directory = tempfile.mkdtemp(prefix="bench_crawl_")
+    server = None
+    try:
+        # 页面中的链接包含服务地址，先选好端口再生成页面
+        port = free_port()
+        base = "http://127.0.0.1:{}".format(port)
+        routes = build_routes(args, base)
+        ready = context.Queue()
+        server = context.Process(target=serve, args=(routes, port, args.latency, args.jitter, args.seed, ready),
+                                 daemon=True)
+        server.start()
+        ready.get(timeout=30)
+
+        parameters = {key: getattr(args, key) for key in
+                      ("days", "per_day", "column_days", "pages", "latency", "jitter", "workers", "seed")}
+        print("延迟 {:.0f}±{:.0f}ms，新闻联播 {} 天 x {} 节，栏目 {} 天，每个程序运行 {} 次".format(
+            args.latency, args.jitter, args.days, args.per_day, args.column_days, args.repeat))
+        print("{:<6} {:>9} {:>7} {:>9} {:>10} {:>12} {:>10}".format(
+            "程序", "耗时 s", "请求", "请求/s", "CPU ms", "解析 CPU ms", "RSS MB"))
+        results = {}
+        for program in args.programs:
+            result = measure(context, program, base, directory, args)
+            results[program] = result
+            print("{:<8} {:>9.2f} {:>9.0f} {:>9.1f} {:>10.1f} {:>12.1f} {:>10.1f}".format(
+                program, result["wall_s"], result["requests"], result["req_per_s"], result["cpu_ms"],
+                result["parse_cpu_ms"], result["peak_rss_mb"]))
+            for error in result["errors"]:
+                print("    结果不正确: " + error)
+    finally:
+        if server is not None:
+            server.terminate()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    failed = any(result["errors"] for result in results.values())
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"parameters": parameters, "results": results}, f, ensure_ascii=False, indent=2)
+        print("保存基准到 {}".format(args.baseline))
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["parameters"] != parameters:
+            print("基准的运行参数不同，不对比: {}".format(baseline["parameters"]))
+        else:
+            regressions = compare(results, baseline, args.tolerance)
+            for regression in regressions:
+                print("变慢: " + regression)
+            if not regressions:
+                print("与基准相比没有超过 {:.0%} 的变化".format(args.tolerance))
+            failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import argparse
+import os
+import re
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+from lxml import etree
+
+import fixtures
+
+sys.path.insert(0, fixtures.ROOT)
+
+from xwlb.xwlb import extract_guid, extract_items, extract_section  # noqa: E402
+
+"""
+    新闻联播页面提取的基准测试，不访问网络，比较原来逐个下标拼 XPath + 整棵树序列化找 guid 的写法
+    和现在预编译 XPath、只遍历一次 <li>、在原文中找 guid 的写法，输出每天的解析 CPU 时间和 Python 内存分配
+    用法 (在 benchmark 目录下执行):
+        python bench_extract.py                         使用 xwlb/content 生成的页面
+        python bench_extract.py --pages ./pages         使用保存的页面 (day.html 和 section_*.html)
+        python bench_extract.py --fetch 20240413 --pages ./pages   先保存某一天的真实页面
+"""
+
+
+def old_extract_day(pages: Dict[str, str]) -> List[Tuple]:
+    # 原来的写法，保留用于对比
+    html = etree.HTML(pages["day.html"])
+    count = int(html.xpath('count(//html/body/li)'))
+    items = []
+    for i in range(1, count + 1):
+        image_url = 'http:' + html.xpath('//html/body/li[{}]/div/a/img/@src'.format(i))[0]
+        section_url = html.xpath('//html/body/li[{}]/a/@href'.format(i))[0]
+        items.append((i - 1, image_url, section_url))
+
+    sections = []
+    for name, text in pages.items():
+        if name == "day.html":
+            continue
+        sub_html = etree.HTML(text)
+        abstracts = sub_html.xpath('//*[@id="page_body"]/div[1]/div[2]/div[1]/div[2]/text()')
+        content = sub_html.xpath('//*[@id="content_area"]//text()')
+        match = re.search(r'var guid = "(.*?)";', etree.tostring(sub_html, encoding="unicode"))
+        sections.append((''.join(abstracts), ''.join(content), match.group(1) if match else None))
+    return [items, sections]
+
+
+def new_extract_day(pages: Dict[str, str]) -> List[Tuple]:
+    items = extract_items(etree.HTML(pages["day.html"]))
+    sections = []
+    for name, text in pages.items():
+        if name == "day.html":
+            continue
+        sections.append(extract_section(etree.HTML(text)) + (extract_guid(text),))
+    return [items, sections]
+
+
+def measure(extract: Callable, days: List[Dict[str, str]], repeat: int) -> Tuple[float, float]:
+    """
+    返回 (每天 CPU 毫秒, 每天 Python 内存分配峰值 KB)。
+    lxml 的树由 libxml2 分配，不在 tracemalloc 统计中，这里统计的是提取过程中产生的 Python 对象 (序列化的字符串、列表等)。
+    """
+    for pages in days:
+        extract(pages)
+
+    begin = time.process_time()
+    for _ in range(repeat):
+        for pages in days:
+            extract(pages)
+    cpu_ms = (time.process_time() - begin) * 1000 / (repeat * len(days))
+
+    peak = 0
+    tracemalloc.start()
+    for pages in days:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        extract(pages)
+        peak += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return cpu_ms, peak / 1024 / len(days)
+
+
+def fetch_day(date: str, directory: str) -> None:
+    # 保存某一天的列表页和每一节的页面，需要在程序目录 (如 benchmark) 下运行以读取配置文件
+    from common.config import get_value_from_yaml_or_env
+    from common.parse_html import fetch_html
+
+    text, html = fetch_html(get_value_from_yaml_or_env("xwlb.day_url").format(date))
+    pages = {"day.html": text}
+    for i, _, section_url in extract_items(html):
+        pages["section_{:02d}.html".format(i)] = fetch_html(section_url)[0]
+    fixtures.save_pages(pages, directory)
+    print("保存 {} 个页面到 {}".format(len(pages), directory))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="新闻联播页面提取基准测试")
+    parser.add_argument("--pages", default=None, help="保存页面的目录，不指定时用 xwlb/content 生成")
+    parser.add_argument("--fetch", default=None, metavar="DATE", help="先把这一天的页面保存到 --pages")
+    parser.add_argument("--repeat", type=int, default=20, help="重复次数")
+    args = parser.parse_args()
+
+    if args.fetch:
+        args.pages = args.pages or os.path.join(".", args.fetch)
+        fetch_day(args.fetch, args.pages)
+
+    if args.pages:
+        days = [fixtures.load_pages(args.pages)]
+    else:
+        sections = fixtures.load_sections()
+        days = [fixtures.build_day(sections)]
+
+    if old_extract_day(days[0]) != new_extract_day(days[0]):
+        raise SystemExit("两种写法的提取结果不一致")
+
+    size = sum(len(text.encode("utf-8")) for pages in days for text in pages.values()) / len(days)
+    print("每天 {} 个页面，{:.0f} KB，重复 {} 次".format(len(days[0]), size / 1024, args.repeat))
+    results = {}
+    for name, extract in (("old", old_extract_day), ("new", new_extract_day)):
+        results[name] = measure(extract, days, args.repeat)
+        print("{:<4} CPU {:8.2f} ms/天  内存峰值 {:8.1f} KB/天".format(name, *results[name]))
+    old, new = results["old"], results["new"]
+    print("节省 CPU {:.2f} ms/天 ({:.0%})，内存峰值 {:.1f} KB/天".format(
+        old[0] - new[0], (old[0] - new[0]) / old[0], old[1] - new[1]))
+
+
+if __name__ == '__main__':
+    main()
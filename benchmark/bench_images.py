@@ -0,0 +1,111 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Dict
+
+from PIL import Image
+
+import fixtures
+
+sys.path.insert(0, fixtures.ROOT)
+
+from common import image  # noqa: E402
+
+"""
+    缩略图生成的吞吐量，不访问网络: 本地 HTTP 服务返回生成的 JPEG (大小接近 cctvpic 的章节图片)，
+    分别用线程池和进程池生成缩略图，输出每秒处理的图片数，并按回填的天数估算总耗时
+    用法 (在 benchmark 目录下执行):
+        python bench_images.py --count 300 --days 365 --per-day 16
+"""
+
+
+def make_images(count: int, width: int, height: int) -> Dict[str, bytes]:
+    # 渐变加噪点，压缩后的大小和真实照片接近；每张图片左上角不同，内容 hash 各不相同
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40)
+    base = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+    images = {}
+    for i in range(count):
+        copy = base.copy()
+        copy.paste((i * 37 % 256, i * 59 % 256, i * 83 % 256), (0, 0, 32, 32))
+        buffer = BytesIO()
+        copy.save(buffer, format="JPEG", quality=85)
+        images["/img/{}.jpg".format(i)] = buffer.getvalue()
+    return images
+
+
+def serve(images: Dict[str, bytes]) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            body = images.get(self.path)
+            self.send_response(200 if body else 404)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(body or b"")))
+            self.end_headers()
+            self.wfile.write(body or b"")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run(name: str, urls, pool, workers: int) -> float:
+    directory = tempfile.mkdtemp(prefix="bench_images_")
+    try:
+        image._store = image.ImageStore(directory, 1 << 40)
+        begin = time.perf_counter()
+        results = image.process_images(urls, workers=workers, pool=pool)
+        elapsed = time.perf_counter() - begin
+        stats = image._store.stats
+        print("{:<10} {:5d} 张  {:7.2f}s  {:7.1f} 张/秒  下载 {:6.1f} MB  生成 {:5.1f} MB".format(
+            name, len(results), elapsed, len(results) / elapsed,
+            stats["fetched_bytes"] / 1048576, stats["generated_bytes"] / 1048576))
+        return len(results) / elapsed
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="缩略图生成吞吐量")
+    parser.add_argument("--count", type=int, default=200, help="图片数")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--workers", type=int, default=8, help="下载线程数")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="进程数")
+    parser.add_argument("--days", type=int, default=365, help="估算回填的天数")
+    parser.add_argument("--per-day", type=int, default=16, help="每天的图片数 (新闻联播约 16 节)")
+    args = parser.parse_args()
+
+    images = make_images(args.count, args.width, args.height)
+    server = serve(images)
+    base = "http://127.0.0.1:{}".format(server.server_port)
+    urls = [base + path for path in images]
+    print("{} 张 {}x{} 图片，平均 {:.0f} KB，缩略图 {}".format(
+        len(images), args.width, args.height, sum(map(len, images.values())) / len(images) / 1024,
+        ", ".join("{name} {width}px {format}".format(**variant) for variant in image.get_variants())))
+
+    with ThreadPoolExecutor(max_workers=args.processes) as pool:
+        threads = run("threads", urls, pool, args.workers)
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        # 先启动子进程，不计入耗时
+        list(pool.map(abs, range(args.processes)))
+        processes = run("processes", urls, pool, args.workers)
+
+    total = args.days * args.per_day
+    print("回填 {} 天 ({} 张): 线程池约 {:.1f} 分钟，进程池约 {:.1f} 分钟 ({} 个 CPU)".format(
+        args.days, total, total / threads / 60, total / processes / 60, os.cpu_count()))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import argparse
+import json
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import fixtures
+
+sys.path.insert(0, fixtures.ROOT)
+
+from common.ngram_index import NgramIndex, record_text  # noqa: E402
+
+"""
+    倒排索引的建立和查询速度: 用 fixtures.make_corpus 生成多年的新闻联播记录，逐天写入并 flush (与每天运行时相同)，
+    再与逐条扫描原文的结果、耗时对比
+    用法 (在 benchmark 目录下执行):
+        python bench_ngram.py --years 5
+"""
+
+
+def scan(corpus, keywords, start, end):
+    # 逐条扫描: 所有关键词都是原文的子串
+    keywords = [keyword.lower() for keyword in keywords]
+    return sorted((date, "tbl_xwlb", "{}/{}".format(date, record["id"]))
+                  for date, records in corpus if start <= date <= end
+                  for record in records
+                  if all(keyword in record_text(record).lower() for keyword in keywords))
+
+
+def timed(func, repeat: int):
+    times, result = [], None
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - begin)
+    return result, statistics.median(times) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="倒排索引基准测试")
+    parser.add_argument("--years", type=float, default=3)
+    parser.add_argument("--per-day", type=int, default=16)
+    parser.add_argument("--max-segments", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    days = int(args.years * 365)
+    corpus = list(fixtures.make_corpus(days, args.per_day))
+    raw_bytes = sum(len(json.dumps(records, ensure_ascii=False).encode("utf-8")) for _, records in corpus)
+    directory = tempfile.mkdtemp(prefix="bench_ngram_")
+    try:
+        index = NgramIndex(directory, args.max_segments)
+        begin = time.perf_counter()
+        slowest = 0.0
+        for date, records in corpus:
+            day_begin = time.perf_counter()
+            index.add_day("tbl_xwlb", date, records)
+            index.flush()
+            slowest = max(slowest, time.perf_counter() - day_begin)
+        elapsed = time.perf_counter() - begin
+        stats = index.stats()
+        print("{} 天 {} 条，原文 {:.1f} MB，索引 {:.1f} MB ({} 个段，{} 个词)".format(
+            days, stats["documents"], raw_bytes / 1048576, stats["bytes"] / 1048576, stats["segments"],
+            stats["terms"]))
+        print("逐天写入: {:.1f}s，{:.0f} 条/秒，最慢的一天 (含合并) {:.2f}s".format(
+            elapsed, stats["documents"] / elapsed, slowest))
+
+        begin = time.perf_counter()
+        index = NgramIndex(directory, args.max_segments)
+        print("重新打开: {:.0f}ms".format((time.perf_counter() - begin) * 1000))
+
+        # 高频词、短语、随机生成的低频人名、多个关键词，分别查询全部日期和最近一年
+        # 低频词: 从一条记录中取 20 个三字片段，选出现次数最少的
+        sample = corpus[len(corpus) // 2][1][0]["content"]
+        pieces = [sample[i:i + 3] for i in range(0, len(sample) - 3, max((len(sample) - 3) // 20, 1))]
+        rare = min((piece for piece in pieces if "。" not in piece and "，" not in piece),
+                   key=lambda piece: len(scan(corpus, [piece], corpus[0][0], corpus[-1][0])))
+        last_year = corpus[-365][0] if len(corpus) > 365 else corpus[0][0]
+        queries = ["经济", "习近平总书记", rare, "发展 合作", "国家 标签"]
+        print("{:<16} {:>10} {:>8} {:>10} {:>10}".format("查询", "范围", "结果", "索引 ms", "扫描 ms"))
+        for query in queries:
+            for start, end in ((corpus[0][0], corpus[-1][0]), (last_year, corpus[-1][0])):
+                found, index_ms = timed(lambda: index.search(query, start, end), args.repeat)
+                expected, scan_ms = timed(lambda: scan(corpus, query.split(), start, end), 1)
+                status = "" if found == expected else "  结果不一致: {} / {}".format(len(found), len(expected))
+                print("{:<16} {:>10} {:>8} {:>10.1f} {:>10.1f}{}".format(
+                    query, start[:4] + "-" + end[:4], len(found), index_ms, scan_ms, status))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import glob
+import html
+import json
+import os
+import random
+import re
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Tuple
+
+"""
+    基准测试用的页面，按新闻联播页面的结构用 xwlb/content 下保存的数据生成，
+    也可以读取 bench_extract.py --fetch 保存下来的真实页面；
+    以及用这些数据中的句子拼出的多年的记录 (make_corpus)
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONTENT_DIR = os.path.join(ROOT, "xwlb", "content")
+
+# 真实页面中除正文外还有大量导航、脚本，用来让页面大小接近线上
+_NAV = "".join('<li><a href="https://tv.cctv.com/lm/{0}/" target="_blank">栏目{0}</a></li>'.format(i)
+               for i in range(300))
+_SCRIPTS = "".join('<script type="text/javascript">var config_{0} = {{"id": {0}, "name": "item{0}"}};</script>'
+                   .format(i) for i in range(60))
+
+
+def load_sections() -> List[Dict]:
+    """
+    读取 xwlb/content 下保存的所有章节。
+    """
+    sections = []
+    for file_name in sorted(glob.glob(os.path.join(CONTENT_DIR, "*.json"))):
+        with open(file_name, "r") as f:
+            sections.extend(json.load(f))
+    return sections
+
+
+def section_guid(section: Dict) -> str:
+    # 用链接中的 VIDE... 作为 guid，保证同一节每次生成的页面相同
+    match = re.search(r"(VIDE\w+)\.shtml", section["video_url"])
+    return match.group(1) if match else "%032x" % section["id"]
+
+
+def day_page(sections: List[Dict]) -> str:
+    """
+    一天的列表页，只有 <li>，解析后位于 /html/body/li。
+    """
+    items = []
+    for section in sections:
+        items.append('<li><div class="image"><a href="{url}" target="_blank">'
+                     '<img src="{image}" alt=""></a></div>'
+                     '<a href="{url}" target="_blank">{title}</a></li>'.format(
+                         url=section["video_url"], image=section["image_url"].replace("http:", "", 1),
+                         title=html.escape(section["abstract"][:30])))
+    return "\n".join(items)
+
+
+def section_page(section: Dict) -> str:
+    """
+    一节的页面，摘要在 #page_body/div[1]/div[2]/div[1]/div[2]，正文在 #content_area，guid 在 script 中。
+    """
+    paragraphs = "".join("<p>{}</p>".format(html.escape(paragraph))
+                         for paragraph in section["content"].split("。") if paragraph)
+    return ('<!DOCTYPE html><html><head><meta charset="utf-8"><title>{title}</title>{scripts}'
+            '<script type="text/javascript">var guid = "{guid}";var commentTitle = "{title}";</script>'
+            '</head><body><div class="nav"><ul>{nav}</ul></div>'
+            '<div id="page_body"><div class="column"><div class="header"></div><div class="main">'
+            '<div class="info"><div class="label">简介</div><div class="brief">{abstract}</div></div>'
+            '<div class="video"><div id="content_area">{content}</div></div>'
+            '</div></div></div><div class="footer"><ul>{nav}</ul></div></body></html>').format(
+        title=html.escape(section["abstract"][:30]), scripts=_SCRIPTS, guid=section_guid(section),
+        nav=_NAV, abstract=html.escape(section["abstract"]), content=paragraphs)
+
+
+def build_day(sections: List[Dict]) -> Dict[str, str]:
+    """
+    返回 {文件名: 页面}，day.html 是列表页，其余是每一节的页面。
+    """
+    pages = {"day.html": day_page(sections)}
+    for i, section in enumerate(sections):
+        pages["section_{:02d}.html".format(i)] = section_page(section)
+    return pages
+
+
+def save_pages(pages: Dict[str, str], directory: str) -> None:
+    os.makedirs(directory, exist_ok=True)
+    for name, text in pages.items():
+        with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+def load_pages(directory: str) -> Dict[str, str]:
+    pages = {}
+    for file_name in sorted(glob.glob(os.path.join(directory, "*.html"))):
+        with open(file_name, "r", encoding="utf-8") as f:
+            pages[os.path.basename(file_name)] = f.read()
+    return pages
+
+
+def make_corpus(days: int, per_day: int = 16, start: str = "20150101",
+                seed: int = 0) -> Iterator[Tuple[str, List[Dict]]]:
+    """
+    生成 days 天、每天 per_day 节的新闻联播记录，返回 (日期, 记录)。
+    正文由保存的章节中随机抽取的句子拼成，再加入随机生成的人名、地名，使词的分布接近多年的数据；
+    标签从固定的标签池中按幂律分布抽取。
+    """
+    rng = random.Random(seed)
+    sentences = [sentence + "。" for section in load_sections()
+                 for sentence in section["content"].split("。") if sentence]
+    chars = [chr(code) for code in range(0x4e00, 0x4e00 + 3000)]
+    names = ["".join(rng.choice(chars) for _ in range(rng.randint(2, 4))) for _ in range(20000)]
+    tags = ["标签{}".format(i) for i in range(2000)]
+    first = datetime.strptime(start, "%Y%m%d")
+    for day in range(days):
+        date = (first + timedelta(days=day)).strftime("%Y%m%d")
+        records = []
+        for i in range(per_day):
+            parts = rng.sample(sentences, rng.randint(3, 12))
+            for _ in range(rng.randint(1, 4)):
+                parts.insert(rng.randrange(len(parts) + 1), names[int(rng.paretovariate(1.1)) % len(names)] + "。")
+            content = "".join(parts)
+            records.append({
+                "id": i + 1,
+                "date": date,
+                "image_url": "http://p1.img.cctvpic.com/{}/{}.jpg".format(date, i),
+                "tags": " ".join(sorted({tags[int(rng.paretovariate(0.8)) % len(tags)]
+                                         for _ in range(rng.randint(1, 4))})),
+                "abstract": content[:40],
+                "content": content,
+                "video_url": "https://tv.cctv.com/{}/{}.shtml".format(date, i),
+            })
+        yield date, records
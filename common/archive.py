@@ -0,0 +1,329 @@
+import argparse
+import gzip
+import json
+import logging
+import mmap
+import os
+import re
+import threading
+import zlib
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from common.config import get_value_from_yaml_or_env
+from common.sink import Sink
+
+"""
+    按天追加的压缩归档，代替每天一个缩进格式的 json 文件
+    - 归档文件 表名.jsonl.gz: 每天的记录写成 JSONL，单独压缩为一个 gzip 块追加到文件末尾，
+      整个文件仍是合法的 gzip，可以直接 zcat
+    - 索引文件 表名.jsonl.gz.idx: 每行 日期\\t偏移\\t长度\\t条数，同一天重新写入时追加新块，以最后一行为准
+    - 读取一天或一段日期时 mmap 归档文件，只解压对应的块
+    用法 (在程序目录下执行，配置中的相对路径相对程序目录):
+        PYTHONPATH=.. python -m common.archive convert tbl_xwlb ./content
+        PYTHONPATH=.. python -m common.archive read tbl_xwlb 20240401 20240413
+        PYTHONPATH=.. python -m common.archive compact tbl_xwlb
+"""
+
+log = logging.getLogger(__name__)
+
+_DATE_PATTERN = re.compile(r"(\d{8})")
+
+
+class Archive:
+
+    def __init__(self, path: str, level: int = 6):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.level = level
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # {日期: (偏移, 长度, 条数)}，以及排好序的日期，用于按范围查找
+        self._blocks: Dict[str, Tuple[int, int, int]] = {}
+        self._dates: List[str] = []
+        self._mmap: Optional[mmap.mmap] = None
+        self._mapped_size = 0
+        self._load_index()
+
+    def _recover(self) -> None:
+        """
+        处理 compact 中途退出留下的临时文件: 只剩索引的临时文件说明归档已经替换、索引还没有替换，
+        此时旧索引与归档不一致，用临时文件 (替换前已 fsync) 完成替换；两个临时文件都在说明还没有替换，直接删除。
+        """
+        tmp_path, tmp_index = self.path + ".tmp", self.index_path + ".tmp"
+        if os.path.exists(tmp_index) and not os.path.exists(tmp_path):
+            log.warning("%s 上次压缩没有完成，使用压缩后的索引", self.path)
+            os.replace(tmp_index, self.index_path)
+            return
+        for path in (tmp_path, tmp_index):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _load_index(self) -> None:
+        self._recover()
+        if not os.path.exists(self.index_path):
+            return
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        with open(self.index_path) as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) != 4:
+                    # 写到一半的最后一行
+                    continue
+                date, offset, length, count = parts[0], int(parts[1]), int(parts[2]), int(parts[3])
+                if offset + length <= size:
+                    self._blocks[date] = (offset, length, count)
+        self._dates = sorted(self._blocks)
+
+    def dates(self) -> List[str]:
+        with self._lock:
+            return list(self._dates)
+
+    def __contains__(self, date: str) -> bool:
+        return date in self._blocks
+
+    def write_day(self, date: str, records: List[Dict]) -> None:
+        self.write_days({date: records})
+
+    def write_days(self, days: Dict[str, List[Dict]]) -> None:
+        """
+        追加多天的数据，已有的日期以新写入的为准，所有块写完后一次 fsync 再写索引。
+        """
+        if not days:
+            return
+        with self._lock:
+            entries = []
+            with open(self.path, "ab") as f:
+                offset = f.tell()
+                for date, records in days.items():
+                    data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+                    block = gzip.compress(data.encode("utf-8"), compresslevel=self.level, mtime=0)
+                    f.write(block)
+                    entries.append((date, offset, len(block), len(records)))
+                    offset += len(block)
+                f.flush()
+                os.fsync(f.fileno())
+            # 先写数据再写索引，中途失败时索引不会指向不完整的块
+            with open(self.index_path, "a") as f:
+                f.write("".join("{}\t{}\t{}\t{}\n".format(*entry) for entry in entries))
+                f.flush()
+                os.fsync(f.fileno())
+            for date, offset, length, count in entries:
+                self._blocks[date] = (offset, length, count)
+            self._dates = sorted(self._blocks)
+
+    def _view(self) -> Optional[mmap.mmap]:
+        # 文件变大后重新映射
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size == 0:
+            return None
+        if self._mmap is None or self._mapped_size < size:
+            if self._mmap is not None:
+                self._mmap.close()
+            with open(self.path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped_size = size
+        return self._mmap
+
+    def _read_block(self, date: str) -> bytes:
+        with self._lock:
+            offset, length, _ = self._blocks[date]
+            # 切片得到压缩块的副本，解压在锁外进行
+            block = self._view()[offset:offset + length]
+        return gzip.decompress(block)
+
+    def read_day(self, date: str) -> List[Dict]:
+        """
+        读取一天的记录，没有这一天时返回空列表。
+        """
+        if date not in self._blocks:
+            return []
+        return [json.loads(line) for line in self._read_block(date).decode("utf-8").splitlines() if line]
+
+    def range_dates(self, start: Optional[str] = None, end: Optional[str] = None) -> List[str]:
+        with self._lock:
+            low = bisect_left(self._dates, start) if start else 0
+            high = bisect_right(self._dates, end) if end else len(self._dates)
+            return self._dates[low:high]
+
+    def read_range(self, start: Optional[str] = None, end: Optional[str] = None) -> Dict[str, List[Dict]]:
+        """
+        读取 [start, end] 之间每天的记录，按日期排序。
+        """
+        return {date: self.read_day(date) for date in self.range_dates(start, end)}
+
+    def iter_records(self, start: Optional[str] = None, end: Optional[str] = None,
+                     chunk_size: int = 64 * 1024) -> Iterator[Dict]:
+        """
+        按日期顺序逐条返回 [start, end] 之间的记录，每次只解压 chunk_size 字节，内存占用与归档大小无关。
+        """
+        for date in self.range_dates(start, end):
+            with self._lock:
+                offset, length, _ = self._blocks[date]
+            decompressor = zlib.decompressobj(wbits=31)
+            pending = b""
+            for position in range(offset, offset + length, chunk_size):
+                with self._lock:
+                    chunk = self._view()[position:min(position + chunk_size, offset + length)]
+                lines = (pending + decompressor.decompress(chunk)).split(b"\n")
+                pending = lines.pop()
+                for line in lines:
+                    if line:
+                        yield json.loads(line)
+            pending += decompressor.flush()
+            if pending.strip():
+                yield json.loads(pending)
+
+    def compact(self) -> int:
+        """
+        重写归档，去掉被覆盖的旧块，返回减少的字节数。
+        """
+        with self._lock:
+            view = self._view()
+            if view is None:
+                return 0
+            size = self._mapped_size
+            tmp_path, tmp_index = self.path + ".tmp", self.index_path + ".tmp"
+            blocks, offset = {}, 0
+            with open(tmp_path, "wb") as f, open(tmp_index, "w") as index:
+                # 压缩块原样复制，不需要解压
+                for date in self._dates:
+                    old_offset, length, count = self._blocks[date]
+                    f.write(view[old_offset:old_offset + length])
+                    index.write("{}\t{}\t{}\t{}\n".format(date, offset, length, count))
+                    blocks[date] = (offset, length, count)
+                    offset += length
+                for file in (f, index):
+                    file.flush()
+                    os.fsync(file.fileno())
+            self._mmap.close()
+            self._mmap, self._mapped_size = None, 0
+            # 两次替换之间退出时，下次打开由 _recover 用 tmp_index 完成索引的替换
+            os.replace(tmp_path, self.path)
+            _fsync_dir(self.path)
+            os.replace(tmp_index, self.index_path)
+            self._blocks = blocks
+            return size - offset
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            live = sum(length for _, length, _ in self._blocks.values())
+            return {"days": len(self._blocks), "records": sum(count for _, _, count in self._blocks.values()),
+                    "live_bytes": live,
+                    "file_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap, self._mapped_size = None, 0
+
+
+def _fsync_dir(path: str) -> None:
+    # 保证目录中的替换先于后面的替换落盘
+    fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+_archives: Dict[str, Archive] = {}
+_lock = threading.Lock()
+
+
+def get_archive(table_name: str) -> Archive:
+    """
+    每个表一个归档，路径为 archive.dir/表名.jsonl.gz。
+    """
+    archive = _archives.get(table_name)
+    if archive is None:
+        with _lock:
+            archive = _archives.get(table_name)
+            if archive is None:
+                directory = get_value_from_yaml_or_env("archive.dir") or "../archive"
+                archive = Archive(os.path.join(directory, table_name + ".jsonl.gz"),
+                                  int(get_value_from_yaml_or_env("archive.level") or 6))
+                _archives[table_name] = archive
+    return archive
+
+
+class ArchiveSink(Sink):
+    """
+    存储目标 archive，每次写入一天或多天的完整数据。
+    """
+
+    row_level = False
+
+    def target(self) -> str:
+        return os.path.abspath(get_value_from_yaml_or_env("archive.dir") or "../archive")
+
+    def replace_day(self, table_name: str, date: str, records: List[Dict]) -> None:
+        get_archive(table_name).write_day(date, records)
+
+    def upsert(self, table_name: str, records: List[Dict]) -> None:
+        days: Dict[str, List[Dict]] = {}
+        for record in records:
+            days.setdefault(record["date"], []).append(record)
+        get_archive(table_name).write_days(days)
+
+
+def find_json_files(paths: Iterable[str]) -> List[Tuple[str, str]]:
+    """
+    找出目录或文件列表中的 json 文件，返回按日期排序的 (日期, 路径)，日期取文件名中的 8 位数字。
+    """
+    files = []
+    for path in paths:
+        names = [os.path.join(path, name) for name in os.listdir(path)] if os.path.isdir(path) else [path]
+        for name in names:
+            match = _DATE_PATTERN.search(os.path.basename(name))
+            if name.endswith(".json") and match:
+                files.append((match.group(1), name))
+    return sorted(files)
+
+
+def convert(archive: Archive, paths: Iterable[str], batch_days: int = 100) -> int:
+    """
+    把已有的 json 文件 (如 xwlb/content/20240413新闻联播共16条.json) 写入归档，返回写入的天数。
+    文件内容可以是记录列表，也可以是单条记录；同一天有多个文件时以后面的为准。
+    """
+    files = find_json_files(paths)
+    days: Dict[str, List[Dict]] = {}
+    written = 0
+    for i, (date, path) in enumerate(files):
+        with open(path) as f:
+            content = json.load(f)
+        days[date] = content if isinstance(content, list) else [content]
+        if len(days) >= batch_days or i == len(files) - 1:
+            archive.write_days(days)
+            written += len(days)
+            days = {}
+    log.info("转换 %d 个文件，写入 %d 天到 %s", len(files), written, archive.path)
+    return written
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="按天压缩的 JSONL 归档")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert_parser = subparsers.add_parser("convert", help="把已有的 json 文件写入归档")
+    convert_parser.add_argument("table", help="表名，如 tbl_xwlb")
+    convert_parser.add_argument("paths", nargs="+", help="json 文件或目录")
+    read_parser = subparsers.add_parser("read", help="按 JSONL 输出 [start, end] 之间的记录")
+    read_parser.add_argument("table")
+    read_parser.add_argument("start", nargs="?")
+    read_parser.add_argument("end", nargs="?")
+    compact_parser = subparsers.add_parser("compact", help="去掉被覆盖的旧块")
+    compact_parser.add_argument("table")
+    args = parser.parse_args()
+
+    target = get_archive(args.table)
+    if args.command == "convert":
+        convert(target, args.paths)
+    elif args.command == "read":
+        for item in target.iter_records(args.start, args.end):
+            print(json.dumps(item, ensure_ascii=False))
+    else:
+        log.info("压缩 %s，减少 %d 字节", target.path, target.compact())
+    log.info("%s: %s", target.path, target.stats())
@@ -0,0 +1,94 @@
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List
+from urllib.parse import urlsplit, parse_qs
+
+from common.config import get_value_from_yaml_or_env
+from common.jsonp import get_jsonp
+from common.video_info import get_tags
+
+"""
+    央视栏目列表接口 getVideoListByColumn (今日说法、焦点访谈)
+    接口支持 n (每页条数) 和 p (页码)，按时间倒序返回，结果包在 JSONP 回调中
+"""
+
+log = logging.getLogger(__name__)
+
+
+def get_callback(day_url: str) -> str:
+    # 回调函数名在 url 的 cb 或 callback 参数中，如 Callback、lanmu_0
+    query = parse_qs(urlsplit(day_url).query)
+    return (query.get("cb") or query.get("callback"))[0]
+
+
+def get_column_page(program: str, n: int = 1, p: int = 1) -> Dict:
+    """
+    获取栏目列表的一页。
+
+    参数:
+        program (str): 配置文件中的栏目名，jrsf 或 jdft。
+        n (int): 每页条数。
+        p (int): 页码，从 1 开始。
+
+    返回:
+        Dict: 接口返回的 data，包含 list 和 total。
+    """
+    day_url = get_value_from_yaml_or_env(program + ".day_url")
+    # 直接解析 Callback 中的 JSON，不经过 HTML 解析
+    return get_jsonp(day_url.format(n, p), get_callback(day_url))['data']
+
+
+def get_entry_date(entry: Dict) -> str:
+    # 播出日期，time 形如 2024-11-25 13:02:46，没有 time 时使用 focus_date (毫秒时间戳)
+    if entry.get("time"):
+        return entry["time"][:10].replace("-", "")
+    return datetime.fromtimestamp(int(entry["focus_date"]) / 1000).strftime("%Y%m%d")
+
+
+def to_record(entry: Dict, date: str, tags: str) -> Dict[str, str]:
+    return {
+        "date": date,
+        "title": entry['title'],
+        "image_url": entry['image'],
+        "content": entry['brief'],
+        "video_url": entry['url'],
+        "guid": entry['guid'],
+        "tags": tags
+    }
+
+
+def list_column(program: str, start: str, end: str) -> List[Dict[str, str]]:
+    """
+    按页拉取 [start, end] 之间每天的节目，一天有多条时取最新的一条。
+
+    参数:
+        program (str): 配置文件中的栏目名，jrsf 或 jdft。
+        start (str): 开始日期，格式为 yyyymmdd。
+        end (str): 结束日期 (包含)，格式为 yyyymmdd。
+
+    返回:
+        List[Dict[str, str]]: 按日期倒序的记录，格式与 get_content 相同。
+    """
+    page_size = int(get_value_from_yaml_or_env("column.page_size") or 100)
+    begin = time.perf_counter()
+
+    # 列表按时间倒序，翻到早于 start 的节目或最后一页为止
+    entries: Dict[str, Dict] = {}
+    page = 1
+    while True:
+        data = get_column_page(program, page_size, page)
+        items = data.get('list') or []
+        for entry in items:
+            date = get_entry_date(entry)
+            if start <= date <= end:
+                entries.setdefault(date, entry)
+        if len(items) < page_size or (items and get_entry_date(items[-1]) < start):
+            break
+        page += 1
+
+    tags = get_tags(entry['guid'] for entry in entries.values())
+    records = [to_record(entry, date, tags[entry['guid']]) for date, entry in entries.items()]
+    log.info("%s 拉取 %d 页，%s 到 %s 共 %d 期，耗时 %.2fs",
+             program, page, start, end, len(records), time.perf_counter() - begin)
+    return records
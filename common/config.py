@@ -1,6 +1,8 @@
 import logging
 import os
 import re
+import threading
+from typing import Any, Dict
 
 import yaml
 
@@ -36,35 +38,80 @@ yaml.SafeLoader.add_constructor('!env', env_var_constructor)
 yaml.SafeLoader.add_implicit_resolver('!env', pattern, None)
 
 
+class Config:
+    """
+    配置文件只在第一次使用和文件修改时间变化时解析，!env 占位符在解析时替换。
+    解析结果展开成 {"a.b.c": value} 的字典，按点号分隔的 key 取值是 O(1)。
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._mtime = None
+        self._values: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def get(self, props: str, default: Any = None) -> Any:
+        self._reload_if_changed()
+        return self._values.get(props, default)
+
+    def _reload_if_changed(self) -> None:
+        mtime = os.stat(self.file_path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            # 读取 YAML 文件
+            with open(self.file_path, "r") as f:
+                config = yaml.safe_load(f) or {}
+            values = {}
+            _flatten(config, "", values)
+            self._values = values
+            self._mtime = mtime
+            log.info("加载配置文件 %s", self.file_path)
+
+
+def _flatten(node: Any, prefix: str, values: Dict[str, Any]) -> None:
+    # 中间层级也保留，"mysql" 可以取到整个字典
+    if prefix:
+        values[prefix] = node
+    if isinstance(node, dict):
+        for key, value in node.items():
+            _flatten(value, "{}.{}".format(prefix, key) if prefix else str(key), values)
+
+
+_configs: Dict[str, Config] = {}
+_configs_lock = threading.Lock()
+
+
+def get_config(file_path: str = config_file_name) -> Config:
+    """
+    每个配置文件在进程内只有一个 Config 对象。
+    """
+    config = _configs.get(file_path)
+    if config is None:
+        with _configs_lock:
+            config = _configs.setdefault(file_path, Config(file_path))
+    return config
 
 
-def get_value_from_yaml_or_env(props: str, file_path: str = config_file_name) -> str:
+def get_value_from_yaml_or_env(props: str, file_path: str = config_file_name) -> Any:
     """
-    Get the value from YAML file based on the provided keys.
+    Get the value from YAML file based on the provided keys,
+    falling back to the environment variable named `props`.
 
     Parameters:
-        props (str): The keys to navigate through the YAML structure.
+        props (str): The keys to navigate through the YAML structure, separated by dots.
         file_path (str): The path to the YAML file.
 
     Returns:
         The value corresponding to the provided keys.
     """
-    # 读取 YAML 文件
-    with open(file_path, "r") as f:
-        config = yaml.safe_load(f)
-
-    # 使用点号分割字符串来得到键列表
-    keys = props.split(".")
-
-    # 逐级获取值
-    value = config
-    for key in keys:
-        value = value[key]
-
+    value = get_config(file_path).get(props)
     if value is not None:
         return value
     else:
-        os.getenv(props, None)
+        return os.getenv(props, None)
 
 
 if __name__ == "__main__":
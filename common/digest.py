@@ -0,0 +1,199 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, Iterable, List, Optional
+
+from common.config import get_value_from_yaml_or_env
+
+"""
+    记录内容的摘要 (hash)，用于跳过没有变化的写入和推送
+    - 每条记录按规范化后的字段计算摘要，按 存储目标 + 表 + 唯一键 保存在本地 SQLite 中
+    - 重新运行同一天时只写入新增、变化的记录，全部没变时不访问存储目标
+    - 推送的内容也记录摘要，内容没变时不重复推送
+"""
+
+log = logging.getLogger(__name__)
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(name: str, value) -> str:
+    """
+    规范化字段值: 统一 unicode 形式、合并空白；标签与顺序无关，去重后排序。
+    """
+    text = unicodedata.normalize("NFC", "" if value is None else str(value))
+    if name == "tags":
+        return " ".join(sorted(set(text.split())))
+    return _SPACES.sub(" ", text).strip()
+
+
+def record_key(record: Dict) -> str:
+    # 与表的唯一键一致: 新闻联播按 (date, id)，今日说法、焦点访谈按 date
+    return "{}/{}".format(record["date"], record["id"]) if "id" in record else str(record["date"])
+
+
+def record_digest(record: Dict) -> str:
+    normalized = {name: normalize(name, value) for name, value in record.items() if not name.startswith("_")}
+    return hashlib.blake2b(json.dumps(normalized, sort_keys=True, ensure_ascii=False).encode("utf-8"),
+                           digest_size=16).hexdigest()
+
+
+def text_digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class Changes:
+    """
+    一批记录和已保存摘要的比较结果，new / changed / unchanged 中是记录，removed 中是唯一键。
+    """
+
+    def __init__(self):
+        self.new: List[Dict] = []
+        self.changed: List[Dict] = []
+        self.unchanged: List[Dict] = []
+        self.removed: List[str] = []
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self.new or self.changed or self.removed)
+
+    def __str__(self) -> str:
+        return "新增 {}，变化 {}，未变 {}，删除 {}".format(
+            len(self.new), len(self.changed), len(self.unchanged), len(self.removed))
+
+
+class DigestIndex:
+
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("pragma journal_mode = wal")
+            self._conn.execute("create table if not exists record_digest ("
+                               "sink text not null, tbl text not null, key text not null, date text not null, "
+                               "digest text not null, updated_at real not null, primary key (sink, tbl, key))")
+            self._conn.execute("create index if not exists idx_record_digest_date on record_digest (sink, tbl, date)")
+            self._conn.execute("create table if not exists push_digest ("
+                               "channel text not null, date text not null, digest text not null, "
+                               "pushed_at real not null, primary key (channel, date))")
+        self.stats = {"new": 0, "changed": 0, "unchanged": 0, "removed": 0, "pushed": 0, "push_skipped": 0}
+
+    def _load(self, sink: str, table_name: str, dates: Iterable[str]) -> Dict[str, str]:
+        # {唯一键: 摘要}，按日期查询，一次最多 500 个日期
+        dates = list(dict.fromkeys(dates))
+        saved = {}
+        with self._lock:
+            for i in range(0, len(dates), 500):
+                chunk = dates[i:i + 500]
+                rows = self._conn.execute(
+                    "select key, digest from record_digest where sink = ? and tbl = ? and date in ({})".format(
+                        ", ".join("?" * len(chunk))), (sink, table_name, *chunk))
+                saved.update(rows)
+        return saved
+
+    def diff(self, sink: str, table_name: str, records: List[Dict], digests: List[str],
+             date: Optional[str] = None) -> Changes:
+        """
+        比较记录和已保存的摘要。
+
+        参数:
+            sink (str): 存储目标名和写入位置 (sink.digest_sink)，每个目标分别记录写入过的内容。
+            table_name (str): 表名。
+            records (List[Dict]): 要写入的记录。
+            digests (List[str]): 每条记录的摘要，与 records 一一对应。
+            date (str): 替换一天的数据时传入，这一天已保存但不在 records 中的记录算作删除。
+
+        返回:
+            Changes: 比较结果。
+        """
+        saved = self._load(sink, table_name, [date] if date else [record["date"] for record in records])
+        changes = Changes()
+        for record, digest in zip(records, digests):
+            key = record_key(record)
+            if key not in saved:
+                changes.new.append(record)
+            elif saved.pop(key) != digest:
+                changes.changed.append(record)
+            else:
+                changes.unchanged.append(record)
+        if date:
+            changes.removed = list(saved)
+        return changes
+
+    def commit(self, sink: str, table_name: str, records: List[Dict], digests: List[str],
+               date: Optional[str] = None) -> None:
+        """
+        写入成功后保存摘要，替换一天的数据时删除这一天其他的摘要。
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            if date:
+                self._conn.execute("delete from record_digest where sink = ? and tbl = ? and date = ?",
+                                   (sink, table_name, date))
+            self._conn.executemany(
+                "insert or replace into record_digest (sink, tbl, key, date, digest, updated_at) "
+                "values (?, ?, ?, ?, ?, ?)",
+                [(sink, table_name, record_key(record), str(record["date"]), digest, now)
+                 for record, digest in zip(records, digests)])
+
+    def should_push(self, channel: str, date: str, text: str) -> bool:
+        """
+        这一天推送过相同的内容时返回 False。
+        """
+        with self._lock:
+            row = self._conn.execute("select digest from push_digest where channel = ? and date = ?",
+                                     (channel, date)).fetchone()
+        changed = row is None or row[0] != text_digest(text)
+        self.count("pushed" if changed else "push_skipped")
+        return changed
+
+    def record_push(self, channel: str, date: str, text: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("insert or replace into push_digest (channel, date, digest, pushed_at) "
+                               "values (?, ?, ?, ?)", (channel, date, text_digest(text), time.time()))
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.stats[name] += value
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return bool(get_value_from_yaml_or_env("digest.enabled"))
+
+
+def get_index() -> DigestIndex:
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                _index = DigestIndex(get_value_from_yaml_or_env("digest.db"))
+    return _index
+
+
+def should_push(channel: str, date: str, text: str) -> bool:
+    return not enabled() or get_index().should_push(channel, date, text)
+
+
+def record_push(channel: str, date: str, text: str) -> None:
+    if enabled():
+        get_index().record_push(channel, date, text)
+
+
+def log_stats() -> None:
+    if _index is not None:
+        stats = _index.stats
+        log.info("内容摘要: 新增 %d 条，变化 %d 条，未变 %d 条，删除 %d 条；推送 %d 次，内容未变跳过 %d 次",
+                 stats["new"], stats["changed"], stats["unchanged"], stats["removed"],
+                 stats["pushed"], stats["push_skipped"])
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from common.time import get_current_time
+
+"""
+    HTTP 响应的磁盘缓存，由 http_client.get 使用，配置 http_cache.enabled 打开
+    - 以 url 为 key，响应内容压缩后存储，同时保存 ETag / Last-Modified
+    - 按 url 规则设置有效期，过期后带 If-None-Match / If-Modified-Since 重新验证
+    - 总大小超过上限时删除最久没有使用的文件
+"""
+
+log = logging.getLogger(__name__)
+
+# 需要保存的响应头
+_KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+
+class CacheEntry:
+
+    def __init__(self, url: str, meta: Dict, body: bytes):
+        self.url = url
+        self.meta = meta
+        self.body = body
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.meta["headers"].get("ETag"):
+            headers["If-None-Match"] = self.meta["headers"]["ETag"]
+        if self.meta["headers"].get("Last-Modified"):
+            headers["If-Modified-Since"] = self.meta["headers"]["Last-Modified"]
+        return headers
+
+    def to_response(self) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.url = self.url
+        response._content = self.body
+        response.headers = CaseInsensitiveDict(self.meta["headers"])
+        response.encoding = self.meta.get("encoding")
+        return response
+
+
+class HttpCache:
+
+    def __init__(self, directory: str, max_bytes: int, default_ttl: int, rules: List[Dict]):
+        """
+        参数:
+            directory (str): 缓存目录。
+            max_bytes (int): 缓存文件总大小上限。
+            default_ttl (int): 没有匹配规则的 url 的有效期 (秒)，0 表示不缓存。
+            rules (List[Dict]): 按顺序匹配的规则 {pattern, ttl, past_immutable}，ttl 为 -1 表示永不过期，
+                past_immutable 为 true 时 pattern 第一个分组是 yyyymmdd 日期，早于今天的页面永不过期。
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.rules = [(re.compile(rule["pattern"]), int(rule["ttl"]), bool(rule.get("past_immutable")))
+                      for rule in rules]
+        self._lock = threading.Lock()
+        # {文件路径: [大小, 最后使用时间]}，第一次写入时扫描目录
+        self._files: Optional[Dict[str, List[float]]] = None
+        self._total = 0
+        self.stats = {"hits": 0, "revalidated": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def ttl(self, url: str) -> int:
+        for pattern, ttl, past_immutable in self.rules:
+            match = pattern.search(url)
+            if match:
+                if past_immutable and match.group(1) < get_current_time()[0]:
+                    return -1
+                return ttl
+        return self.default_ttl
+
+    def lookup(self, url: str) -> Optional[CacheEntry]:
+        """
+        读取缓存，不存在或不缓存的 url 返回 None。
+        """
+        if self.ttl(url) == 0:
+            return None
+        path = self._path(url)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        header, _, body = data.partition(b"\n")
+        try:
+            meta = json.loads(header)
+            if meta["url"] != url:
+                return None
+            # is_fresh、conditional_headers 使用的字段，缺少时和内容损坏一样处理
+            if "stored_at" not in meta or not isinstance(meta.get("headers"), dict):
+                raise ValueError("缺少 stored_at 或 headers")
+            entry = CacheEntry(url, meta, zlib.decompress(body))
+        except (ValueError, TypeError, KeyError, zlib.error) as e:
+            # 写到一半或损坏的文件: 删除后当作没有缓存，重新请求
+            log.warning("缓存文件损坏，删除 %s: %s", path, e)
+            self._discard(path)
+            return None
+        self._touch(path)
+        return entry
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        ttl = self.ttl(entry.url)
+        return ttl < 0 or time.time() - entry.meta["stored_at"] < ttl
+
+    def revalidated(self, entry: CacheEntry, response: requests.Response) -> None:
+        """
+        服务端返回 304，更新存储时间和验证头，继续使用缓存的内容。
+        """
+        self.count("revalidated")
+        for header in ("ETag", "Last-Modified"):
+            if response.headers.get(header):
+                entry.meta["headers"][header] = response.headers[header]
+        self._write(entry.url, entry.meta, entry.body)
+
+    def store(self, url: str, response: requests.Response) -> None:
+        if response.status_code != 200 or self.ttl(url) == 0:
+            return
+        meta = {
+            "url": url,
+            "headers": {header: response.headers[header] for header in _KEPT_HEADERS if header in response.headers},
+            "encoding": response.encoding,
+        }
+        self.count("stores")
+        self._write(url, meta, response.content)
+
+    def _write(self, url: str, meta: Dict, body: bytes) -> None:
+        with self._lock:
+            self._load_files()
+        meta["stored_at"] = time.time()
+        data = json.dumps(meta, ensure_ascii=False).encode("utf-8") + b"\n" + zlib.compress(body)
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再替换，并发读取时不会读到一半的文件
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            old = self._files.get(path)
+            self._total += len(data) - (old[0] if old else 0)
+            self._files[path] = [len(data), time.time()]
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        # 按最后使用时间删除，直到总大小降到上限的 90%
+        for path, (size, _) in sorted(self._files.items(), key=lambda item: item[1][1]):
+            if self._total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            del self._files[path]
+            self._total -= size
+            self.stats["evictions"] += 1
+
+    def _discard(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            if self._files is not None and path in self._files:
+                self._total -= self._files.pop(path)[0]
+
+    def _load_files(self) -> None:
+        if self._files is not None:
+            return
+        self._files = {}
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                self._files[path] = [stat.st_size, stat.st_mtime]
+                self._total += stat.st_size
+
+    def _touch(self, path: str) -> None:
+        now = time.time()
+        with self._lock:
+            if self._files is not None and path in self._files:
+                self._files[path][1] = now
+        try:
+            os.utime(path, (now, now))
+        except FileNotFoundError:
+            pass
+
+    def _path(self, url: str) -> str:
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, key[:2], key + ".z")
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
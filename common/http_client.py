@@ -0,0 +1,189 @@
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+
+from common.config import get_value_from_yaml_or_env
+from common import metrics
+from common.http_cache import HttpCache
+
+"""
+    共享的 HTTP 客户端，所有模块都通过这里发请求
+    - 每个 host 一个连接池，keep-alive 复用连接，已建立的 TLS 连接也会被复用，不用重复握手
+    - Accept-Encoding 协商 gzip (安装了 brotli 时还有 br)
+    - 连接/读取超时、失败重试都从配置文件读取
+    - http_cache.enabled 打开时 GET 请求使用磁盘缓存，见 http_cache.py
+    注意: 文件不能命名为 http, 不然会和标准库冲突
+"""
+
+log = logging.getLogger(__name__)
+
+_session = None
+_lock = threading.Lock()
+# 全局和每个 host 的并发请求数限制，在第一次请求时按配置创建
+_global_limit = None
+_host_limits: Dict[str, threading.BoundedSemaphore] = {}
+# 磁盘缓存，False 表示没有打开
+_cache = None
+
+
+def _config(key: str, default):
+    value = get_value_from_yaml_or_env("http." + key)
+    return default if value is None else value
+
+
+def get_session() -> requests.Session:
+    """
+    获取进程内共享的 Session，第一次调用时创建。
+    """
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _create_session()
+    return _session
+
+
+def _create_session() -> requests.Session:
+    retry = Retry(total=int(_config("retries", 3)),
+                  backoff_factor=float(_config("backoff_factor", 0.5)),
+                  status_forcelist=(429, 500, 502, 503, 504))
+    # pool_connections 是缓存的 host 连接池个数，pool_maxsize 是每个 host 保持的连接数
+    adapter = HTTPAdapter(pool_connections=int(_config("pool_connections", 32)),
+                          pool_maxsize=int(_config("pool_maxsize", 16)),
+                          max_retries=retry)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({
+        "Connection": "keep-alive",
+        # urllib3 能解码的压缩方式，安装了 brotli 时包含 br
+        "Accept-Encoding": ACCEPT_ENCODING,
+    })
+    return session
+
+
+@contextmanager
+def _limit(url: str) -> Iterator[None]:
+    """
+    限制同时进行的请求数: http.max_concurrency 是全局上限，http.per_host_concurrency 是每个 host 的上限，
+    <= 0 表示不限制。
+    """
+    global _global_limit
+    host = urlsplit(url).netloc
+    if _global_limit is None or host not in _host_limits:
+        with _lock:
+            if _global_limit is None:
+                _global_limit = _semaphore(int(_config("max_concurrency", 0)))
+            if host not in _host_limits:
+                _host_limits[host] = _semaphore(int(_config("per_host_concurrency", 0)))
+    global_limit, host_limit = _global_limit, _host_limits[host]
+    with global_limit, host_limit:
+        yield
+
+
+class _Unlimited:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def _semaphore(size: int):
+    return threading.BoundedSemaphore(size) if size > 0 else _Unlimited()
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    发起请求，未指定 timeout 时使用配置文件中的 (连接超时, 读取超时)。
+    """
+    kwargs.setdefault("timeout", (float(_config("connect_timeout", 5)), float(_config("read_timeout", 15))))
+    with _limit(url), metrics.span("http_request", host=urlsplit(url).netloc, method=method):
+        return get_session().request(method, url, **kwargs)
+
+
+def get_cache() -> Optional[HttpCache]:
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                if get_value_from_yaml_or_env("http_cache.enabled"):
+                    _cache = HttpCache(get_value_from_yaml_or_env("http_cache.dir"),
+                                       int(get_value_from_yaml_or_env("http_cache.max_bytes")),
+                                       int(get_value_from_yaml_or_env("http_cache.default_ttl") or 0),
+                                       get_value_from_yaml_or_env("http_cache.rules") or [])
+                else:
+                    _cache = False
+    return _cache or None
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    cache = get_cache()
+    if cache is None or cache.ttl(url) == 0:
+        return request("GET", url, **kwargs)
+
+    entry = cache.lookup(url)
+    if entry is not None and cache.is_fresh(entry):
+        cache.count("hits")
+        return entry.to_response()
+
+    # 缓存过期，带上验证头重新请求
+    if entry is not None:
+        kwargs["headers"] = {**entry.conditional_headers(), **(kwargs.get("headers") or {})}
+    response = request("GET", url, **kwargs)
+    if entry is not None and response.status_code == 304:
+        cache.revalidated(entry, response)
+        return entry.to_response()
+
+    cache.count("misses")
+    cache.store(url, response)
+    return response
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def get_pool_stats() -> Dict[str, Dict[str, int]]:
+    """
+    每个 host 的连接复用情况。
+
+    返回:
+        Dict[str, Dict[str, int]]: {host: {"requests": 请求数, "connections": 新建连接数, "reused": 复用次数}}
+    """
+    stats = {}
+    if _session is None:
+        return stats
+
+    for adapter in set(_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            host = "{}://{}".format(key.key_scheme, key.key_host)
+            if key.key_port:
+                host += ":{}".format(key.key_port)
+            stats[host] = {
+                "requests": pool.num_requests,
+                "connections": pool.num_connections,
+                "reused": max(pool.num_requests - pool.num_connections, 0),
+            }
+    return stats
+
+
+def log_stats() -> None:
+    for host, stat in get_pool_stats().items():
+        log.info("%s 请求 %d 次，新建连接 %d 个，复用 %d 次",
+                 host, stat["requests"], stat["connections"], stat["reused"])
+    cache = get_cache()
+    if cache is not None:
+        log.info("http 缓存命中 %d 次，重新验证 %d 次，未命中 %d 次，写入 %d 次，淘汰 %d 个",
+                 cache.stats["hits"], cache.stats["revalidated"], cache.stats["misses"],
+                 cache.stats["stores"], cache.stats["evictions"])
@@ -0,0 +1,288 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from io import BytesIO
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image
+
+from common import http_client, metrics
+from common.config import get_value_from_yaml_or_env
+
+"""
+    章节图片的缩略图 (WebP / JPEG)
+    - 多线程并发下载原图，在进程池中缩放、编码，不受 GIL 限制
+    - 按原图内容的 sha256 保存，url → sha256 记录在 SQLite 中，已经处理过的 url 不再下载
+    - 总大小超过 image.max_bytes 时删除最久没有使用的文件
+    - 发布到 WordPress 时上传 wordpress.image_variant 指定的缩略图 (wordpress/media.py)，不再上传原图
+"""
+
+log = logging.getLogger(__name__)
+
+_EXTENSIONS = {"webp": "webp", "jpeg": "jpg", "png": "png"}
+
+
+def make_derivatives(data: bytes, variants: List[Dict]) -> Dict[str, bytes]:
+    """
+    生成缩略图，在子进程中执行，参数和返回值都是可以 pickle 的简单类型。
+
+    参数:
+        data (bytes): 原图内容。
+        variants (List[Dict]): [{name, width, format, quality}]，宽度超过 width 时等比缩小。
+
+    返回:
+        Dict[str, bytes]: {name: 缩略图内容}。
+    """
+    results = {}
+    if not variants:
+        return results
+    image = Image.open(BytesIO(data))
+    # JPEG 解码时直接按接近最大缩略图的比例缩小，比解码完整图片再缩放快很多
+    largest = max(int(variant["width"]) for variant in variants)
+    image.draft("RGB", (largest, largest * image.height // max(image.width, 1)))
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    # 从大到小生成，只解码一次
+    for variant in sorted(variants, key=lambda v: -int(v["width"])):
+        width = int(variant["width"])
+        if image.width > width:
+            image = image.resize((width, max(width * image.height // image.width, 1)), Image.LANCZOS,
+                                 reducing_gap=2.0)
+        buffer = BytesIO()
+        image.save(buffer, format=variant["format"].upper(), quality=int(variant.get("quality") or 80),
+                   optimize=variant["format"].lower() == "jpeg")
+        results[variant["name"]] = buffer.getvalue()
+    return results
+
+
+class ImageStore:
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, "images.db"), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("pragma journal_mode = wal")
+            self._conn.execute("create table if not exists image ("
+                               "url text primary key, sha256 text not null, size integer not null)")
+        # {文件路径: [大小, 最后使用时间]}，第一次写入时扫描目录
+        self._files: Optional[Dict[str, List[float]]] = None
+        self._total = 0
+        self.stats = {"cached": 0, "fetched": 0, "generated": 0, "failed": 0, "evictions": 0,
+                      "fetched_bytes": 0, "generated_bytes": 0}
+
+    def path(self, sha256: str, variant: Dict) -> str:
+        return os.path.join(self.directory, sha256[:2],
+                            "{}_{}.{}".format(sha256, variant["name"], _EXTENSIONS[variant["format"].lower()]))
+
+    def lookup(self, url: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("select sha256 from image where url = ?", (url,)).fetchone()
+        return row[0] if row else None
+
+    def remember(self, url: str, sha256: str, size: int) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("insert or replace into image (url, sha256, size) values (?, ?, ?)",
+                               (url, sha256, size))
+
+    def get(self, sha256: str, variants: List[Dict]) -> Optional[Dict[str, str]]:
+        """
+        所有缩略图都存在时返回 {name: 路径}，并更新最后使用时间。
+        """
+        paths = {variant["name"]: self.path(sha256, variant) for variant in variants}
+        if not all(os.path.exists(path) for path in paths.values()):
+            return None
+        now = time.time()
+        for path in paths.values():
+            with self._lock:
+                if self._files is not None and path in self._files:
+                    self._files[path][1] = now
+            try:
+                os.utime(path, (now, now))
+            except FileNotFoundError:
+                return None
+        return paths
+
+    def put(self, sha256: str, variants: List[Dict], derivatives: Dict[str, bytes]) -> Dict[str, str]:
+        with self._lock:
+            self._load_files()
+        paths = {}
+        for variant in variants:
+            path = self.path(sha256, variant)
+            data = derivatives[variant["name"]]
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再替换，不会读到写了一半的文件
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            paths[variant["name"]] = path
+            with self._lock:
+                old = self._files.get(path)
+                self._total += len(data) - (old[0] if old else 0)
+                self._files[path] = [len(data), time.time()]
+                self.stats["generated_bytes"] += len(data)
+        with self._lock:
+            if self._total > self.max_bytes:
+                self._evict()
+        return paths
+
+    def _evict(self) -> None:
+        # 按最后使用时间删除，直到总大小降到上限的 90%
+        for path, (size, _) in sorted(self._files.items(), key=lambda item: item[1][1]):
+            if self._total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            del self._files[path]
+            self._total -= size
+            self.stats["evictions"] += 1
+
+    def _load_files(self) -> None:
+        if self._files is not None:
+            return
+        self._files = {}
+        for root, _, names in os.walk(self.directory):
+            if root == self.directory:
+                # 根目录下只有 images.db
+                continue
+            for name in names:
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                self._files[path] = [stat.st_size, stat.st_mtime]
+                self._total += stat.st_size
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.stats[name] += value
+
+
+_store = None
+_processes = None
+_lock = threading.Lock()
+
+
+def get_store() -> ImageStore:
+    global _store
+    if _store is None:
+        with _lock:
+            if _store is None:
+                _store = ImageStore(get_value_from_yaml_or_env("image.dir"),
+                                    int(get_value_from_yaml_or_env("image.max_bytes") or 1 << 30))
+    return _store
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    # 进程池在第一次使用时创建，常驻运行时一直复用
+    global _processes
+    if _processes is None:
+        with _lock:
+            if _processes is None:
+                # 不能 fork: 常驻运行时进程中有其他线程 (连接池、推送队列、metrics) 持有的锁，fork 出的子进程可能死锁
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                _processes = ProcessPoolExecutor(
+                    max_workers=int(get_value_from_yaml_or_env("image.processes") or 0) or os.cpu_count(),
+                    mp_context=multiprocessing.get_context(method))
+    return _processes
+
+
+def get_variants() -> List[Dict]:
+    return get_value_from_yaml_or_env("image.variants") or []
+
+
+def process_images(image_urls: Iterable[str], workers: int = None,
+                   pool: Executor = None) -> Dict[str, Dict[str, str]]:
+    """
+    下载图片并生成缩略图。
+
+    参数:
+        image_urls (Iterable[str]): 图片 url，可以重复。
+        workers (int): 下载线程数，默认读取 image.fetch_workers。
+        pool (Executor): 生成缩略图的进程池，默认使用共享的进程池。
+
+    返回:
+        Dict[str, Dict[str, str]]: {url: {缩略图名: 本地路径}}，失败的图片不在结果中。
+    """
+    store = get_store()
+    variants = get_variants()
+    pool = pool or get_process_pool()
+    urls = list(dict.fromkeys(image_urls))
+    workers = workers or int(get_value_from_yaml_or_env("image.fetch_workers") or 8)
+    begin = time.perf_counter()
+    results = {}
+
+    # 已经处理过的 url 不需要下载
+    pending = []
+    for url in urls:
+        sha256 = store.lookup(url)
+        paths = store.get(sha256, variants) if sha256 else None
+        if paths is not None:
+            results[url] = paths
+            store.count("cached")
+        else:
+            pending.append(url)
+
+    def fetch(url: str):
+        response = http_client.get(url)
+        if response.status_code != 200:
+            raise Exception(f"无法下载图片: {response.status_code}")
+        return response.content
+
+    # 下载完成一张就提交一张到进程池，下载和生成缩略图同时进行
+    generating: Dict[str, Tuple[Future, List[str]]] = {}
+    with ThreadPoolExecutor(max_workers=max(min(workers, len(pending)), 1), thread_name_prefix="image") as executor:
+        fetch = metrics.bind(fetch)
+        futures = {executor.submit(fetch, url): url for url in pending}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                data = future.result()
+            except Exception as e:
+                store.count("failed")
+                log.error("下载图片失败 %s: %s", url, e)
+                continue
+            store.count("fetched")
+            store.count("fetched_bytes", len(data))
+            sha256 = hashlib.sha256(data).hexdigest()
+            store.remember(url, sha256, len(data))
+            # 不同 url 的相同图片只生成一次
+            paths = store.get(sha256, variants)
+            if paths is not None:
+                results[url] = paths
+            elif sha256 in generating:
+                generating[sha256][1].append(url)
+            else:
+                generating[sha256] = (pool.submit(make_derivatives, data, variants), [url])
+
+    for sha256, (future, same_urls) in generating.items():
+        try:
+            paths = store.put(sha256, variants, future.result())
+            store.count("generated")
+            for url in same_urls:
+                results[url] = paths
+        except Exception as e:
+            store.count("failed")
+            log.error("生成缩略图失败 %s: %s", same_urls[0], e)
+
+    elapsed = time.perf_counter() - begin
+    log.info("处理图片 %d 张 (本地已有 %d 张，新生成 %d 张)，耗时 %.2fs，%.1f 张/秒",
+             len(results), len(urls) - len(pending), len(generating), elapsed, len(urls) / max(elapsed, 1e-9))
+    return results
+
+
+def log_stats() -> None:
+    if _store is not None:
+        stats = _store.stats
+        log.info("图片: 本地已有 %d 张，下载 %d 张 (%.1f MB)，生成 %d 张 (%.1f MB)，失败 %d 张，淘汰 %d 个文件",
+                 stats["cached"], stats["fetched"], stats["fetched_bytes"] / 1048576, stats["generated"],
+                 stats["generated_bytes"] / 1048576, stats["failed"], stats["evictions"])
@@ -0,0 +1,78 @@
+import json
+import logging
+import re
+from typing import Any
+
+from common import http_client
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+"""
+    JSONP 接口 (如 getVideoListByColumn 返回的 Callback({...}); ) 的解析
+    直接在响应的原始字节上去掉回调函数，不经过 HTML 解析；安装了 orjson 时用 orjson 解码
+"""
+
+log = logging.getLogger(__name__)
+
+# 合法的回调函数名，允许 a.b 形式
+_CALLBACK_PATTERN = re.compile(r'^[A-Za-z_$][\w$]*(\.[A-Za-z_$][\w$]*)*$')
+
+
+class JsonpError(ValueError):
+    """
+    JSONP 响应格式不正确。
+    """
+
+
+def loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def parse_jsonp(raw: bytes, callback: str) -> Any:
+    """
+    去掉回调函数，解析其中的 JSON。
+
+    参数:
+        raw (bytes): 响应的原始内容，如 b'Callback({"data": ...});'。
+        callback (str): 回调函数名。
+
+    返回:
+        Any: 解析后的 JSON。
+    """
+    if not _CALLBACK_PATTERN.match(callback):
+        raise JsonpError(f"回调函数名不合法: {callback!r}")
+
+    # 去掉 BOM 和首尾空白，结尾的分号可有可无
+    body = raw.strip()
+    if body.startswith(b'\xef\xbb\xbf'):
+        body = body[3:].lstrip()
+    prefix = callback.encode("utf-8") + b'('
+    if not body.startswith(prefix):
+        raise JsonpError(f"响应不是以 {callback}( 开头: {body[:80]!r}")
+    if body.endswith(b';'):
+        body = body[:-1].rstrip()
+    if not body.endswith(b')'):
+        raise JsonpError(f"响应没有以 ) 结尾: {body[-80:]!r}")
+
+    payload = body[len(prefix):-1]
+    try:
+        return loads(payload)
+    except ValueError as e:
+        raise JsonpError(f"{callback} 中的 JSON 解析失败: {e}，内容: {payload[:80]!r}") from e
+
+
+def get_jsonp(url: str, callback: str) -> Any:
+    """
+    请求 JSONP 接口并返回解析后的 JSON。
+    """
+    response = http_client.get(url)
+    try:
+        return parse_jsonp(response.content, callback)
+    except JsonpError:
+        log.error("JSONP 响应格式不正确 %s (status=%s)", url, response.status_code)
+        raise
@@ -0,0 +1,321 @@
+import bisect
+import contextvars
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from common.config import get_value_from_yaml_or_env
+
+"""
+    各阶段的耗时统计和每次运行的 trace
+    - with metrics.span("parse_html"): ... 或 @metrics.timed() 记录一次耗时，写入直方图 news_span_seconds{span="..."}，
+      抛出异常时 news_span_errors_total 加一；metrics.inc 记录计数 news_<name>_total
+    - Prometheus 文本格式: 每次运行结束时写入 metrics.file (可以用 node_exporter 的 textfile 收集)，
+      metrics.port > 0 时在 http://host:port/metrics 提供 (常驻运行时使用)
+    - with metrics.trace("xwlb", date=...): 记录这次运行中结束的 span，结束时写入 metrics.trace_dir 下的 JSON 文件；
+      当前的 trace 保存在 contextvars 中，同时进行的运行 (如今日说法和焦点访谈) 互不影响，
+      提交到线程池的函数用 metrics.bind 包装 (或 contextvars.copy_context().run) 后才会记录到提交时的 trace
+    - metrics.enabled 为 false 时 span 返回同一个空的上下文，timed 只多一次判断，不记录任何数据
+    enabled、port 在第一次使用时读取，修改后需要重启
+"""
+
+log = logging.getLogger(__name__)
+
+PREFIX = "news_"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# 当前线程 (或 context) 所在的 trace，没有时为 None
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("metrics_trace", default=None)
+
+
+class Trace:
+
+    def __init__(self, job: str, labels: Dict[str, str]):
+        self.job = job
+        self.labels = labels
+        self.started_at = datetime.now()
+        self.begin = time.perf_counter()
+        self.events: List[Dict] = []
+        # 结束后仍在后台执行的 span (如超时的写入) 不再记录
+        self.finished = False
+
+
+class Registry:
+    """
+    进程内所有 span 的直方图和计数，写入时加锁。
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(float(bucket) for bucket in buckets))
+        self._lock = threading.Lock()
+        # {(span, labels): [每个区间的次数 (最后一个是 +Inf), 总耗时]}
+        self._histograms: Dict[Tuple[str, Labels], List[float]] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+
+    def observe(self, name: str, labels: Labels, start: float, duration: float, error: Optional[type]) -> None:
+        index = bisect.bisect_left(self.buckets, duration)
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[(name, labels)] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += duration
+            if error is not None:
+                key = ("span_errors", (("span", name),) + labels)
+                self._counters[key] = self._counters.get(key, 0) + 1
+            current = _current_trace.get()
+            if current is not None and not current.finished:
+                current.events.append({
+                    "span": name,
+                    "labels": dict(labels),
+                    "thread": threading.current_thread().name,
+                    "start_ms": round((start - current.begin) * 1000, 3),
+                    "duration_ms": round(duration * 1000, 3),
+                    "error": error.__name__ if error is not None else None,
+                })
+
+    def inc(self, name: str, labels: Labels, value: float) -> None:
+        with self._lock:
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + value
+
+    def finish_trace(self, trace: Trace) -> Dict:
+        with self._lock:
+            trace.finished = True
+            events = list(trace.events)
+        summary: Dict[str, Dict] = {}
+        for event in events:
+            item = summary.setdefault(event["span"], {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+            item["count"] += 1
+            item["errors"] += event["error"] is not None
+            item["total_ms"] = round(item["total_ms"] + event["duration_ms"], 3)
+            item["max_ms"] = max(item["max_ms"], event["duration_ms"])
+        return {
+            "job": trace.job,
+            "labels": trace.labels,
+            "started_at": trace.started_at.isoformat(timespec="seconds"),
+            "duration_ms": round((time.perf_counter() - trace.begin) * 1000, 3),
+            "summary": summary,
+            "events": sorted(events, key=lambda event: event["start_ms"]),
+        }
+
+    def render(self) -> str:
+        """
+        Prometheus 文本格式。
+        """
+        with self._lock:
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+            counters = dict(self._counters)
+        lines = ["# HELP {0}span_seconds 各阶段的耗时".format(PREFIX), "# TYPE {0}span_seconds histogram".format(PREFIX)]
+        bounds = [_format_number(bucket) for bucket in self.buckets] + ["+Inf"]
+        for (name, labels), histogram in sorted(histograms.items()):
+            base = (("span", name),) + labels
+            total = 0
+            for bound, count in zip(bounds, histogram):
+                total += count
+                lines.append("{}span_seconds_bucket{} {}".format(PREFIX, _format_labels(base + (("le", bound),)), total))
+            lines.append("{}span_seconds_sum{} {}".format(PREFIX, _format_labels(base), _format_number(histogram[-1])))
+            lines.append("{}span_seconds_count{} {}".format(PREFIX, _format_labels(base), total))
+        for counter in sorted({name for name, _ in counters}):
+            lines.append("# TYPE {}{}_total counter".format(PREFIX, counter))
+            for (name, labels), value in sorted(counters.items()):
+                if name == counter:
+                    lines.append("{}{}_total{} {}".format(PREFIX, name, _format_labels(labels), _format_number(value)))
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"')
+                                           .replace("\n", "\\n")) for key, value in labels) + "}"
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Span:
+    __slots__ = ("registry", "name", "labels", "start")
+
+    def __init__(self, registry: Registry, name: str, labels: Labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.registry.observe(self.name, self.labels, self.start, time.perf_counter() - self.start, exc_type)
+        return False
+
+
+class _NoopSpan:
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NOOP = _NoopSpan()
+# None 表示还没有读取配置，False 表示没有启用
+_registry = None
+_lock = threading.Lock()
+
+
+def get_registry() -> Optional[Registry]:
+    global _registry
+    if _registry is None:
+        with _lock:
+            if _registry is None:
+                if get_value_from_yaml_or_env("metrics.enabled"):
+                    registry = Registry(get_value_from_yaml_or_env("metrics.buckets") or DEFAULT_BUCKETS)
+                    port = int(get_value_from_yaml_or_env("metrics.port") or 0)
+                    if port > 0:
+                        _serve(registry, get_value_from_yaml_or_env("metrics.host") or "127.0.0.1", port)
+                    _registry = registry
+                else:
+                    _registry = False
+    return _registry or None
+
+
+def span(name: str, **labels):
+    """
+    记录 with 块的耗时，labels 的取值应该是有限的几种 (如 host、表名)，不要使用 url 等。
+    """
+    registry = _registry if _registry is not None else get_registry()
+    if not registry:
+        return _NOOP
+    return _Span(registry, name, tuple(sorted((key, str(value)) for key, value in labels.items())))
+
+
+def timed(name: Optional[str] = None) -> Callable:
+    """
+    记录函数每次调用的耗时，span 名默认为函数名。
+    """
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            registry = _registry if _registry is not None else get_registry()
+            if not registry:
+                return func(*args, **kwargs)
+            with _Span(registry, span_name, ()):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind(func: Callable) -> Callable:
+    """
+    返回在当前 context 中执行 func 的函数，提交到线程池后 span 仍记录到提交时的 trace；没有 trace 时返回 func。
+    """
+    if _current_trace.get() is None:
+        return func
+    context = contextvars.copy_context()
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        # 同一个 Context 不能同时在多个线程中进入，每次调用使用一份副本
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    registry = _registry if _registry is not None else get_registry()
+    if registry:
+        registry.inc(name, tuple(sorted((key, str(label)) for key, label in labels.items())), value)
+
+
+@contextmanager
+def trace(job: str, **labels) -> Iterator[None]:
+    """
+    记录一次运行，结束时写入 trace 文件和 Prometheus 文本文件。
+    """
+    registry = get_registry()
+    if registry is None:
+        yield
+        return
+    current = Trace(job, {key: str(value) for key, value in labels.items()})
+    token = _current_trace.set(current)
+    try:
+        yield
+    finally:
+        _current_trace.reset(token)
+        result = registry.finish_trace(current)
+        try:
+            _write_trace(result)
+            write_file(registry)
+        except OSError as e:
+            log.error("写入 trace 失败: %s", e)
+
+
+def _write_trace(result: Dict) -> None:
+    trace_dir = get_value_from_yaml_or_env("metrics.trace_dir")
+    if not trace_dir:
+        return
+    os.makedirs(trace_dir, exist_ok=True)
+    name = "_".join([result["job"], *result["labels"].values(),
+                     result["started_at"].replace(":", "").replace("-", "")]) + ".json"
+    path = os.path.join(trace_dir, name)
+    _atomic_write(path, json.dumps(result, ensure_ascii=False, indent=1))
+    slowest = sorted(result["summary"].items(), key=lambda item: item[1]["total_ms"], reverse=True)[:5]
+    log.info("trace 写入 %s，%d 个 span，耗时最多: %s", path, len(result["events"]),
+             ", ".join("{} {:.0f}ms/{}次".format(name, item["total_ms"], item["count"]) for name, item in slowest))
+
+
+def write_file(registry: Optional[Registry] = None) -> None:
+    """
+    把当前的统计写入 metrics.file，先写临时文件再替换，收集程序不会读到一半的内容。
+    """
+    registry = registry or get_registry()
+    path = get_value_from_yaml_or_env("metrics.file")
+    if registry is None or not path:
+        return
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    _atomic_write(path, registry.render())
+
+
+def _atomic_write(path: str, text: str) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _serve(registry: Registry, host: str, port: int) -> None:
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            body = registry.render().encode("utf-8") if self.path.split("?")[0] == "/metrics" else b""
+            self.send_response(200 if body else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    log.info("Prometheus 指标: http://%s:%d/metrics", host, port)
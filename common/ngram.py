@@ -0,0 +1,41 @@
+import re
+from typing import Iterator, Optional, Tuple
+
+"""
+    全文索引的切分方式，SQLite 的 FTS5 索引 (sqlite/sqlite.py) 和倒排索引 (common/ngram_index.py) 共用
+    - 中文按相邻两个字 (二元组) 切分，每段中文的最后一个字也作为一个词，单个汉字按前缀查询时才能找到
+    - 字母和数字按词切分，转成小写
+    - 修改切分方式后两种索引都需要重新生成
+"""
+
+_CJK = r"\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_TOKEN_PATTERN = re.compile(r"[{}]+|[A-Za-z0-9]+".format(_CJK))
+_CJK_PATTERN = re.compile(r"[{}]".format(_CJK))
+
+
+def tokenize(text: Optional[str], query: bool = False) -> Iterator[Tuple[str, int]]:
+    """
+    切分文本，返回 (词, 字符偏移)。
+    query 为 True 时最后一段中文不加最后一个字，文本中这段后面可能还有其他字。
+    """
+    matches = list(_TOKEN_PATTERN.finditer(text or ""))
+    for i, match in enumerate(matches):
+        word, start = match.group(0), match.start()
+        if _CJK_PATTERN.match(word):
+            for j in range(len(word) - 1):
+                yield word[j:j + 2], start + j
+            if len(word) == 1 or not (query and i == len(matches) - 1):
+                yield word[-1], start + len(word) - 1
+        else:
+            yield word.lower(), start
+
+
+def to_ngrams(text: Optional[str], query: bool = False) -> str:
+    """
+    切分成空格分隔的词。
+    """
+    return " ".join(term for term, _ in tokenize(text, query))
+
+
+def is_single_cjk(term: str) -> bool:
+    return len(term) == 1 and _CJK_PATTERN.match(term) is not None
@@ -0,0 +1,559 @@
+import heapq
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from common.config import get_value_from_yaml_or_env
+from common.digest import record_key
+from common.ngram import is_single_cjk, tokenize
+from common.sink import Sink
+
+"""
+    按字切分的倒排索引，查询 "哪几天提到了 X"，不依赖数据库，可以用归档或导出的数据建立
+    - 切分方式见 common/ngram.py，位置为字符偏移
+    - 每个词的倒排表: 文档 id 差值、位置个数、位置差值，都用 varint 编码
+    - 每次 flush 写入一个段文件，段内词典按字节排序，用 mmap 读取并二分查找；段数超过上限时合并
+    - 重新写入一天时旧文档标记为删除，查询时过滤；合并段时去掉已删除的文档，剩下的文档重新编号
+    目录结构:
+        MANIFEST        段文件列表、文档日志文件名和已提交的行数
+        docs.log        每次 flush 一行: 新增的文档 [id, 表名, 唯一键, 日期] 和删除的文档 id，
+                        合并后换成新的 docs_NNNNNN.log，第一行是重新编号后的全部文档
+        seg_NNNNNN.idx  段文件
+"""
+
+log = logging.getLogger(__name__)
+
+# 建立索引的字段，不同字段之间用换行分隔，短语不会跨字段匹配
+FIELDS = ("title", "abstract", "content", "tags")
+
+# 段文件头: 标识、词数、词条表偏移、词文本偏移
+_HEADER = struct.Struct("<4sIQQ")
+_MAGIC = b"NGX1"
+# 词条: 词文本偏移、词文本长度、倒排表偏移、倒排表长度、文档数、第一个文档 id、最后一个文档 id
+_ENTRY = struct.Struct("<IHQIIII")
+
+
+def record_text(record: Dict) -> str:
+    return "\n".join(str(record[field]) for field in FIELDS if record.get(field))
+
+
+def encode_varint(value: int, out: bytearray) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint(data, position: int) -> Tuple[int, int]:
+    """
+    返回 (值, 下一个位置)。
+    """
+    value, shift = 0, 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def decode_postings(data: bytes, accept=None) -> Dict[int, List[int]]:
+    """
+    解码倒排表，返回 {文档 id: [位置]}；accept(文档 id) 为 False 的文档只跳过，不解码位置。
+    """
+    result = {}
+    doc, position, end = 0, 0, len(data)
+    while position < end:
+        delta, position = decode_varint(data, position)
+        doc += delta
+        count, position = decode_varint(data, position)
+        if accept is not None and not accept(doc):
+            # 跳过 count 个 varint
+            while count:
+                if data[position] < 0x80:
+                    count -= 1
+                position += 1
+            continue
+        positions, offset = [], 0
+        for _ in range(count):
+            delta, position = decode_varint(data, position)
+            offset += delta
+            positions.append(offset)
+        result[doc] = positions
+    return result
+
+
+class Segment:
+    """
+    只读的段文件，词典和倒排表都直接从 mmap 中读取。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self._entries_offset, self._terms_offset = _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"不是索引段文件: {path}")
+
+    def _entry(self, i: int) -> tuple:
+        return _ENTRY.unpack_from(self._mmap, self._entries_offset + i * _ENTRY.size)
+
+    def _term(self, entry: tuple) -> bytes:
+        return self._mmap[self._terms_offset + entry[0]:self._terms_offset + entry[0] + entry[1]]
+
+    def _lower_bound(self, term: bytes) -> int:
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._term(self._entry(middle)) < term:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self, term: bytes) -> Optional[tuple]:
+        i = self._lower_bound(term)
+        if i < self.count:
+            entry = self._entry(i)
+            if self._term(entry) == term:
+                return entry
+        return None
+
+    def prefix(self, prefix: bytes) -> Iterator[tuple]:
+        for i in range(self._lower_bound(prefix), self.count):
+            entry = self._entry(i)
+            if not self._term(entry).startswith(prefix):
+                break
+            yield entry
+
+    def postings(self, entry: tuple) -> bytes:
+        return self._mmap[entry[2]:entry[2] + entry[3]]
+
+    def terms(self) -> Iterator[Tuple[bytes, tuple]]:
+        for i in range(self.count):
+            entry = self._entry(i)
+            yield self._term(entry), entry
+
+    def size(self) -> int:
+        return len(self._mmap)
+
+    def close(self) -> None:
+        self._mmap.close()
+
+
+def write_segment(path: str, terms: Iterable[Tuple[bytes, bytes, int, int, int]]) -> None:
+    """
+    写入段文件，terms 按词的字节顺序给出 (词, 倒排表, 文档数, 第一个文档 id, 最后一个文档 id)。
+    """
+    tmp_path = path + ".tmp"
+    entries, term_blob = bytearray(), bytearray()
+    count = 0
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * _HEADER.size)
+        offset = _HEADER.size
+        for term, postings, df, first, last in terms:
+            f.write(postings)
+            entries += _ENTRY.pack(len(term_blob), len(term), offset, len(postings), df, first, last)
+            term_blob += term
+            offset += len(postings)
+            count += 1
+        f.write(entries)
+        f.write(term_blob)
+        f.seek(0)
+        f.write(_HEADER.pack(_MAGIC, count, offset, offset + len(entries)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _rebase(postings: bytes, previous: int) -> bytes:
+    # 段内第一个文档 id 是绝对值，拼接到前一段后面时改成与前一段最后一个文档的差值
+    first, position = decode_varint(postings, 0)
+    head = bytearray()
+    encode_varint(first - previous, head)
+    return bytes(head) + postings[position:]
+
+
+class NgramIndex:
+
+    def __init__(self, directory: str, max_segments: int = 8):
+        self.directory = directory
+        self.max_segments = max_segments
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        # 文档: 日期 (yyyymmdd 整数，0 表示已删除)、表名、唯一键
+        self._dates = array("I")
+        self._tables: List[str] = []
+        self._keys: List[str] = []
+        # {(表名, 日期): [文档 id]}，重新写入一天时删除旧文档
+        self._days: Dict[Tuple[str, str], List[int]] = {}
+        self._segments: List[Segment] = []
+        self._next_segment = 1
+        self._log_name = "docs.log"
+        self._log_lines = 0
+        # 还没有 flush 的文档和倒排表
+        self._pending_docs: List[Tuple[int, str, str, str]] = []
+        self._pending_deleted: List[int] = []
+        self._buffer: Dict[str, bytearray] = {}
+        self._buffer_info: Dict[str, List[int]] = {}
+        self._load()
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, "MANIFEST")
+
+    def _load(self) -> None:
+        if not os.path.exists(self._manifest_path()):
+            return
+        with open(self._manifest_path()) as f:
+            manifest = json.load(f)
+        self._next_segment = manifest["next_segment"]
+        self._log_name = manifest.get("log", "docs.log")
+        self._log_lines = manifest["log_lines"]
+        self._segments = [Segment(os.path.join(self.directory, name)) for name in manifest["segments"]]
+        # 只应用已提交的行，之后的行是 flush 中途失败留下的，截掉以免影响之后追加的行
+        log_path = os.path.join(self.directory, self._log_name)
+        with open(log_path) as f:
+            lines = f.readlines()
+        if len(lines) > self._log_lines:
+            with open(log_path, "w") as f:
+                f.writelines(lines[:self._log_lines])
+        for line in lines[:self._log_lines]:
+            self._apply(json.loads(line))
+
+    def _apply(self, entry: Dict) -> None:
+        # 同一次 flush 中可能先新增后删除，先应用新增
+        for doc, table_name, key, date in entry["docs"]:
+            while len(self._dates) <= doc:
+                self._dates.append(0)
+                self._tables.append("")
+                self._keys.append("")
+            self._dates[doc] = int(date)
+            self._tables[doc] = table_name
+            self._keys[doc] = key
+            self._days.setdefault((table_name, date), []).append(doc)
+        for doc in entry["deleted"]:
+            self._dates[doc] = 0
+
+    def add_day(self, table_name: str, date: str, records: List[Dict]) -> None:
+        """
+        替换一天的文档，flush 之后才能查询到。
+        """
+        with self._lock:
+            old = self._days.pop((table_name, date), [])
+            self._pending_deleted.extend(old)
+            for doc in old:
+                self._dates[doc] = 0
+            docs = []
+            for record in records:
+                doc = len(self._dates)
+                self._dates.append(int(date))
+                self._tables.append(table_name)
+                self._keys.append(record_key(record))
+                docs.append(doc)
+                self._pending_docs.append((doc, table_name, self._keys[doc], date))
+                self._add_postings(doc, record_text(record))
+            self._days[(table_name, date)] = docs
+
+    def _add_postings(self, doc: int, text: str) -> None:
+        positions: Dict[str, List[int]] = {}
+        for term, offset in tokenize(text):
+            positions.setdefault(term, []).append(offset)
+        for term, offsets in positions.items():
+            postings = self._buffer.get(term)
+            if postings is None:
+                postings = self._buffer[term] = bytearray()
+                # [文档数, 第一个文档 id, 最后一个文档 id]
+                self._buffer_info[term] = [0, doc, 0]
+            info = self._buffer_info[term]
+            encode_varint(doc - info[2], postings)
+            encode_varint(len(offsets), postings)
+            previous = 0
+            for offset in offsets:
+                encode_varint(offset - previous, postings)
+                previous = offset
+            info[0] += 1
+            info[2] = doc
+
+    def flush(self) -> None:
+        """
+        把新增的文档写入一个段文件，段数超过 max_segments 时合并所有段。
+        """
+        with self._lock:
+            if not self._pending_docs and not self._pending_deleted:
+                return
+            names = [os.path.basename(segment.path) for segment in self._segments]
+            if self._buffer:
+                name = "seg_{:06d}.idx".format(self._next_segment)
+                self._next_segment += 1
+                terms = sorted((term.encode("utf-8"), term) for term in self._buffer)
+                write_segment(os.path.join(self.directory, name),
+                              ((encoded, bytes(self._buffer[term]), *self._buffer_info[term])
+                               for encoded, term in terms))
+                self._segments.append(Segment(os.path.join(self.directory, name)))
+                names.append(name)
+            # 段文件写完后再追加文档日志，最后更新 MANIFEST 提交
+            with open(os.path.join(self.directory, self._log_name), "a") as f:
+                f.write(json.dumps({"docs": self._pending_docs, "deleted": self._pending_deleted},
+                                   ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._log_lines += 1
+            self._write_manifest(names)
+            self._pending_docs, self._pending_deleted = [], []
+            self._buffer, self._buffer_info = {}, {}
+            if len(self._segments) > self.max_segments:
+                self.merge()
+
+    def _write_manifest(self, names: List[str]) -> None:
+        tmp_path = self._manifest_path() + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"segments": names, "next_segment": self._next_segment, "log": self._log_name,
+                       "log_lines": self._log_lines}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._manifest_path())
+
+    def merge(self) -> None:
+        """
+        把所有段合并为一个。各段的文档 id 依次递增，同一个词的倒排表按段的顺序拼接，不需要解码；
+        有已删除的文档时解码倒排表，去掉已删除的文档，剩下的文档按原来的顺序重新编号。
+        """
+        with self._lock:
+            # 重新编号前先写入还没有 flush 的文档
+            self.flush()
+            if len(self._segments) <= 1:
+                return
+            name = "seg_{:06d}.idx".format(self._next_segment)
+            self._next_segment += 1
+            live = [doc for doc, date in enumerate(self._dates) if date]
+            # 旧文档 id → 新文档 id，没有删除的文档时为 None
+            remap = None
+            if len(live) < len(self._dates):
+                remap = array("I", [0]) * len(self._dates)
+                for new, old in enumerate(live):
+                    remap[old] = new
+
+            def tagged(i: int, segment: Segment):
+                for term, entry in segment.terms():
+                    yield term, i, entry
+
+            def merged_terms():
+                streams = [tagged(i, segment) for i, segment in enumerate(self._segments)]
+                current, parts = None, []
+                for term, i, entry in heapq.merge(*streams):
+                    if term != current and parts:
+                        joined = self._join(current, parts, remap)
+                        if joined is not None:
+                            yield joined
+                        parts = []
+                    current = term
+                    parts.append((i, entry))
+                if parts:
+                    joined = self._join(current, parts, remap)
+                    if joined is not None:
+                        yield joined
+
+            write_segment(os.path.join(self.directory, name), merged_terms())
+            old_log = self._log_name
+            if remap is not None:
+                self._compact_docs(live, "docs_{:06d}.log".format(self._next_segment - 1))
+            old = self._segments
+            self._segments = [Segment(os.path.join(self.directory, name))]
+            # 新的段文件和文档日志都写完后更新 MANIFEST 提交，之前退出时仍使用旧的段和日志
+            self._write_manifest([name])
+            for segment in old:
+                segment.close()
+                os.remove(segment.path)
+            if old_log != self._log_name:
+                os.remove(os.path.join(self.directory, old_log))
+            log.info("合并 %d 个段: %s，%.1f MB，去掉已删除的文档 %d 个", len(old), name,
+                     self._segments[0].size() / 1048576, len(remap) - len(live) if remap is not None else 0)
+
+    def _compact_docs(self, live: List[int], log_name: str) -> None:
+        """
+        只保留 live 中的文档并重新编号，写入新的文档日志。
+        """
+        docs = [(new, self._tables[old], self._keys[old], str(self._dates[old])) for new, old in enumerate(live)]
+        with open(os.path.join(self.directory, log_name), "w") as f:
+            f.write(json.dumps({"docs": docs, "deleted": []}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._dates = array("I", (self._dates[old] for old in live))
+        self._tables = [self._tables[old] for old in live]
+        self._keys = [self._keys[old] for old in live]
+        self._days = {}
+        for doc, table_name, _, date in docs:
+            self._days.setdefault((table_name, date), []).append(doc)
+        self._log_name, self._log_lines = log_name, 1
+
+    def _join(self, term: bytes, parts: List[Tuple[int, tuple]],
+              remap: Optional[array] = None) -> Optional[Tuple[bytes, bytes, int, int, int]]:
+        if remap is not None:
+            return self._join_live(term, parts, remap)
+        chunks, df, previous = [], 0, 0
+        for i, entry in parts:
+            postings = self._segments[i].postings(entry)
+            chunks.append(postings if not chunks else _rebase(postings, previous))
+            df += entry[4]
+            previous = entry[6]
+        return term, b"".join(chunks), df, parts[0][1][5], previous
+
+    def _join_live(self, term: bytes, parts: List[Tuple[int, tuple]],
+                   remap: array) -> Optional[Tuple[bytes, bytes, int, int, int]]:
+        # 解码各段的倒排表，跳过已删除的文档，按新的文档 id 重新编码；没有剩下的文档时返回 None
+        dates = self._dates
+        postings, df, first, previous = bytearray(), 0, 0, 0
+        for i, entry in parts:
+            for doc, positions in decode_postings(self._segments[i].postings(entry), dates.__getitem__).items():
+                doc = remap[doc]
+                if not df:
+                    first = doc
+                encode_varint(doc - previous, postings)
+                encode_varint(len(positions), postings)
+                offset = 0
+                for position in positions:
+                    encode_varint(position - offset, postings)
+                    offset = position
+                df += 1
+                previous = doc
+        return (term, bytes(postings), df, first, previous) if df else None
+
+    def _postings(self, term: str, accept) -> Dict[int, List[int]]:
+        result: Dict[int, List[int]] = {}
+        encoded = term.encode("utf-8")
+        # 单个汉字: 以这个字开头的二元组和段尾的单字
+        single = is_single_cjk(term)
+        for segment in self._segments:
+            entries = list(segment.prefix(encoded)) if single else [segment.find(encoded)]
+            for entry in entries:
+                if entry is None:
+                    continue
+                for doc, positions in decode_postings(segment.postings(entry), accept).items():
+                    result.setdefault(doc, []).extend(positions)
+        return result
+
+    def _match_phrase(self, keyword: str, accept) -> Set[int]:
+        tokens = list(tokenize(keyword, query=True))
+        if not tokens:
+            return set()
+        base = tokens[0][1]
+        # 文档数少的词先查，后面的词只解码候选文档的位置
+        postings = []
+        candidates: Optional[Set[int]] = None
+        for term, offset in sorted(set(tokens), key=lambda token: self._document_frequency(token[0])):
+            found = self._postings(term, accept if candidates is None else candidates.__contains__)
+            candidates = set(found) if candidates is None else candidates & set(found)
+            postings.append((offset - base, found))
+            if not candidates:
+                return set()
+        if len(postings) == 1:
+            return candidates
+        matched = set()
+        for doc in candidates:
+            position_sets = [(shift, set(found[doc])) for shift, found in postings]
+            shift0, starts = position_sets[0]
+            for start in starts:
+                if all(start - shift0 + shift in positions for shift, positions in position_sets[1:]):
+                    matched.add(doc)
+                    break
+        return matched
+
+    def _document_frequency(self, term: str) -> int:
+        encoded = term.encode("utf-8")
+        total = 0
+        for segment in self._segments:
+            entry = segment.find(encoded)
+            total += entry[4] if entry else 0
+        return total
+
+    def search(self, query: str, start: Optional[str] = None, end: Optional[str] = None,
+               tables: Optional[Iterable[str]] = None) -> List[Tuple[str, str, str]]:
+        """
+        查询同时包含所有关键词的文档，每个关键词按短语匹配 (字和词的顺序、位置都一致)。
+
+        参数:
+            query (str): 空格分隔的关键词。
+            start (str): 开始日期 (包含)，格式为 yyyymmdd。
+            end (str): 结束日期 (包含)，格式为 yyyymmdd。
+            tables (Iterable[str]): 只查询这些表，默认全部。
+
+        返回:
+            List[Tuple[str, str, str]]: 按日期排序的 (日期, 表名, 唯一键)。
+        """
+        low, high = int(start or 0), int(end or 99999999)
+        table_set = set(tables) if tables else None
+        with self._lock:
+            dates, table_names = self._dates, self._tables
+
+            def accept(doc: int) -> bool:
+                date = dates[doc]
+                return date != 0 and low <= date <= high and (table_set is None or table_names[doc] in table_set)
+
+            matched: Optional[Set[int]] = None
+            for keyword in query.split():
+                docs = self._match_phrase(keyword, accept if matched is None else matched.__contains__)
+                matched = docs if matched is None else matched & docs
+                if not matched:
+                    return []
+            if matched is None:
+                return []
+            return sorted((str(dates[doc]), table_names[doc], self._keys[doc]) for doc in matched)
+
+    def days(self, query: str, start: Optional[str] = None, end: Optional[str] = None,
+             tables: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        提到所有关键词的日期。
+        """
+        return sorted({date for date, _, _ in self.search(query, start, end, tables)})
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"documents": sum(1 for date in self._dates if date), "segments": len(self._segments),
+                    "terms": sum(segment.count for segment in self._segments),
+                    "bytes": sum(segment.size() for segment in self._segments)}
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def get_index() -> NgramIndex:
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                _index = NgramIndex(get_value_from_yaml_or_env("ngram_index.dir") or "../data/ngram",
+                                    int(get_value_from_yaml_or_env("ngram_index.max_segments") or 8))
+    return _index
+
+
+class NgramSink(Sink):
+    """
+    存储目标 ngram，写入的每一天替换索引中这一天的文档。
+    """
+
+    row_level = False
+
+    def target(self) -> str:
+        return os.path.abspath(get_value_from_yaml_or_env("ngram_index.dir") or "../data/ngram")
+
+    def replace_day(self, table_name: str, date: str, records: List[Dict]) -> None:
+        index = get_index()
+        index.add_day(table_name, date, records)
+        index.flush()
+
+    def upsert(self, table_name: str, records: List[Dict]) -> None:
+        days: Dict[str, List[Dict]] = {}
+        for record in records:
+            days.setdefault(record["date"], []).append(record)
+        index = get_index()
+        for date, day_records in days.items():
+            index.add_day(table_name, date, day_records)
+        index.flush()
@@ -1,13 +1,26 @@
-import requests
+from typing import Tuple
+
 from lxml import etree
 
+from common import http_client, metrics
 
-def parse_html(url: str):
+
+def fetch_html(url: str) -> Tuple[str, etree._Element]:
+    """
+    请求网页，返回原始文本和解析后的 HTML，需要在原文中查找内容 (如 script 中的变量) 时使用。
+    """
     # 发起网站请求
-    response = requests.get(url)
+    with metrics.span("fetch_html"):
+        response = http_client.get(url)
 
-    # 设置编码方式为 UTF-8
-    response.encoding = 'utf-8'
+        # 设置编码方式为 UTF-8
+        response.encoding = 'utf-8'
+        text = response.text
 
     # 解析返回的 HTML 数据
-    return etree.HTML(response.text)
+    with metrics.span("parse_html"):
+        return text, etree.HTML(text)
+
+
+def parse_html(url: str):
+    return fetch_html(url)[1]
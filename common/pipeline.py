@@ -0,0 +1,109 @@
+import contextvars
+import logging
+import time
+from concurrent.futures import Executor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from common import metrics
+
+"""
+    按依赖关系执行的阶段 (抓取 → 写库 → 推送 → 发布)
+    每个阶段是一个函数，参数是本次运行的 context (包含 date 和已完成阶段的返回值，以阶段名为 key)，
+    依赖都完成后提交到线程池，互不依赖的阶段并行执行；阶段失败时依赖它的阶段跳过
+"""
+
+log = logging.getLogger(__name__)
+
+
+class StageResult:
+
+    def __init__(self, status: str, duration: float = 0.0, error: Optional[BaseException] = None):
+        # ok / failed / skipped (依赖失败) / disabled (没有启用)
+        self.status = status
+        self.duration = duration
+        self.error = error
+
+    @property
+    def satisfied(self) -> bool:
+        # 没有启用的阶段不阻塞依赖它的阶段
+        return self.status in ("ok", "disabled")
+
+
+class Pipeline:
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stages: Dict[str, Tuple[Callable[[Dict], Any], Tuple[str, ...]]] = {}
+
+    def add(self, name: str, func: Callable[[Dict], Any], deps: Iterable[str] = ()) -> "Pipeline":
+        """
+        添加一个阶段，依赖的阶段需要先添加，因此不会出现环。
+        """
+        deps = tuple(deps)
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"{self.name}.{name} 依赖的阶段 {dep} 不存在")
+        self.stages[name] = (func, deps)
+        return self
+
+    def run(self, context: Dict, executor: Executor, enabled: Optional[Iterable[str]] = None) -> Dict[str, StageResult]:
+        """
+        执行所有阶段。
+
+        参数:
+            context (Dict): 本次运行的参数，如 {"date": "20240413"}，阶段的返回值也写入其中。
+            executor (Executor): 执行阶段的线程池，多次运行共用。
+            enabled (Iterable[str]): 启用的阶段，None 表示全部启用。
+
+        返回:
+            Dict[str, StageResult]: 每个阶段的结果。
+        """
+        enabled = None if enabled is None else set(enabled)
+        begin = time.perf_counter()
+        results: Dict[str, StageResult] = {}
+        pending = dict(self.stages)
+        running = {}
+        while pending or running:
+            # 标记跳过的阶段可能让后面的阶段也可以确定状态，循环到没有变化为止
+            changed = True
+            while changed:
+                changed = False
+                for name, (func, deps) in list(pending.items()):
+                    if any(dep not in results for dep in deps):
+                        continue
+                    changed = True
+                    del pending[name]
+                    failed = [dep for dep in deps if not results[dep].satisfied]
+                    if failed:
+                        results[name] = StageResult("skipped")
+                        log.warning("%s %s 跳过: 依赖的阶段 %s 没有成功", self.name, name, ", ".join(failed))
+                    elif enabled is not None and name not in enabled:
+                        results[name] = StageResult("disabled")
+                    else:
+                        # 在提交时的 context 中执行，阶段中的 span 记录到这次运行的 trace
+                        running[executor.submit(contextvars.copy_context().run,
+                                                self._run_stage, name, func, context)] = name
+
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+
+        log.info("%s %s 完成，耗时 %.2fs: %s", self.name, context.get("date", ""), time.perf_counter() - begin,
+                 ", ".join("{} {}".format(name, "{:.2f}s".format(result.duration) if result.status == "ok"
+                                          else result.status)
+                           for name, result in results.items()))
+        return results
+
+    def _run_stage(self, name: str, func: Callable[[Dict], Any], context: Dict) -> StageResult:
+        start = time.perf_counter()
+        try:
+            with metrics.span("stage", pipeline=self.name, stage=name):
+                context[name] = func(context)
+            result = StageResult("ok", time.perf_counter() - start)
+            log.info("%s %s 完成，耗时 %.2fs", self.name, name, result.duration)
+        except Exception as e:
+            result = StageResult("failed", time.perf_counter() - start, e)
+            log.exception("%s %s 失败，耗时 %.2fs", self.name, name, result.duration)
+        return result
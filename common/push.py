@@ -2,50 +2,184 @@ import base64
 import hashlib
 import hmac
 import json
+import logging
+import threading
 import time
-from urllib.parse import quote_plus
-
-import requests
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List
 
+from common import http_client, metrics
 from common.config import get_value_from_yaml_or_env
 
+"""
+    推送消息到钉钉
+    - 每次请求重新计算签名，同一个 Messenger 可以一直使用
+    - 机器人每分钟最多发送 20 条消息，按 token 用令牌桶限速
+    - markdown 超过 dingtalk.max_bytes 时按行拆成多条，按顺序发送
+    - 失败时按指数退避重试；send 放入后台队列立即返回，send_md 等待发送完成
+"""
+
+log = logging.getLogger(__name__)
+
+# 钉钉返回的发送太快的错误码，等待后重试
+_RATE_LIMITED = 130101
+
+
+class TokenBucket:
+    """
+    令牌桶: 容量为 burst，每分钟补充 rate_per_minute 个，任意一分钟内最多发出 burst + rate_per_minute 个。
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        取一个令牌，没有时等待，返回等待的秒数。
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+# 后台发送队列，只有一个线程，消息和拆分后的各部分按提交顺序发送
+_queue = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dingtalk")
+
+
+def get_bucket(token: str) -> TokenBucket:
+    # 限制是按机器人计算的，同一个 token 的所有 Messenger 共用一个令牌桶
+    with _buckets_lock:
+        bucket = _buckets.get(token)
+        if bucket is None:
+            bucket = TokenBucket(float(get_value_from_yaml_or_env("dingtalk.rate_per_minute") or 15),
+                                 int(get_value_from_yaml_or_env("dingtalk.burst") or 5))
+            _buckets[token] = bucket
+        return bucket
+
+
+def split_markdown(text: str, max_bytes: int) -> List[str]:
+    """
+    按行把 markdown 拆成不超过 max_bytes 字节 (utf-8) 的几段，单行超过上限时按字符切开。
+    """
+    parts, current, size = [], [], 0
+    for line in text.split('\n'):
+        line_size = len(line.encode('utf-8'))
+        # 加上换行符
+        if current and size + 1 + line_size > max_bytes:
+            parts.append('\n'.join(current))
+            current, size = [], 0
+        while line_size > max_bytes:
+            # 按字符切，不会切断多字节字符
+            cut, cut_size = 0, 0
+            for char in line:
+                char_size = len(char.encode('utf-8'))
+                if cut_size + char_size > max_bytes:
+                    break
+                cut += 1
+                cut_size += char_size
+            parts.append(line[:cut])
+            line, line_size = line[cut:], line_size - cut_size
+        size += (1 if current else 0) + line_size
+        current.append(line)
+    if current or not parts:
+        parts.append('\n'.join(current))
+    return parts
+
+
+class DingTalkError(Exception):
+    """
+    钉钉返回错误或重试后仍然失败。
+    """
 
-# 推送消息到钉钉
 
 class Messenger:
 
     def __init__(self, token=None, secret=None):
-        self.timestamp = str(round(time.time() * 1000))
         self.URL = get_value_from_yaml_or_env("dingtalk.send_url")
         self.headers = {'Content-Type': 'application/json'}
         self.token = token or get_value_from_yaml_or_env("dingtalk.access_token")
         self.secret = secret or get_value_from_yaml_or_env("dingtalk.secret")
-        self.sign = self.generate_sign()
-        self.params = {'access_token': self.token, 'sign': self.sign}
+        self.max_bytes = int(get_value_from_yaml_or_env("dingtalk.max_bytes") or 18000)
+        self.retries = int(get_value_from_yaml_or_env("dingtalk.retries") or 3)
+        self.retry_backoff = float(get_value_from_yaml_or_env("dingtalk.retry_backoff") or 2)
+        self.bucket = get_bucket(self.token)
 
-    def generate_sign(self):
+    def generate_sign(self, timestamp: str) -> str:
         secret_enc = self.secret.encode('utf-8')
-        string_to_sign = '{}\n{}'.format(self.timestamp, self.secret)
+        string_to_sign = '{}\n{}'.format(timestamp, self.secret)
         string_to_sign_enc = string_to_sign.encode('utf-8')
         hmac_code = hmac.new(secret_enc, string_to_sign_enc, digestmod=hashlib.sha256).digest()
-        return quote_plus(base64.b64encode(hmac_code))
+        # 作为 params 传给 requests 时会做 url 编码，这里不再编码
+        return base64.b64encode(hmac_code).decode('utf-8')
+
+    def send(self, title, text) -> Future:
+        """
+        放入后台队列后立即返回，Future 的结果是每一部分的响应。
+        """
+        return _queue.submit(metrics.bind(self.send_md), title, text)
 
     # 发送消息
+    @metrics.timed("dingtalk_send_md")
     def send_md(self, title, text):
-        data = {
-            'msgtype': 'markdown',
-            'markdown': {
-                'title': title,
-                'text': text
+        """
+        发送 markdown 消息，超长时拆成多条按顺序发送，返回每一条的响应。
+        """
+        parts = split_markdown(text, self.max_bytes)
+        responses = []
+        for i, part in enumerate(parts):
+            part_title = title if len(parts) == 1 else '{} ({}/{})'.format(title, i + 1, len(parts))
+            data = {
+                'msgtype': 'markdown',
+                'markdown': {
+                    'title': part_title,
+                    'text': part
+                }
             }
-        }
-        self.params['timestamp'] = self.timestamp
-        return requests.post(
-            url=self.URL,
-            data=json.dumps(data),
-            params=self.params,
-            headers=self.headers
-        )
+            responses.append(self._post(data))
+        return responses
+
+    def _post(self, data):
+        body = json.dumps(data)
+        for attempt in range(self.retries + 1):
+            waited = self.bucket.acquire()
+            if waited > 0:
+                log.info("钉钉限速，等待 %.1fs", waited)
+            # 每次请求重新签名，签名中的时间戳一小时后失效
+            timestamp = str(round(time.time() * 1000))
+            params = {'access_token': self.token, 'timestamp': timestamp, 'sign': self.generate_sign(timestamp)}
+            try:
+                response = http_client.post(url=self.URL, data=body, params=params, headers=self.headers)
+                result = response.json() if response.status_code == 200 else {}
+                if result.get('errcode') == 0:
+                    return response
+                error = "status={}, {}".format(response.status_code, result or response.text[:200])
+                # 参数、签名等错误重试也不会成功
+                if response.status_code == 200 and result.get('errcode') != _RATE_LIMITED:
+                    raise DingTalkError("推送钉钉失败: " + error)
+            except DingTalkError:
+                raise
+            except Exception as e:
+                error = str(e)
+            if attempt < self.retries:
+                delay = self.retry_backoff * 2 ** attempt
+                log.warning("推送钉钉失败 (%s)，%.0fs 后第 %d 次重试", error, delay, attempt + 1)
+                time.sleep(delay)
+        raise DingTalkError("推送钉钉失败，已重试 {} 次: {}".format(self.retries, error))
 
 
 if __name__ == '__main__':
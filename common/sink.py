@@ -0,0 +1,236 @@
+import importlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Dict, List, Optional
+
+from common import digest, metrics
+from common.config import get_value_from_yaml_or_env
+
+"""
+    存储目标 (mysql、pg、mongo、sqlite、json 文件、压缩归档、倒排索引)，在配置文件 sinks.enabled 中启用
+    启用的目标并发写入，每个目标有自己的线程池、超时时间，一个目标失败或变慢不影响其他目标
+    启用 digest 时按记录摘要只写入新增、变化的记录，内容没变的目标不写入
+"""
+
+log = logging.getLogger(__name__)
+
+
+class SinkError(Exception):
+    """
+    必须成功的存储目标 (sinks.<name>.required) 写入失败或超时。
+    """
+
+
+class Sink(ABC):
+    """
+    存储目标，子类实现 replace_day 和 upsert，出错时抛出异常；没有实现时 get_sink 创建实例就会失败。
+    """
+
+    # 能否按行更新: 为 False 时 (如按天写文件) 有变化的日期整天重写
+    row_level = True
+
+    def target(self) -> str:
+        """
+        实际写入的位置 (数据库地址、目录)，内容摘要按 目标名@位置 保存，修改配置指向新的库后重新全部写入。
+        """
+        return ""
+
+    @abstractmethod
+    def replace_day(self, table_name: str, date: str, records: List[Dict]) -> None:
+        """
+        用 records 替换指定日期的全部数据。
+        """
+
+    @abstractmethod
+    def upsert(self, table_name: str, records: List[Dict]) -> None:
+        """
+        插入或更新记录，记录可以跨多天。
+        """
+
+
+class FileSink(Sink):
+    """
+    每天的数据写入一个 json 文件，路径为 sinks.file.dir/日期.json，dir 中可以使用 {table}。
+    """
+
+    row_level = False
+
+    def target(self) -> str:
+        return os.path.abspath(str(get_value_from_yaml_or_env("sinks.file.dir") or "./content"))
+
+    def replace_day(self, table_name: str, date: str, records: List[Dict]) -> None:
+        directory = str(get_value_from_yaml_or_env("sinks.file.dir") or "./content").format(table=table_name)
+        os.makedirs(directory, exist_ok=True)
+        # 先写临时文件再替换，不会留下写了一半的文件
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(json.dumps(records, indent=4, ensure_ascii=False))
+        os.replace(tmp_path, os.path.join(directory, date + ".json"))
+
+    def upsert(self, table_name: str, records: List[Dict]) -> None:
+        days: Dict[str, List[Dict]] = {}
+        for record in records:
+            days.setdefault(record["date"], []).append(record)
+        for date, day_records in days.items():
+            self.replace_day(table_name, date, day_records)
+
+
+# 存储目标名: 实现类，第一次使用时导入，没有启用的目标不需要安装对应的驱动
+SINK_CLASSES = {
+    "mysql": "mySql.mySql:MySqlSink",
+    "pg": "pg.pg:PgSink",
+    "mongo": "mongo.mongo:MongoSink",
+    "file": "common.sink:FileSink",
+    "archive": "common.archive:ArchiveSink",
+    "sqlite": "sqlite.sqlite:SqliteSink",
+    "ngram": "common.ngram_index:NgramSink",
+    "tags": "common.tag_rollup:TagRollupSink",
+}
+
+_sinks: Dict[str, Sink] = {}
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_lock = threading.Lock()
+
+
+def get_sink(name: str) -> Sink:
+    sink = _sinks.get(name)
+    if sink is None:
+        with _lock:
+            sink = _sinks.get(name)
+            if sink is None:
+                if name not in SINK_CLASSES:
+                    raise ValueError(f"不支持的存储目标: {name}")
+                module_name, class_name = SINK_CLASSES[name].split(":")
+                sink = getattr(importlib.import_module(module_name), class_name)()
+                _sinks[name] = sink
+    return sink
+
+
+def _get_executor(name: str) -> ThreadPoolExecutor:
+    executor = _executors.get(name)
+    if executor is None:
+        with _lock:
+            executor = _executors.get(name)
+            if executor is None:
+                workers = int(get_value_from_yaml_or_env(f"sinks.{name}.workers") or 2)
+                executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sink_" + name)
+                _executors[name] = executor
+    return executor
+
+
+def enabled_sinks() -> List[str]:
+    return list(get_value_from_yaml_or_env("sinks.enabled") or [])
+
+
+def digest_sink(name: str) -> str:
+    # 摘要按写入位置区分，同名目标换了库或目录时已保存的摘要不再适用
+    target = get_sink(name).target()
+    return "{}@{}".format(name, target) if target else name
+
+
+def _write(name: str, method: str, args: tuple) -> float:
+    start = time.perf_counter()
+    with metrics.span("sink_write", sink=name, method=method):
+        getattr(get_sink(name), method)(*args)
+    return time.perf_counter() - start
+
+
+def _plan(name: str, method: str, changes: digest.Changes, records: List[Dict]) -> tuple:
+    """
+    按比较结果确定写入方式: 有删除的记录时整天替换，否则只 upsert 新增、变化的记录。
+    """
+    if changes.removed:
+        return method, records
+    rows = changes.new + changes.changed
+    if not get_sink(name).row_level:
+        dates = {record["date"] for record in rows}
+        rows = [record for record in records if record["date"] in dates]
+    return "upsert", rows
+
+
+def write_to_sinks(method: str, table_name: str, records: List[Dict], date: Optional[str] = None,
+                   sinks: Optional[List[str]] = None, partial: bool = False) -> Dict[str, str]:
+    """
+    并发写入所有启用的存储目标，等每个目标完成或超时后返回。
+
+    参数:
+        method (str): replace_day 或 upsert。
+        table_name (str): 表名 (mongo 为集合名)。
+        records (List[Dict]): 要写入的记录，每个目标拿到一份副本。
+        date (str): replace_day 时要替换的日期。
+        sinks (List[str]): 写入的目标，默认读取 sinks.enabled。
+        partial (bool): records 只是这些日期的部分记录 (如跳过了获取失败的章节)，
+            按天整体重写的目标 (row_level 为 False) 会删除其他记录，跳过这些目标。
+
+    返回:
+        Dict[str, str]: 每个目标的结果 ok / unchanged / skipped / failed / timeout。
+    """
+    sinks = enabled_sinks() if sinks is None else sinks
+    begin = time.perf_counter()
+    # 替换为空的一天需要删除数据，不做比较
+    digests = [digest.record_digest(record) for record in records] if digest.enabled() and records else None
+    results, futures = {}, {}
+    for name in sinks:
+        if partial and not get_sink(name).row_level:
+            # 不保存摘要，下次完整写入时再写入这个目标
+            results[name] = "skipped"
+            log.warning("%s 记录不完整，跳过按天重写的 %s", table_name, name)
+            continue
+        sink_method, rows = method, records
+        if digests is not None:
+            index = digest.get_index()
+            changes = index.diff(digest_sink(name), table_name, records, digests,
+                                 date if method == "replace_day" else None)
+            for kind in ("new", "changed", "unchanged", "removed"):
+                index.count(kind, len(getattr(changes, kind)))
+            log.info("%s %s 对比 %s: %s", table_name, date or "", name, changes)
+            if not changes.dirty:
+                results[name] = "unchanged"
+                continue
+            sink_method, rows = _plan(name, method, changes, records)
+        # 各个目标可能修改记录 (如 mongo 加 _id)，每个目标一份副本
+        copies = [dict(record) for record in rows]
+        args = (table_name, date, copies) if sink_method == "replace_day" else (table_name, copies)
+        futures[name] = (_get_executor(name).submit(metrics.bind(_write), name, sink_method, args), len(rows))
+
+    # 所有目标同时开始，各自的截止时间从 begin 算起
+    failed = []
+    for name, (future, count) in futures.items():
+        timeout = float(get_value_from_yaml_or_env(f"sinks.{name}.timeout") or 60)
+        try:
+            elapsed = future.result(timeout=max(begin + timeout - time.perf_counter(), 0))
+            results[name] = "ok"
+            log.info("%s 写入 %s 成功: %d 条，耗时 %.2fs", table_name, name, count, elapsed)
+            if digests is not None or (method == "replace_day" and digest.enabled()):
+                # 写入成功后才保存摘要，失败的目标下次重新写入；替换为空的一天时删除这一天的摘要
+                digest.get_index().commit(digest_sink(name), table_name, records, digests or [],
+                                          date if method == "replace_day" else None)
+        except TimeoutError:
+            # 线程无法中断，超时的写入在后台继续执行，这里不再等待
+            results[name] = "timeout"
+            log.error("%s 写入 %s 超时 (%.0fs)", table_name, name, timeout)
+        except Exception as e:
+            results[name] = "failed"
+            log.exception("%s 写入 %s 失败: %s", table_name, name, e)
+        if results[name] != "ok" and get_value_from_yaml_or_env(f"sinks.{name}.required"):
+            failed.append(name)
+
+    log.info("%s %s 写入 %s，耗时 %.2fs", table_name, date or "", ", ".join(
+        "{} {}".format(name, result) for name, result in results.items()), time.perf_counter() - begin)
+    if failed:
+        raise SinkError(f"{table_name} 写入 {', '.join(failed)} 失败")
+    return results
+
+
+def replace_day(table_name: str, date: str, records: List[Dict]) -> Dict[str, str]:
+    return write_to_sinks("replace_day", table_name, records, date)
+
+
+def upsert(table_name: str, records: List[Dict], partial: bool = False) -> Dict[str, str]:
+    return write_to_sinks("upsert", table_name, records, partial=partial)
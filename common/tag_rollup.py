@@ -0,0 +1,247 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import Counter
+from itertools import combinations
+from typing import Dict, List, Optional, Tuple
+
+from common.config import get_value_from_yaml_or_env
+from common.sink import Sink
+
+"""
+    标签统计: 每天、每月的标签次数和每月两两同时出现的次数，写入一天时增量更新，查询时不需要读取原始记录
+    - day_tags 保存每天每条记录的标签，重新写入一天时先减去旧的计数再加上新的，结果与只写入一次相同
+    - 标签相同时不做任何更新
+    用法 (在程序目录下执行):
+        PYTHONPATH=.. python -m common.tag_rollup top tbl_xwlb --start 202401 --end 202403
+        PYTHONPATH=.. python -m common.tag_rollup trend tbl_xwlb 经济 --by month
+        PYTHONPATH=.. python -m common.tag_rollup related tbl_xwlb 经济
+        PYTHONPATH=.. python -m common.tag_rollup rebuild tbl_xwlb      从归档 (common.archive) 重新统计
+"""
+
+log = logging.getLogger(__name__)
+
+
+def record_tags(record: Dict) -> List[str]:
+    # 标签用空格分隔，同一条记录中重复的只算一次
+    return sorted(set(str(record.get("tags") or "").split()))
+
+
+def count_tags(tag_lists: List[List[str]]) -> Tuple[Counter, Counter]:
+    """
+    返回 (标签次数, 标签对次数)，标签对按字典序排列。
+    """
+    tags, pairs = Counter(), Counter()
+    for tag_list in tag_lists:
+        tags.update(tag_list)
+        pairs.update(combinations(tag_list, 2))
+    return tags, pairs
+
+
+def _bounds(start: Optional[str], end: Optional[str], daily: bool) -> Tuple[str, str]:
+    """
+    把月份 yyyymm 或日期 yyyymmdd 转成查询的表使用的格式: 按天查询时月份补成这个月的第一天和最后一天，
+    按月查询时日期只保留月份。字符串比较时长度不同的值会漏掉开始或结束的月份。
+    """
+    if daily:
+        low = start + "01" if start and len(start) == 6 else start
+        high = end + "31" if end and len(end) == 6 else end
+    else:
+        low, high = start and start[:6], end and end[:6]
+    return low or "0", high or "99999999"
+
+
+class TagRollup:
+
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("pragma journal_mode = wal")
+            self._conn.execute("create table if not exists day_tags ("
+                               "tbl text not null, date text not null, tags text not null, primary key (tbl, date))")
+            self._conn.execute("create table if not exists tag_day ("
+                               "tbl text not null, date text not null, tag text not null, count integer not null, "
+                               "primary key (tbl, date, tag))")
+            self._conn.execute("create index if not exists idx_tag_day_tag on tag_day (tbl, tag, date)")
+            self._conn.execute("create table if not exists tag_month ("
+                               "tbl text not null, month text not null, tag text not null, count integer not null, "
+                               "primary key (tbl, month, tag))")
+            self._conn.execute("create index if not exists idx_tag_month_tag on tag_month (tbl, tag, month)")
+            self._conn.execute("create table if not exists pair_month ("
+                               "tbl text not null, month text not null, tag_a text not null, tag_b text not null, "
+                               "count integer not null, primary key (tbl, month, tag_a, tag_b))")
+            self._conn.execute("create index if not exists idx_pair_month_b on pair_month (tbl, tag_b, month)")
+        self.stats = {"days": 0, "unchanged": 0}
+
+    def ingest_day(self, table_name: str, date: str, records: List[Dict]) -> bool:
+        """
+        写入一天的标签，替换这一天之前写入的标签，返回是否有变化。
+        """
+        tag_lists = [record_tags(record) for record in records]
+        encoded = json.dumps(tag_lists, ensure_ascii=False)
+        month = date[:6]
+        with self._lock, self._conn:
+            row = self._conn.execute("select tags from day_tags where tbl = ? and date = ?",
+                                     (table_name, date)).fetchone()
+            if row is not None and row[0] == encoded:
+                self.stats["unchanged"] += 1
+                return False
+            old_tags, old_pairs = count_tags(json.loads(row[0]) if row else [])
+            new_tags, new_pairs = count_tags(tag_lists)
+            # 每月的计数按差值更新，减到 0 的行删除
+            tag_delta = Counter(new_tags)
+            tag_delta.subtract(old_tags)
+            pair_delta = Counter(new_pairs)
+            pair_delta.subtract(old_pairs)
+            self._conn.executemany(
+                "insert into tag_month (tbl, month, tag, count) values (?, ?, ?, ?) "
+                "on conflict (tbl, month, tag) do update set count = count + excluded.count",
+                [(table_name, month, tag, count) for tag, count in tag_delta.items() if count])
+            self._conn.executemany(
+                "insert into pair_month (tbl, month, tag_a, tag_b, count) values (?, ?, ?, ?, ?) "
+                "on conflict (tbl, month, tag_a, tag_b) do update set count = count + excluded.count",
+                [(table_name, month, a, b, count) for (a, b), count in pair_delta.items() if count])
+            self._conn.execute("delete from tag_month where tbl = ? and month = ? and count <= 0", (table_name, month))
+            self._conn.execute("delete from pair_month where tbl = ? and month = ? and count <= 0",
+                               (table_name, month))
+            # 每天的计数直接替换
+            self._conn.execute("delete from tag_day where tbl = ? and date = ?", (table_name, date))
+            self._conn.executemany("insert into tag_day (tbl, date, tag, count) values (?, ?, ?, ?)",
+                                   [(table_name, date, tag, count) for tag, count in new_tags.items()])
+            self._conn.execute("insert or replace into day_tags (tbl, date, tags) values (?, ?, ?)",
+                               (table_name, date, encoded))
+            self.stats["days"] += 1
+        return True
+
+    def top(self, table_name: str, start: Optional[str] = None, end: Optional[str] = None,
+            k: int = 20) -> List[Tuple[str, int]]:
+        """
+        [start, end] 之间出现次数最多的 k 个标签，start、end 为月份 yyyymm 或日期 yyyymmdd。
+        """
+        return self._query_counts("tag", table_name, None, start, end, k)
+
+    def related(self, table_name: str, tag: str, start: Optional[str] = None, end: Optional[str] = None,
+                k: int = 20) -> List[Tuple[str, int]]:
+        """
+        [start, end] 月份之间与 tag 同时出现次数最多的 k 个标签，传入日期 yyyymmdd 时按所在的月份查询。
+        """
+        return self._query_counts("pair", table_name, tag, start, end, k)
+
+    def _query_counts(self, kind: str, table_name: str, tag: Optional[str], start: Optional[str],
+                      end: Optional[str], k: int) -> List[Tuple[str, int]]:
+        daily = kind == "tag" and ((start and len(start) == 8) or (end and len(end) == 8))
+        column = "date" if daily else "month"
+        low, high = _bounds(start, end, daily)
+        if kind == "tag":
+            table = "tag_day" if daily else "tag_month"
+            query = (f"select tag, sum(count) as total from {table} where tbl = ? and {column} between ? and ? "
+                     f"group by tag order by total desc, tag limit ?")
+            params = (table_name, low, high, k)
+        else:
+            query = ("select other, sum(count) as total from ("
+                     "select tag_b as other, count from pair_month where tbl = ? and tag_a = ? and month between ? and ? "
+                     "union all "
+                     "select tag_a as other, count from pair_month where tbl = ? and tag_b = ? and month between ? and ?"
+                     ") group by other order by total desc, other limit ?")
+            params = (table_name, tag, low, high, table_name, tag, low, high, k)
+        with self._lock:
+            return [(name, total) for name, total in self._conn.execute(query, params)]
+
+    def trend(self, table_name: str, tag: str, by: str = "month", start: Optional[str] = None,
+              end: Optional[str] = None) -> List[Tuple[str, int]]:
+        """
+        tag 每天或每月的次数，没有出现的日期、月份不在结果中。
+        """
+        table, column = ("tag_day", "date") if by == "day" else ("tag_month", "month")
+        with self._lock:
+            return list(self._conn.execute(
+                f"select {column}, count from {table} where tbl = ? and tag = ? and {column} between ? and ? "
+                f"order by {column}", (table_name, tag, *_bounds(start, end, by == "day"))))
+
+    def clear(self, table_name: str) -> None:
+        with self._lock, self._conn:
+            for table in ("day_tags", "tag_day", "tag_month", "pair_month"):
+                self._conn.execute(f"delete from {table} where tbl = ?", (table_name,))
+
+
+_rollup = None
+_lock = threading.Lock()
+
+
+def get_rollup() -> TagRollup:
+    global _rollup
+    if _rollup is None:
+        with _lock:
+            if _rollup is None:
+                _rollup = TagRollup(get_value_from_yaml_or_env("tag_rollup.db"))
+    return _rollup
+
+
+class TagRollupSink(Sink):
+    """
+    存储目标 tags，写入的每一天替换这一天的标签统计。
+    """
+
+    row_level = False
+
+    def target(self) -> str:
+        return os.path.abspath(get_value_from_yaml_or_env("tag_rollup.db"))
+
+    def replace_day(self, table_name: str, date: str, records: List[Dict]) -> None:
+        get_rollup().ingest_day(table_name, date, records)
+
+    def upsert(self, table_name: str, records: List[Dict]) -> None:
+        days: Dict[str, List[Dict]] = {}
+        for record in records:
+            days.setdefault(record["date"], []).append(record)
+        rollup = get_rollup()
+        for date, day_records in days.items():
+            rollup.ingest_day(table_name, date, day_records)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="标签统计")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    top_parser = subparsers.add_parser("top", help="出现次数最多的标签")
+    top_parser.add_argument("table")
+    top_parser.add_argument("--start", help="开始月份 yyyymm 或日期 yyyymmdd")
+    top_parser.add_argument("--end", help="结束月份 yyyymm 或日期 yyyymmdd")
+    top_parser.add_argument("-k", type=int, default=20)
+    trend_parser = subparsers.add_parser("trend", help="标签每天或每月的次数")
+    trend_parser.add_argument("table")
+    trend_parser.add_argument("tag")
+    trend_parser.add_argument("--by", choices=["day", "month"], default="month")
+    related_parser = subparsers.add_parser("related", help="经常同时出现的标签")
+    related_parser.add_argument("table")
+    related_parser.add_argument("tag")
+    related_parser.add_argument("--start", help="开始月份 yyyymm")
+    related_parser.add_argument("--end", help="结束月份 yyyymm")
+    related_parser.add_argument("-k", type=int, default=20)
+    rebuild_parser = subparsers.add_parser("rebuild", help="清空后从归档重新统计")
+    rebuild_parser.add_argument("table")
+    args = parser.parse_args()
+
+    rollup = get_rollup()
+    if args.command == "top":
+        rows = rollup.top(args.table, args.start, args.end, args.k)
+    elif args.command == "trend":
+        rows = rollup.trend(args.table, args.tag, args.by)
+    elif args.command == "related":
+        rows = rollup.related(args.table, args.tag, args.start, args.end, args.k)
+    else:
+        from common.archive import get_archive
+        rollup.clear(args.table)
+        archive = get_archive(args.table)
+        for day in archive.dates():
+            rollup.ingest_day(args.table, day, archive.read_day(day))
+        rows = rollup.top(args.table, k=10)
+        log.info("从 %s 重新统计 %d 天", archive.path, rollup.stats["days"])
+    for name, value in rows:
+        print(name, value)
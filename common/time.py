@@ -38,5 +38,10 @@ def get_yesterday_time() -> tuple[str, str]:
     return date_format, iso_format
 
 
+def get_date_before(days: int) -> str:
+    # 北京时间 days 天前的日期，格式为 YYYYMMDD
+    return (datetime.now(pytz.timezone('Asia/Shanghai')) - timedelta(days=days)).strftime('%Y%m%d')
+
+
 if __name__ == '__main__':
     print(get_current_time())
@@ -0,0 +1,186 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+from common import http_client, metrics
+from common.config import get_value_from_yaml_or_env
+
+"""
+    视频信息 (getHttpVideoInfo.do?pid=...) 的本地缓存，新闻联播、今日说法、焦点访谈共用
+    pid 发布后信息不会变化，保存到 SQLite，前面加一层内存 LRU；
+    多个 pid 一起查询时先去重，本地没有的再并发请求接口，一个事务写入
+"""
+
+log = logging.getLogger(__name__)
+
+
+class TagLookupError(Exception):
+    """
+    部分 pid 的视频信息获取失败，tags 是获取成功的部分。
+    """
+
+    def __init__(self, missing: List[str], tags: Dict[str, str]):
+        super().__init__("获取标签失败: {}".format(", ".join(missing)))
+        self.missing = missing
+        self.tags = tags
+
+
+def extract_info(payload: Dict) -> Dict:
+    # 只保存后续会用到的字段
+    video = payload.get("video") or {}
+    return {
+        "tag": payload.get("tag") or '',
+        "title": payload.get("title") or '',
+        "duration": video.get("totalLength") or '',
+        "image": payload.get("image") or '',
+        "channel": payload.get("play_channel") or '',
+        "column": payload.get("column") or '',
+        "pgmtime": payload.get("f_pgmtime") or '',
+    }
+
+
+class VideoInfoStore:
+
+    def __init__(self, db_path: str, url: str, lru_size: int, workers: int):
+        self.url = url
+        self.lru_size = lru_size
+        self.workers = workers
+        self._lru: OrderedDict[str, Dict] = OrderedDict()
+        self._lock = threading.Lock()
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("pragma journal_mode = wal")
+            self._conn.execute("create table if not exists video_info ("
+                               "pid text primary key, info text not null, fetched_at real not null)")
+        self.stats = {"memory": 0, "disk": 0, "fetched": 0, "failed": 0}
+
+    def get(self, pid: str) -> Optional[Dict]:
+        return self.get_many([pid]).get(pid)
+
+    def get_many(self, pids: Iterable[str]) -> Dict[str, Dict]:
+        """
+        批量获取视频信息。
+
+        参数:
+            pids (Iterable[str]): pid 列表，可以重复。
+
+        返回:
+            Dict[str, Dict]: {pid: 视频信息}，获取失败的 pid 不在结果中。
+        """
+        result = {}
+        missing = []
+        with self._lock:
+            for pid in dict.fromkeys(pids):
+                if pid in self._lru:
+                    self._lru.move_to_end(pid)
+                    result[pid] = self._lru[pid]
+                    self.stats["memory"] += 1
+                else:
+                    missing.append(pid)
+
+        if missing:
+            found = self._load(missing)
+            result.update(found)
+            missing = [pid for pid in missing if pid not in found]
+        if missing:
+            result.update(self._fetch(missing))
+        return result
+
+    def _load(self, pids: list) -> Dict[str, Dict]:
+        found = {}
+        with self._lock:
+            # sqlite 参数个数有限制，分批查询
+            for i in range(0, len(pids), 500):
+                chunk = pids[i:i + 500]
+                rows = self._conn.execute("select pid, info from video_info where pid in ({})".format(
+                    ", ".join("?" * len(chunk))), chunk).fetchall()
+                for pid, info in rows:
+                    found[pid] = json.loads(info)
+                    self._remember(pid, found[pid])
+            self.stats["disk"] += len(found)
+        return found
+
+    def _fetch(self, pids: list) -> Dict[str, Dict]:
+        def fetch(pid: str) -> Optional[Dict]:
+            try:
+                with metrics.span("video_info_fetch"):
+                    response = http_client.get(self.url.format(pid))
+                    return extract_info(json.loads(response.text))
+            except Exception as e:
+                log.error("获取视频信息失败 %s: %s", pid, e)
+                return None
+
+        with ThreadPoolExecutor(max_workers=max(min(self.workers, len(pids)), 1),
+                                thread_name_prefix="video_info") as executor:
+            fetched = {pid: info for pid, info in zip(pids, executor.map(metrics.bind(fetch), pids)) if info is not None}
+
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.executemany("insert or replace into video_info (pid, info, fetched_at) values (?, ?, ?)",
+                                       [(pid, json.dumps(info, ensure_ascii=False), now)
+                                        for pid, info in fetched.items()])
+            for pid, info in fetched.items():
+                self._remember(pid, info)
+            self.stats["fetched"] += len(fetched)
+            self.stats["failed"] += len(pids) - len(fetched)
+        return fetched
+
+    def _remember(self, pid: str, info: Dict) -> None:
+        self._lru[pid] = info
+        self._lru.move_to_end(pid)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> VideoInfoStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = VideoInfoStore(get_value_from_yaml_or_env("video_info.db"),
+                                        get_value_from_yaml_or_env("video_info.url"),
+                                        int(get_value_from_yaml_or_env("video_info.lru_size") or 4096),
+                                        int(get_value_from_yaml_or_env("video_info.workers") or 8))
+    return _store
+
+
+def get_video_info(pid: str) -> Optional[Dict]:
+    return get_store().get(pid)
+
+
+def get_video_infos(pids: Iterable[str]) -> Dict[str, Dict]:
+    return get_store().get_many(pids)
+
+
+@metrics.timed()
+def get_tags(pids: Iterable[str]) -> Dict[str, str]:
+    """
+    批量获取 pid 对应的标签，有 pid 获取失败时抛出 TagLookupError，
+    不用空字符串代替: 空标签会被写入数据库、摘要和标签统计，之后不会再重新获取。
+    """
+    pids = list(pids)
+    infos = get_video_infos(pids)
+    tags = {pid: infos[pid]["tag"] for pid in pids if pid in infos}
+    missing = [pid for pid in dict.fromkeys(pids) if pid not in infos]
+    if missing:
+        raise TagLookupError(missing, tags)
+    return tags
+
+
+def log_stats() -> None:
+    if _store is not None:
+        log.info("视频信息: 内存命中 %d 个，本地命中 %d 个，请求接口 %d 个，失败 %d 个",
+                 _store.stats["memory"], _store.stats["disk"], _store.stats["fetched"], _store.stats["failed"])
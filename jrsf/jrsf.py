@@ -1,70 +1,67 @@
-import json
+import argparse
+import logging
 from typing import List, Dict
 
-import requests
-from lxml import etree
-from config import get_value_from_yaml_or_env
-from mongo.mongo import insert_to_mongo, delete_from_mongo
-from mySql.mySql import delete_from_mysql, insert_to_mysql
-from parse_html import parse_html
-from common.time import get_current_time, get_yesterday_time
-from pg.pg import delete_from_pg, insert_to_pg
+from mongo.mongo import insert_to_mongo
+from mySql.mySql import log_pool_stats
+from common import archive, digest, http_client, metrics, sink, video_info
+from common.column import get_column_page, list_column, to_record
+from common.time import get_current_time
+from common.video_info import get_tags
 
 
 def get_content(date: str) -> Dict:
-    jrsf_url = get_value_from_yaml_or_env("jrsf.day_url").format(1, 1)
-    jrsf_text = etree.tostring(parse_html(jrsf_url), encoding="utf-8")
-
-    # 提取 Callback 中的内容
-    start_index = jrsf_text.find(b'Callback(') + len(b'Callback(')
-    end_index = jrsf_text.rfind(b');')
-    callback_content = jrsf_text[start_index:end_index]
-
-    # 转换为字典
-    text_dict = json.loads(callback_content)['data']['list'][0]
+    # 最新的一期
+    text_dict = get_column_page("jrsf", 1, 1)['list'][0]
 
     pid = text_dict['guid']
-    tag_text = requests.get(get_value_from_yaml_or_env("jrsf.tag_url").format(pid))
-    tags = json.loads(tag_text.text, )['tag']
+    tags = get_tags([pid])[pid]
 
-    content = {
-        "date": date,
-        "title": text_dict['title'],
-        "image_url": text_dict['image'],
-        "content": text_dict['brief'],
-        "video_url": text_dict['url'],
-        "guid": text_dict['guid'],
-        "tags": tags
-    }
+    return to_record(text_dict, date, tags)
 
-    return content
 
+def get_contents(start: str, end: str) -> List[Dict[str, str]]:
+    """
+    批量获取 [start, end] 之间每天的节目，大页翻页拉取列表，标签批量获取。
+    """
+    return list_column("jrsf", start, end)
 
-def write_to_file(content: Dict[str, str]) -> None:
-    file_name = "./content/" + title + ".json"
-    with open(file_name, "w") as f:
-        f.write(json.dumps(content, indent=4, ensure_ascii=False))
+
+def write_to_file(content: Dict[str, str], date: str) -> None:
+    # 追加到按天压缩的归档 archive.dir/表名.jsonl.gz，旧的 json 文件用 python -m common.archive convert 转换
+    archive.get_archive("tbl_jrsf").write_day(date, [content])
 
 
 def write_to_mongo(content: Dict[str, str]) -> None:
     insert_to_mongo("jrsf", [content])
 
 
-# 调用函数获取当前时间
-date, iso_time = get_current_time()
-# date, iso_time = get_yesterday_time()
-# 推送标题
-title = date + "今日说法"
+def get_title(date: str) -> str:
+    # 推送标题
+    return date + "今日说法"
 
-if __name__ == '__main__':
-    content = get_content(date)
-    # write_to_file(content)
 
-    # delete_from_mongo("tbl_jrsf", date)
-    # write_to_mongo(content)
-
-    # delete_from_pg("tbl_jrsf", date)
-    # insert_to_pg("tbl_jrsf", [content])
-
-    delete_from_mysql("tbl_jrsf", date)
-    insert_to_mysql("tbl_jrsf", [content])
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="获取今日说法")
+    parser.add_argument("--start", help="批量获取的开始日期 yyyymmdd，不传时只获取最新一期")
+    parser.add_argument("--date", default=get_current_time()[0], help="最新一期记录的日期 yyyymmdd，默认今天")
+    parser.add_argument("--end", default=None, help="批量获取的结束日期 yyyymmdd (包含)，默认 --date")
+    args = parser.parse_args()
+    date = args.date
+
+    with metrics.trace("jrsf", date=date):
+        if args.start:
+            # 批量模式: 所有节目一次写入
+            contents = get_contents(args.start, args.end or date)
+            sink.upsert("tbl_jrsf", contents)
+        else:
+            content = get_content(date)
+            # write_to_file(content, date)
+
+            # 并发写入 sinks.enabled 中的所有存储目标，每个目标在一个事务中替换这一天的数据
+            sink.replace_day("tbl_jrsf", date, [content])
+    http_client.log_stats()
+    video_info.log_stats()
+    digest.log_stats()
+    log_pool_stats()
@@ -1,16 +1,172 @@
-# This is a sample Python script.
+import argparse
+import logging
+import os
+import signal
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
 
-# Press ⌃R to execute it or replace it with your code.
-# Press Double ⇧ to search everywhere for classes, files, tool windows, actions, and settings.
+import pytz
 
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# 切换目录前把相对路径 (如 "") 转成绝对路径，避免切换后 import xwlb 找到 xwlb/xwlb.py
+sys.path[:] = [os.path.abspath(path) for path in sys.path]
+# 配置文件和配置中的相对路径 (如 ../cache) 都是相对程序目录的，与单独运行 xwlb/xwlb.py 时一致
+os.chdir(os.path.join(ROOT, "xwlb"))
 
-def print_hi(name):
-    # Use a breakpoint in the code line below to debug your script.
-    print(f'Hi, {name}')  # Press ⌘F8 to toggle the breakpoint.
+from common import digest, http_client, image, metrics, sink, video_info  # noqa: E402
+from common.config import get_value_from_yaml_or_env  # noqa: E402
+from common.pipeline import Pipeline  # noqa: E402
+from common.time import get_date_before  # noqa: E402
+from jdft import jdft  # noqa: E402
+from jrsf import jrsf  # noqa: E402
+from mySql.mySql import log_pool_stats  # noqa: E402
+from wordpress import media, post_jdft, post_jrsf, post_xwlb  # noqa: E402
+from xwlb import xwlb  # noqa: E402
+
+"""
+    常驻运行新闻联播、今日说法、焦点访谈的任务，每个任务由 抓取 → 写库 → 推送 / 发布 几个阶段组成
+    进程不退出，HTTP 连接池、数据库连接池、配置在多次运行之间复用
+    用法:
+        python main.py daemon [--run-now]                  按 pipeline.jobs 配置的时间每天执行
+        python main.py run xwlb [--date 20240413] [--stages fetch,store]   立即执行一次
+"""
+
+log = logging.getLogger(__name__)
+
+
+def xwlb_pipeline() -> Pipeline:
+    def fetch(context: Dict) -> List[Dict]:
+        # 任意一节失败都抛出异常: 下面的 replace_day 会删除这一天不在结果中的章节
+        sections = xwlb.get_sections(context["date"])
+        # 没有数据时不能继续写库，否则会删除这一天已有的数据
+        if len(sections) == 0:
+            raise Exception(f"{context['date']} 没有获取到数据")
+        return sections
+
+    return (Pipeline("xwlb")
+            .add("fetch", fetch)
+            .add("store", lambda context: sink.replace_day(xwlb.db_name, context["date"], context["fetch"]), ["fetch"])
+            .add("images", lambda context: image.process_images(section["image_url"] for section in context["fetch"]),
+                 ["fetch"])
+            # 推送在后台队列中限速发送，这个阶段等待发送完成以记录结果，不影响其他阶段
+            .add("push", lambda context: xwlb.push_to_dingtalk(context["fetch"], context["date"]).result(), ["fetch"])
+            # 发布时从数据库读取，需要先写库；上传的是图片阶段生成的缩略图
+            .add("publish", lambda context: post_xwlb.add_posts_to_wordpress(context["date"]), ["store", "images"]))
+
+
+def column_pipeline(name: str, module, post_module) -> Pipeline:
+    table = "tbl_" + name
+
+    def fetch(context: Dict) -> List[Dict]:
+        # 按播出日期获取这一天的节目，不能用 get_content (取最新一期并记为请求的日期，补跑以前的日期时会写错)
+        records = module.get_contents(context["date"], context["date"])
+        # 这一天还没有节目时不能继续写库，否则会删除这一天已有的数据
+        if len(records) == 0:
+            raise Exception(f"{name} {context['date']} 没有节目")
+        return records
+
+    return (Pipeline(name)
+            .add("fetch", fetch)
+            .add("store", lambda context: sink.replace_day(table, context["date"], context["fetch"]), ["fetch"])
+            .add("images", lambda context: image.process_images(record["image_url"] for record in context["fetch"]),
+                 ["fetch"])
+            .add("publish", lambda context: post_module.add_posts_to_wordpress(context["date"]), ["store", "images"]))
+
+
+class Runner:
+
+    def __init__(self, workers: int):
+        self.executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="stage")
+        self.pipelines = {
+            "xwlb": xwlb_pipeline(),
+            "jrsf": column_pipeline("jrsf", jrsf, post_jrsf),
+            "jdft": column_pipeline("jdft", jdft, post_jdft),
+        }
+
+    def run(self, job: str, date: str, stages: Optional[Iterable[str]] = None) -> bool:
+        """
+        执行一次任务，返回启用的阶段是否都成功。
+        """
+        # 每次运行写入一个 trace，启用 metrics 时同时更新 Prometheus 文本文件
+        with metrics.trace(job, date=date):
+            results = self.pipelines[job].run({"date": date}, self.executor, stages)
+        http_client.log_stats()
+        video_info.log_stats()
+        media.log_stats()
+        image.log_stats()
+        digest.log_stats()
+        log_pool_stats()
+        return all(result.satisfied for result in results.values())
+
+
+def job_config(job: str) -> Dict:
+    return get_value_from_yaml_or_env("pipeline.jobs." + job) or {}
+
+
+def daemon(runner: Runner, run_now: bool = False) -> None:
+    """
+    每天在配置的时间执行任务；启动时已经过了执行时间的任务，run_now 为 True 时立即执行，否则等到明天。
+    配置文件修改后下一次检查时生效。
+    """
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    tz = pytz.timezone('Asia/Shanghai')
+    jobs = ThreadPoolExecutor(max_workers=len(runner.pipelines), thread_name_prefix="job")
+    running: Dict[str, Future] = {}
+    # {任务: 最后一次执行的日期}
+    last_run: Dict[str, str] = {}
+    first = True
+    log.info("开始常驻运行")
+    while not stop.is_set():
+        now = datetime.now(tz)
+        today = now.strftime("%Y%m%d")
+        for job in runner.pipelines:
+            config = job_config(job)
+            if not config.get("at") or last_run.get(job) == today:
+                continue
+            if now.time() < datetime.strptime(str(config["at"]), "%H:%M").time():
+                continue
+            last_run[job] = today
+            if first and not run_now:
+                log.info("%s 今天的执行时间 %s 已过，明天执行", job, config["at"])
+                continue
+            if job in running and not running[job].done():
+                log.warning("%s 上一次还没有结束，跳过", job)
+                continue
+            date = get_date_before(int(config.get("days_ago") or 0))
+            running[job] = jobs.submit(runner.run, job, date, config.get("stages"))
+        first = False
+        stop.wait(int(get_value_from_yaml_or_env("pipeline.poll_interval") or 30))
+
+    log.info("停止常驻运行，等待正在执行的任务结束")
+    jobs.shutdown(wait=True)
+    runner.executor.shutdown(wait=True)
 
 
-# Press the green button in the gutter to run the script.
 if __name__ == '__main__':
-    print_hi('PyCharm')
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="新闻联播、今日说法、焦点访谈")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    daemon_parser = subparsers.add_parser("daemon", help="常驻运行，按配置的时间执行任务")
+    daemon_parser.add_argument("--run-now", action="store_true", help="启动时立即执行今天已经过了执行时间的任务")
+    run_parser = subparsers.add_parser("run", help="立即执行一次任务")
+    run_parser.add_argument("job", choices=["xwlb", "jrsf", "jdft"])
+    run_parser.add_argument("--date", default=None, help="日期 yyyymmdd，默认按 pipeline.jobs.<job>.days_ago 计算")
+    run_parser.add_argument("--stages", default=None, help="执行的阶段，逗号分隔，默认读取配置")
+    args = parser.parse_args()
 
-# See PyCharm help at https://www.jetbrains.com/help/pycharm/
+    runner = Runner(int(get_value_from_yaml_or_env("pipeline.workers") or 4))
+    if args.command == "daemon":
+        daemon(runner, args.run_now)
+    else:
+        config = job_config(args.job)
+        date = args.date or get_date_before(int(config.get("days_ago") or 0))
+        stages = args.stages.split(",") if args.stages else config.get("stages")
+        ok = runner.run(args.job, date, stages)
+        runner.executor.shutdown()
+        sys.exit(0 if ok else 1)
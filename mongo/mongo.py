@@ -1,10 +1,54 @@
+import logging
+import threading
+import time
 from typing import List, Dict, Any
 
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, ReplaceOne, DeleteMany
+from pymongo.collection import Collection
 
-from config import get_value_from_yaml_or_env
+from common import metrics
+from common.config import get_value_from_yaml_or_env
+from common.sink import Sink
 
+log = logging.getLogger(__name__)
 
+_client = None
+_lock = threading.Lock()
+# 已经创建过索引的集合
+_indexed = set()
+
+
+def get_client() -> MongoClient:
+    """
+    进程内共享一个 MongoClient (自带连接池和监控线程)，第一次使用时创建。
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = MongoClient(get_value_from_yaml_or_env("mongo.host"),
+                                      int(get_value_from_yaml_or_env("mongo.port")))
+    return _client
+
+
+def get_collection(collection_name: str) -> Collection:
+    """
+    获取集合，第一次使用时创建索引 (create_index 是幂等的)。
+    """
+    # 选择要使用的数据库（如果不存在，将自动创建）
+    db = get_client()[get_value_from_yaml_or_env("mongo.db_name")]
+    collection = db[collection_name]
+    if collection_name not in _indexed:
+        with _lock:
+            if collection_name not in _indexed:
+                # 按日期删除、查询都走 (date, id) 索引；今日说法、焦点访谈按 guid 更新
+                collection.create_index([("date", ASCENDING), ("id", ASCENDING)], name="date_id")
+                collection.create_index([("guid", ASCENDING)], name="guid", sparse=True)
+                _indexed.add(collection_name)
+    return collection
+
+
+@metrics.timed()
 def insert_to_mongo(collection_name: str, data: List[Dict]) -> None:
     """
     连接到 MongoDB，选择指定数据库和集合，并插入数据。
@@ -16,21 +60,105 @@ def insert_to_mongo(collection_name: str, data: List[Dict]) -> None:
     Returns:
         None
     """
-    # 连接到 MongoDB
-    client = MongoClient(get_value_from_yaml_or_env("mongo.host"), int(get_value_from_yaml_or_env("mongo.port")))
-
-    # 选择要使用的数据库（如果不存在，将自动创建）
-    db = client[get_value_from_yaml_or_env("mongo.db_name")]
-
     # 获取一个集合
-    collection = db[collection_name]
+    collection = get_collection(collection_name)
 
     # 插入数据
+    start = time.perf_counter()
     result = collection.insert_many(data)
+    elapsed = time.perf_counter() - start
+
+    log.info("插入 %d 行，耗时 %.2fs，%.0f 行/秒", len(result.inserted_ids), elapsed,
+             len(result.inserted_ids) / max(elapsed, 1e-9))
+
+
+def upsert_filter(record: Dict[str, Any]) -> Dict[str, Any]:
+    # 有 guid 的按 guid 更新，新闻联播按 (date, id) 更新
+    if record.get("guid"):
+        return {"guid": record["guid"]}
+    return {"date": record["date"], "id": record["id"]}
+
+
+@metrics.timed()
+def bulk_upsert_to_mongo(collection_name: str, data: List[Dict]) -> None:
+    """
+    按 (date, id) 或 guid 批量更新或插入，一次 bulk_write 发送，不需要先删除。
+
+    Parameters:
+        collection_name (str): 要使用的集合名称。
+        data (List[Dict]): 要写入的数据。
+
+    Returns:
+        None
+    """
+    if len(data) == 0:
+        return
+
+    collection = get_collection(collection_name)
+    operations = _upsert_operations(data)
+
+    start = time.perf_counter()
+    result = collection.bulk_write(operations, ordered=False)
+    elapsed = time.perf_counter() - start
 
-    print(f"插入 {len(result.inserted_ids)} 行")
+    log.info("新增 %d 行，更新 %d 行，耗时 %.2fs，%.0f 行/秒", result.upserted_count, result.modified_count,
+             elapsed, len(data) / max(elapsed, 1e-9))
 
 
+def _upsert_operations(data: List[Dict]) -> List[ReplaceOne]:
+    # insert_many 会在原字典中加上 _id，这里去掉，避免替换时修改 _id
+    return [ReplaceOne(upsert_filter(record), {k: v for k, v in record.items() if k != "_id"}, upsert=True)
+            for record in data]
+
+
+@metrics.timed()
+def replace_day_in_mongo(collection_name: str, date: str, data: List[Dict]) -> None:
+    """
+    用 data 替换集合中指定日期的数据，代替 delete_from_mongo + insert_to_mongo。
+    按 guid 或 (date, id) 更新或插入，再删除这一天多余的旧文档，在一次 bulk_write 中发送。
+    内容相同的文档不会被修改，也不会出现这一天数据为空的时间窗口。
+
+    Parameters:
+        collection_name (str): 要使用的集合名称。
+        date (str): 要替换的日期。
+        data (List[Dict]): 这一天的全部数据。
+
+    Returns:
+        None
+    """
+    collection = get_collection(collection_name)
+    operations = _upsert_operations(data)
+
+    # 删除这一天不在本次数据中的旧文档
+    if len(data) == 0:
+        operations.append(DeleteMany({"date": date}))
+    elif data[0].get("guid"):
+        operations.append(DeleteMany({"date": date, "guid": {"$nin": [record["guid"] for record in data]}}))
+    else:
+        operations.append(DeleteMany({"date": date, "id": {"$nin": [record["id"] for record in data]}}))
+
+    result = collection.bulk_write(operations, ordered=False)
+    log.info("替换集合 %s 中 %s 的数据: 新增 %d 行，更新 %d 行，删除 %d 行", collection_name, date,
+             result.upserted_count, result.modified_count, result.deleted_count)
+
+
+class MongoSink(Sink):
+    """
+    存储目标 mongo，表名作为集合名。
+    """
+
+    def target(self) -> str:
+        return "{}:{}/{}".format(get_value_from_yaml_or_env("mongo.host"), get_value_from_yaml_or_env("mongo.port"),
+                                 get_value_from_yaml_or_env("mongo.db_name"))
+
+    def replace_day(self, table_name: str, date: str, records: List[Dict]) -> None:
+        replace_day_in_mongo(table_name, date, records)
+
+    def upsert(self, table_name: str, records: List[Dict]) -> None:
+        bulk_upsert_to_mongo(table_name, records)
+
+
+@metrics.timed()
 def delete_from_mongo(collection_name: str, date: str) -> None:
     """
     连接到 MongoDB，选择指定数据库和集合，并删除指定日期的数据。
@@ -42,19 +170,13 @@ def delete_from_mongo(collection_name: str, date: str) -> None:
     Returns:
         None
     """
-    # 连接到 MongoDB
-    client = MongoClient(get_value_from_yaml_or_env("mongo.host"), int(get_value_from_yaml_or_env("mongo.port")))
-
-    # 选择要使用的数据库（如果不存在，将自动创建）
-    db = client[get_value_from_yaml_or_env("mongo.db_name")]
-
     # 获取指定的集合
-    collection = db[collection_name]
+    collection = get_collection(collection_name)
 
     # 删除指定日期的数据
     result = collection.delete_many({"date": date})
 
-    print(f"删除 {result.deleted_count} 行")
+    log.info(f"删除 {result.deleted_count} 行")
 
 
 def get_data_from_mongo(collection_name: str, date: str) -> List[Dict[str, Any]]:
@@ -67,25 +189,15 @@ def get_data_from_mongo(collection_name: str, date: str) -> List[Dict[str, Any]]
     返回:
     List[Dict[str, Any]]: 查询到的数据列表。
     """
-    # 连接到 MongoDB
-    client = MongoClient(get_value_from_yaml_or_env("mongo.host"), int(get_value_from_yaml_or_env("mongo.port")))
-
-    # 选择要使用的数据库（如果不存在，将自动创建）
-    db = client[get_value_from_yaml_or_env("mongo.db_name")]
-
     # 获取指定的集合
-    collection = db[collection_name]
+    collection = get_collection(collection_name)
 
     # 查询数据
     query = {"date": date}
     results = collection.find(query)
 
     # 将结果转换为列表并返回
-    data = []
-    for result in results:
-        data.append(result)
-
-    return data
+    return list(results)
 
 
 # 使用示例
@@ -1,9 +1,15 @@
-from typing import List, Dict, Any
+import queue
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Any, Iterator
 
 import logging
 import mysql.connector
+from mysql.connector.abstracts import MySQLConnectionAbstract
 
-from config import get_value_from_yaml_or_env
+from common import metrics
+from common.config import get_value_from_yaml_or_env
+from common.sink import Sink
 
 log = logging.getLogger(__name__)
 
@@ -22,9 +28,168 @@ def get_mysql_config() -> Dict[str, str]:
     }
 
 
+class MySqlPool:
+    """
+    进程内共享的连接池。
+    取连接时先复用空闲连接 (复用前检查连接是否可用)，没有空闲连接且未达到上限时新建，
+    否则等待其他线程归还。
+    """
+
+    def __init__(self, conn_params: Dict[str, str], size: int, timeout: float):
+        self.conn_params = conn_params
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        # 统计: 复用空闲连接次数、等待次数、新建连接次数
+        self.hits = 0
+        self.waits = 0
+        self.connects = 0
+
+    def get_connection(self) -> MySQLConnectionAbstract:
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+                else:
+                    self.waits += 1
+            if can_create:
+                return self._create_connection()
+            try:
+                # 归还的可能是 None (被丢弃连接空出的名额)，下面会重新建立连接
+                connection = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise mysql.connector.errors.PoolError(f"等待连接超时 ({self.timeout}s)")
+
+        if connection is not None and self._is_healthy(connection):
+            with self._lock:
+                self.hits += 1
+            return connection
+        try:
+            return self._new_connection()
+        except mysql.connector.Error:
+            # 名额还给连接池
+            self._idle.put(None)
+            raise
+
+    def release(self, connection: MySQLConnectionAbstract) -> None:
+        self._idle.put(connection)
+
+    def discard(self, connection: MySQLConnectionAbstract) -> None:
+        """
+        丢弃出错的连接，空出一个名额给下一次新建。
+        """
+        try:
+            connection.close()
+        except mysql.connector.Error:
+            pass
+        self._idle.put(None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "waits": self.waits, "connects": self.connects,
+                "size": self.size, "idle": self._idle.qsize()}
+
+    def _create_connection(self) -> MySQLConnectionAbstract:
+        try:
+            return self._new_connection()
+        except mysql.connector.Error:
+            # 建立连接失败，归还名额
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _new_connection(self) -> MySQLConnectionAbstract:
+        connection = mysql.connector.connect(**self.conn_params)
+        with self._lock:
+            self.connects += 1
+        return connection
+
+    @staticmethod
+    def _is_healthy(connection: MySQLConnectionAbstract) -> bool:
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except mysql.connector.Error:
+            log.info("连接不可用，重新建立连接")
+            try:
+                connection.close()
+            except mysql.connector.Error:
+                pass
+            return False
+
+
+_pools: Dict[tuple, MySqlPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(conn_params: Dict[str, str] = None) -> MySqlPool:
+    """
+    相同连接参数共用一个连接池，池大小和等待超时从配置文件读取。
+    """
+    if conn_params is None:
+        conn_params = get_mysql_config()
+    key = tuple(sorted((k, str(v)) for k, v in conn_params.items()))
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = MySqlPool(conn_params,
+                                 int(get_value_from_yaml_or_env("mysql.pool_size") or 5),
+                                 float(get_value_from_yaml_or_env("mysql.pool_timeout") or 30))
+                _pools[key] = pool
+    return pool
+
+
+@contextmanager
+def mysql_session(conn_params: Dict[str, str] = None) -> Iterator[MySQLConnectionAbstract]:
+    """
+    从连接池取一个连接，with 块内的所有操作在同一个事务中，
+    正常退出时提交，出现异常时回滚并抛出，最后把连接还给连接池。
+
+    示例:
+        with mysql_session() as connection:
+            delete_from_mysql("tbl_xwlb", date, connection=connection)
+            insert_to_mysql("tbl_xwlb", sections, connection=connection)
+    """
+    pool = get_pool(conn_params)
+    connection = pool.get_connection()
+    try:
+        yield connection
+        connection.commit()
+    except Exception:
+        try:
+            connection.rollback()
+        except mysql.connector.Error:
+            # 连接已经不可用，直接丢弃
+            pool.discard(connection)
+            raise
+        pool.release(connection)
+        raise
+    else:
+        pool.release(connection)
+
+
+@contextmanager
+def _use_connection(conn_params: Dict[str, str] = None,
+                    connection: MySQLConnectionAbstract = None) -> Iterator[MySQLConnectionAbstract]:
+    # 传入了 connection 时在调用方的事务中执行，否则单独开一个 session
+    if connection is not None:
+        yield connection
+    else:
+        with mysql_session(conn_params) as connection:
+            yield connection
+
+
+@metrics.timed()
 def insert_to_mysql(table_name: str,
                     records: List[Dict[str, str]],
-                    conn_params: Dict[str, str] = None
+                    conn_params: Dict[str, str] = None,
+                    connection: MySQLConnectionAbstract = None
                     ) -> None:
     """
     插入多条记录到 MySql 数据库中的指定表格。
@@ -40,15 +205,13 @@ def insert_to_mysql(table_name: str,
             }
         table_name (str): 数据表名。
         records (List[Dict[str, str]]): 要插入的数据列表，每个元素是一个字典，其中字典的键为列名，值为相应的数据（已转为字符串格式）。
+        connection: mysql_session 中的连接，传入时由 session 负责提交和回滚，出错时抛出异常。
 
     返回:
         None
     """
 
     # 验证参数
-    if conn_params is None:
-        log.info("未传入参数，使用配置文件默认值")
-        conn_params = get_mysql_config()
     if len(records) == 0:
         log.info("没有要插入的记录")
         return
@@ -62,34 +225,24 @@ def insert_to_mysql(table_name: str,
     columns_str = ", ".join(columns)
     insert_query = f"INSERT INTO {table_name} ({columns_str}) VALUES ({placeholders})"
 
-    connection = None
-    cursor = None
     try:
-        # 连接数据库
-        connection = mysql.connector.connect(**conn_params)
-        cursor = connection.cursor()
-
-        # 批量插入数据
-        cursor.executemany(insert_query, values)
-        connection.commit()
-
-        log.info(f"成功插入 {cursor.rowcount} 条记录到表 {table_name}")
+        with _use_connection(conn_params, connection) as conn:
+            with conn.cursor() as cursor:
+                # 批量插入数据
+                cursor.executemany(insert_query, values)
+                log.info(f"成功插入 {cursor.rowcount} 条记录到表 {table_name}")
 
     except mysql.connector.Error as err:
         log.info(f"数据库操作失败，回滚: {err}")
-        connection.rollback()
-
-    finally:
-        # 关闭连接
-        if cursor:
-            cursor.close()
-        if connection.is_connected():
-            connection.close()
+        if connection is not None:
+            raise
 
 
+@metrics.timed()
 def delete_from_mysql(table_name: str,
                       target_date: str,
-                      conn_params: Dict[str, str] = None) -> None:
+                      conn_params: Dict[str, str] = None,
+                      connection: MySQLConnectionAbstract = None) -> None:
     """
     删除指定表中 date 字段等于给定日期的记录。
 
@@ -104,74 +257,171 @@ def delete_from_mysql(table_name: str,
             }
         table_name (str): 要操作的表名。
         target_date (str): 目标日期字符串，格式应与表中 date 字段的格式相匹配。
+        connection: mysql_session 中的连接，传入时由 session 负责提交和回滚，出错时抛出异常。
 
     返回:
         None
     """
 
-    # 验证参数
-    if conn_params is None:
-        conn_params = get_mysql_config()
-
     # 构造删除 SQL 查询
     delete_query = f"DELETE FROM {table_name} WHERE date = %s"
-    connection = None
-    cursor = None
 
     try:
-        # 连接数据库
+        with _use_connection(conn_params, connection) as conn:
+            with conn.cursor() as cursor:
+                # 执行删除操作
+                cursor.execute(delete_query, (target_date,))
+                log.info(f"成功删除 {cursor.rowcount} 条记录，从表 {table_name} 中")
 
-        connection = mysql.connector.connect(**conn_params)
-        cursor = connection.cursor()
+    except mysql.connector.Error as err:
+        log.info(f"数据库操作失败: {err}")
+        if connection is not None:
+            raise
 
-        # 执行删除操作
-        cursor.execute(delete_query, (target_date,))
-        connection.commit()
 
-        log.info(f"成功删除 {cursor.rowcount} 条记录，从表 {table_name} 中")
+def key_columns(columns) -> List[str]:
+    """
+    表的唯一键: 新闻联播每天多条，按 (date, id) 区分；今日说法、焦点访谈每天一条，按 date 区分。
+    """
+    return ["date", "id"] if "id" in columns else ["date"]
+
+
+def _upsert(cursor, table_name: str, records: List[Dict[str, str]]) -> int:
+    columns = list(records[0].keys())
+    keys = key_columns(columns)
+    values = [tuple(record[col] for col in columns) for record in records]
+    updates = ", ".join(f"{col} = VALUES({col})" for col in columns if col not in keys)
+    upsert_query = (f"INSERT INTO {table_name} ({', '.join(columns)}) "
+                    f"VALUES ({', '.join(['%s'] * len(columns))}) "
+                    f"ON DUPLICATE KEY UPDATE {updates}")
+    # executemany 会合并成一条多行 INSERT 发送
+    cursor.executemany(upsert_query, values)
+    # 影响行数: 新插入的行计 1，更新的行计 2，内容没变的行计 0
+    return cursor.rowcount
+
+
+@metrics.timed()
+def upsert_to_mysql(table_name: str,
+                    records: List[Dict[str, str]],
+                    conn_params: Dict[str, str] = None,
+                    connection: MySQLConnectionAbstract = None) -> None:
+    """
+    批量插入或更新记录 (INSERT ... ON DUPLICATE KEY UPDATE)，记录可以跨多天，一条语句发送。
+
+    参数:
+        table_name (str): 数据表名。
+        records (List[Dict[str, str]]): 要写入的记录。
+        connection: mysql_session 中的连接，传入时由 session 负责提交和回滚，出错时抛出异常。
+
+    返回:
+        None
+    """
+    if len(records) == 0:
+        log.info("没有要写入的记录")
+        return
+
+    try:
+        with _use_connection(conn_params, connection) as conn:
+            with conn.cursor() as cursor:
+                upserted = _upsert(cursor, table_name, records)
+                log.info(f"写入表 {table_name}: {len(records)} 条记录，影响 {upserted} 行")
 
     except mysql.connector.Error as err:
-        log.info(f"数据库操作失败: {err}")
-        connection.rollback()
+        log.info(f"数据库操作失败，回滚: {err}")
+        if connection is not None:
+            raise
 
-    finally:
-        # 关闭连接
-        if cursor:
-            cursor.close()
-        if connection.is_connected():
-            connection.close()
+
+@metrics.timed()
+def replace_day_in_mysql(table_name: str,
+                         date: str,
+                         records: List[Dict[str, str]],
+                         conn_params: Dict[str, str] = None,
+                         connection: MySQLConnectionAbstract = None) -> None:
+    """
+    用 records 替换表中指定日期的数据，代替 delete_from_mysql + insert_to_mysql。
+    在同一个连接、同一个事务中执行 INSERT ... ON DUPLICATE KEY UPDATE，再删除这一天多余的旧记录，
+    内容相同的行 MySql 不会重写，中途失败时原来的数据保持不变。
+    需要表上有 (date, id) 或 date 的唯一键，见 sql/mysql.sql。
+
+    参数:
+        table_name (str): 数据表名。
+        date (str): 要替换的日期。
+        records (List[Dict[str, str]]): 这一天的全部记录。
+        connection: mysql_session 中的连接，传入时由 session 负责提交和回滚，出错时抛出异常。
+
+    返回:
+        None
+    """
+    try:
+        with _use_connection(conn_params, connection) as conn:
+            with conn.cursor() as cursor:
+                upserted = 0
+                if len(records) > 0:
+                    upserted = _upsert(cursor, table_name, records)
+
+                # 删除这一天不在本次记录中的旧数据，按 date 区分的表已经被上面的语句覆盖
+                deleted = 0
+                if len(records) == 0:
+                    cursor.execute(f"DELETE FROM {table_name} WHERE date = %s", (date,))
+                    deleted = cursor.rowcount
+                elif "id" in records[0]:
+                    ids = [record["id"] for record in records]
+                    delete_query = (f"DELETE FROM {table_name} WHERE date = %s "
+                                    f"AND id NOT IN ({', '.join(['%s'] * len(ids))})")
+                    cursor.execute(delete_query, (date, *ids))
+                    deleted = cursor.rowcount
+
+                log.info(f"替换表 {table_name} 中 {date} 的数据: {len(records)} 条记录，影响 {upserted} 行，删除 {deleted} 行")
+
+    except mysql.connector.Error as err:
+        log.info(f"数据库操作失败，回滚: {err}")
+        if connection is not None:
+            raise
+
+
+class MySqlSink(Sink):
+    """
+    存储目标 mysql，在一个事务中写入，出错时抛出异常。
+    """
+
+    def target(self) -> str:
+        return "{}:{}/{}".format(get_value_from_yaml_or_env("mysql.host"), get_value_from_yaml_or_env("mysql.port"),
+                                 get_value_from_yaml_or_env("mysql.db_name"))
+
+    def replace_day(self, table_name: str, date: str, records: List[Dict[str, str]]) -> None:
+        with mysql_session() as connection:
+            replace_day_in_mysql(table_name, date, records, connection=connection)
+
+    def upsert(self, table_name: str, records: List[Dict[str, str]]) -> None:
+        with mysql_session() as connection:
+            upsert_to_mysql(table_name, records, connection=connection)
 
 
 def get_data_from_MySql(table_name: str,
                         date: str,
-                        conn_params: Dict[str, str] = None) -> List[Dict[str, Any]]:
+                        conn_params: Dict[str, str] = None,
+                        connection: MySQLConnectionAbstract = None) -> List[Dict[str, Any]]:
     """
     从 MySql 数据库中获取指定日期的数据。
 
     参数:
     date (str): 指定日期。
+    connection: mysql_session 中的连接，可以和其他读写共用一个连接。
 
     返回:
     List[Dict[str, Any]]: 查询到的数据列表。
     """
-    # 连接到 MySql 数据库
-    # 验证参数
-    if conn_params is None:
-        conn_params = get_mysql_config()
-
     # 构造查询语句
     select_query = f"SELECT * FROM {table_name} WHERE date = %s "
-    connection = None
-    cursor = None
 
     try:
-        # 连接数据库
-        connection = mysql.connector.connect(**conn_params)
-        cursor = connection.cursor(dictionary=True)  # 返回字典格式的结果
-
-        # 执行查询
-        cursor.execute(select_query, (date,))
-        result = cursor.fetchall()
+        with _use_connection(conn_params, connection) as conn:
+            # 返回字典格式的结果
+            with conn.cursor(dictionary=True) as cursor:
+                # 执行查询
+                cursor.execute(select_query, (date,))
+                result = cursor.fetchall()
 
         log.info(f"成功查询到 {len(result)} 条记录，从表 {table_name} 中")
 
@@ -179,14 +429,17 @@ def get_data_from_MySql(table_name: str,
 
     except mysql.connector.Error as err:
         log.info(f"数据库操作失败: {err}")
+        if connection is not None:
+            raise
         return []
 
-    finally:
-        # 关闭连接
-        if cursor:
-            cursor.close()
-        if connection.is_connected():
-            connection.close()
+
+def log_pool_stats() -> None:
+    for pool in _pools.values():
+        stats = pool.stats()
+        log.info("mysql 连接池 %s:%s 复用 %d 次，等待 %d 次，新建连接 %d 个",
+                 pool.conn_params.get("host"), pool.conn_params.get("port"),
+                 stats["hits"], stats["waits"], stats["connects"])
 
 
 # 使用示例
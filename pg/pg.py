@@ -1,10 +1,20 @@
-from typing import List, Dict, Any
+import io
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Any, Iterator, Sequence
 
-import psycopg2
 from psycopg2 import sql
-from psycopg2.extras import execute_batch
+from psycopg2.extensions import connection as PgConnection
+from psycopg2.extras import execute_batch, execute_values
+from psycopg2.pool import ThreadedConnectionPool
 
-from config import get_value_from_yaml_or_env
+from common import metrics
+from common.config import get_value_from_yaml_or_env
+from common.sink import Sink
+
+log = logging.getLogger(__name__)
 
 
 def get_pg_config() -> Dict[str, str]:
@@ -17,12 +27,62 @@ def get_pg_config() -> Dict[str, str]:
     }
 
 
+_pools: Dict[tuple, ThreadedConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(conn_params: Dict[str, str] = None) -> ThreadedConnectionPool:
+    """
+    相同连接参数共用一个连接池，连接数从配置文件读取。
+    """
+    if conn_params is None:
+        conn_params = get_pg_config()
+    key = tuple(sorted((k, str(v)) for k, v in conn_params.items()))
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ThreadedConnectionPool(int(get_value_from_yaml_or_env("pg.pool_minconn") or 1),
+                                              int(get_value_from_yaml_or_env("pg.pool_maxconn") or 5),
+                                              **conn_params)
+                _pools[key] = pool
+    return pool
+
+
+@contextmanager
+def pg_session(conn_params: Dict[str, str] = None) -> Iterator[PgConnection]:
+    """
+    从连接池取一个连接，with 块内的所有操作在同一个事务中，
+    正常退出时提交，出现异常时回滚并抛出，最后把连接还给连接池。
+    """
+    pool = get_pool(conn_params)
+    conn = pool.getconn()
+    if conn.closed:
+        # 连接已经断开，丢弃后重新取
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        pool.putconn(conn, close=bool(conn.closed))
+        raise
+    else:
+        pool.putconn(conn)
+
+
+@metrics.timed()
 def insert_to_pg(table_name: str,
                  records: List[Dict[str, str]],
-                 conn_params: Dict[str, str] = None
+                 conn_params: Dict[str, str] = None,
+                 use_copy: bool = None
                  ) -> None:
     """
     插入多条记录到 PostgreSQL 数据库中的指定表格。
+    记录数不少于 pg.copy_threshold 时通过 COPY 写入临时表再合并，否则使用 execute_batch。
 
     参数:
         conn_params (Dict[str, str]): 包含连接信息的字典，例如：
@@ -35,53 +95,86 @@ def insert_to_pg(table_name: str,
             }
         table_name (str): 数据表名。
         records (List[Dict[str, str]]): 要插入的数据列表，每个元素是一个字典，其中字典的键为列名，值为相应的数据（已转为字符串格式）。
+        use_copy (bool): 强制指定写入方式，默认按记录数选择，可以用来对比两种方式的速度。
 
     返回:
         None
     """
 
     # 验证参数
-    if conn_params is None:
-        conn_params = get_pg_config()
     if len(records) == 0:
         return
 
-    # 连接到 PostgreSQL 数据库
-    connection = psycopg2.connect(**conn_params)
+    columns = list(records[0].keys())
+    if use_copy is None:
+        use_copy = len(records) >= int(get_value_from_yaml_or_env("pg.copy_threshold") or 1000)
+    start = time.perf_counter()
     try:
-        # 创建 cursor 对象用来执行SQL语句
-        cursor = connection.cursor()
-
-        # 构建SQL插入语句
-        columns = sql.SQL(', ').join(map(sql.Identifier, records[0].keys()))
-        placeholders = sql.SQL(', ').join(sql.Placeholder() * len(records[0].keys()))
-        stmt = sql.SQL("insert into {} ({}) values ({})").format(
-            sql.Identifier(table_name),
-            columns,
-            placeholders
-        )
-        print(f"执行的 sql: {format(stmt.as_string(connection))}")
-
-        # 使用 execute_batch 执行批量插入
-        execute_batch(cursor, stmt, [tuple(record.values()) for record in records])
-
-        # 提交事务
-        connection.commit()
-
-        # 输出影响的行数
-        print(f"共插入: {len(records)} 行")
-
-        # 关闭 cursor
-        cursor.close()
+        with pg_session(conn_params) as connection:
+            with connection.cursor() as cursor:
+                if use_copy:
+                    _copy_insert(cursor, table_name, columns, records)
+                else:
+                    _batch_insert(cursor, table_name, columns, records)
+
+        # 输出影响的行数和速度
+        elapsed = time.perf_counter() - start
+        log.info("共插入: %d 行 (%s)，耗时 %.2fs，%.0f 行/秒", len(records),
+                 "copy" if use_copy else "execute_batch", elapsed, len(records) / max(elapsed, 1e-9))
 
     except Exception as e:
-        print(f"插入报错: {e}")
-        connection.rollback()
-    finally:
-        # 关闭数据库连接
-        connection.close()
-
-
+        log.error(f"插入报错: {e}")
+
+
+def _batch_insert(cursor, table_name: str, columns: Sequence[str], records: List[Dict[str, str]]) -> None:
+    # 构建SQL插入语句
+    stmt = sql.SQL("insert into {} ({}) values ({})").format(
+        sql.Identifier(table_name),
+        sql.SQL(', ').join(map(sql.Identifier, columns)),
+        sql.SQL(', ').join(sql.Placeholder() * len(columns))
+    )
+    log.debug(f"执行的 sql: {format(stmt.as_string(cursor))}")
+
+    # 使用 execute_batch 执行批量插入
+    execute_batch(cursor, stmt, [tuple(record[col] for col in columns) for record in records])
+
+
+def _copy_insert(cursor, table_name: str, columns: Sequence[str], records: List[Dict[str, str]]) -> None:
+    # 与目标表结构相同的临时表，事务结束时自动删除
+    staging = table_name + "_staging"
+    cursor.execute(sql.SQL("create temp table if not exists {} (like {} including defaults) on commit drop").format(
+        sql.Identifier(staging), sql.Identifier(table_name)))
+
+    # 分块写入内存缓冲区，通过 COPY 发送到临时表
+    copy_stmt = sql.SQL("copy {} ({}) from stdin").format(
+        sql.Identifier(staging), sql.SQL(', ').join(map(sql.Identifier, columns))).as_string(cursor)
+    chunk = int(get_value_from_yaml_or_env("pg.copy_chunk") or 10000)
+    for i in range(0, len(records), chunk):
+        buffer = io.StringIO()
+        for record in records[i:i + chunk]:
+            buffer.write("\t".join(_copy_value(record[col]) for col in columns))
+            buffer.write("\n")
+        buffer.seek(0)
+        cursor.copy_expert(copy_stmt, buffer)
+
+    # 从临时表合并到目标表
+    column_list = sql.SQL(', ').join(map(sql.Identifier, columns))
+    cursor.execute(sql.SQL("insert into {} ({}) select {} from {}").format(
+        sql.Identifier(table_name), column_list, column_list, sql.Identifier(staging)))
+    cursor.execute(sql.SQL("truncate {}").format(sql.Identifier(staging)))
+
+
+def _copy_value(value: Any) -> str:
+    # COPY text 格式: \N 表示 null，反斜杠、制表符、换行需要转义
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r"))
+
+
+@metrics.timed()
 def delete_from_pg(table_name: str,
                    target_date: str,
                    conn_params: Dict[str, str] = None) -> None:
@@ -104,37 +197,152 @@ def delete_from_pg(table_name: str,
         None
     """
 
-    # 验证参数
-    if conn_params is None:
-        conn_params = get_pg_config()
-
-    # 连接到 PostgreSQL 数据库
-    conn = psycopg2.connect(**conn_params)
     try:
-        # 创建 cursor 对象用来执行 SQL 语句
-        cur = conn.cursor()
+        with pg_session(conn_params) as conn:
+            with conn.cursor() as cur:
+                # 构建安全的 SQL 删除语句
+                stmt = sql.SQL("delete from {} where date = %s").format(sql.Identifier(table_name))
 
-        # 构建安全的 SQL 删除语句
-        stmt = sql.SQL("delete from {} where date = %s").format(sql.Identifier(table_name))
+                # 执行删除操作
+                cur.execute(stmt, (target_date,))
 
-        # 执行删除操作
-        cur.execute(stmt, (target_date,))
+                log.debug(f"执行的 sql: {format(stmt.as_string(conn))}")
+                # 打印删除的行数
+                log.info(f"共删除: {cur.rowcount} 行")
+    except Exception as e:
+        log.error(f"Error: {e}")
 
-        # 提交事务
-        conn.commit()
 
-        print(f"执行的 sql: {format(stmt.as_string(conn))}")
-        # 打印删除的行数
-        print(f"共删除: {cur.rowcount} 行")
+def key_columns(columns) -> List[str]:
+    """
+    表的唯一键: 新闻联播每天多条，按 (date, id) 区分；今日说法、焦点访谈每天一条，按 date 区分。
+    """
+    return ["date", "id"] if "id" in columns else ["date"]
+
+
+def _upsert(cursor, table_name: str, records: List[Dict[str, str]]) -> int:
+    columns = list(records[0].keys())
+    keys = key_columns(columns)
+    others = [col for col in columns if col not in keys]
+    # 只有内容变化的行才更新
+    stmt = sql.SQL("insert into {} as t ({}) values %s on conflict ({}) do update set ({}) = ({}) "
+                   "where ({}) is distinct from ({})").format(
+        sql.Identifier(table_name),
+        sql.SQL(', ').join(map(sql.Identifier, columns)),
+        sql.SQL(', ').join(map(sql.Identifier, keys)),
+        sql.SQL(', ').join(map(sql.Identifier, others)),
+        sql.SQL('row({})').format(sql.SQL(', ').join(sql.Identifier("excluded", col) for col in others)),
+        sql.SQL(', ').join(sql.Identifier("t", col) for col in others),
+        sql.SQL(', ').join(sql.Identifier("excluded", col) for col in others))
+    # execute_values 把所有记录拼成一条多行 insert
+    execute_values(cursor, stmt, [tuple(record[col] for col in columns) for record in records],
+                   page_size=len(records))
+    return cursor.rowcount
+
+
+@contextmanager
+def _use_connection(conn_params: Dict[str, str] = None,
+                    connection: PgConnection = None) -> Iterator[PgConnection]:
+    # 传入了 connection 时在调用方的事务中执行，否则单独开一个 session
+    if connection is not None:
+        yield connection
+    else:
+        with pg_session(conn_params) as connection:
+            yield connection
+
+
+@metrics.timed()
+def upsert_to_pg(table_name: str,
+                 records: List[Dict[str, str]],
+                 conn_params: Dict[str, str] = None,
+                 connection: PgConnection = None) -> None:
+    """
+    批量插入或更新记录 (INSERT ... ON CONFLICT DO UPDATE)，记录可以跨多天，一条语句发送。
+
+    参数:
+        table_name (str): 数据表名。
+        records (List[Dict[str, str]]): 要写入的记录。
+        connection: pg_session 中的连接，传入时由 session 负责提交和回滚，出错时抛出异常。
+
+    返回:
+        None
+    """
+    if len(records) == 0:
+        return
 
-        # 关闭 cursor
-        cur.close()
+    try:
+        with _use_connection(conn_params, connection) as conn:
+            with conn.cursor() as cur:
+                upserted = _upsert(cur, table_name, records)
+                log.info(f"写入表 {table_name}: {len(records)} 条记录，新增或更新 {upserted} 行")
+    except Exception as e:
+        log.error(f"写入报错: {e}")
+        if connection is not None:
+            raise
+
+
+@metrics.timed()
+def replace_day_in_pg(table_name: str,
+                      date: str,
+                      records: List[Dict[str, str]],
+                      conn_params: Dict[str, str] = None,
+                      connection: PgConnection = None) -> None:
+    """
+    用 records 替换表中指定日期的数据，代替 delete_from_pg + insert_to_pg。
+    在同一个连接、同一个事务中执行 INSERT ... ON CONFLICT DO UPDATE，再删除这一天多余的旧记录，
+    内容相同的行不会重写，中途失败时原来的数据保持不变。
+    需要表上有 (date, id) 或 date 的唯一约束，见 sql/postgresql.sql。
+
+    参数:
+        table_name (str): 数据表名。
+        date (str): 要替换的日期。
+        records (List[Dict[str, str]]): 这一天的全部记录。
+        connection: pg_session 中的连接，传入时由 session 负责提交和回滚，出错时抛出异常。
+
+    返回:
+        None
+    """
+    try:
+        with _use_connection(conn_params, connection) as conn:
+            with conn.cursor() as cur:
+                upserted = 0
+                if len(records) > 0:
+                    upserted = _upsert(cur, table_name, records)
+
+                # 删除这一天不在本次记录中的旧数据，按 date 区分的表已经被上面的语句覆盖
+                deleted = 0
+                if len(records) == 0:
+                    cur.execute(sql.SQL("delete from {} where date = %s").format(sql.Identifier(table_name)), (date,))
+                    deleted = cur.rowcount
+                elif "id" in records[0]:
+                    cur.execute(sql.SQL("delete from {} where date = %s and id <> all(%s)").format(
+                        sql.Identifier(table_name)), (date, [record["id"] for record in records]))
+                    deleted = cur.rowcount
+
+                log.info(f"替换表 {table_name} 中 {date} 的数据: {len(records)} 条记录，"
+                         f"新增或更新 {upserted} 行，删除 {deleted} 行")
     except Exception as e:
-        print(f"Error: {e}")
-        conn.rollback()
-    finally:
-        # 关闭数据库连接
-        conn.close()
+        log.error(f"替换报错: {e}")
+        if connection is not None:
+            raise
+
+
+class PgSink(Sink):
+    """
+    存储目标 pg，在一个事务中写入，出错时抛出异常。
+    """
+
+    def target(self) -> str:
+        return "{}:{}/{}".format(get_value_from_yaml_or_env("pg.host"), get_value_from_yaml_or_env("pg.port"),
+                                 get_value_from_yaml_or_env("pg.db_name"))
+
+    def replace_day(self, table_name: str, date: str, records: List[Dict[str, str]]) -> None:
+        with pg_session() as connection:
+            replace_day_in_pg(table_name, date, records, connection=connection)
+
+    def upsert(self, table_name: str, records: List[Dict[str, str]]) -> None:
+        with pg_session() as connection:
+            upsert_to_pg(table_name, records, connection=connection)
 
 
 def get_data_from_postgresql(table_name: str,
@@ -149,36 +357,24 @@ def get_data_from_postgresql(table_name: str,
     返回:
     List[Dict[str, Any]]: 查询到的数据列表。
     """
-    # 连接到 PostgreSQL 数据库
-    # 验证参数
-    if conn_params is None:
-        conn_params = get_pg_config()
-    conn = psycopg2.connect(**conn_params)
+    with pg_session(conn_params) as conn:
+        # 创建游标对象
+        with conn.cursor() as cursor:
+            # 执行查询
+            stmt = sql.SQL("SELECT * FROM {} WHERE date = %s order by id ").format(sql.Identifier(table_name))
 
-    # 创建游标对象
-    cursor = conn.cursor()
+            cursor.execute(stmt, (date,))
 
-    # 执行查询
-    stmt = sql.SQL("SELECT * FROM {} WHERE date = %s order by id ").format(sql.Identifier(table_name))
+            # 获取查询结果
+            rows = cursor.fetchall()
 
-    cursor.execute(stmt, (date,))
+            log.debug(f"执行的 sql: {format(stmt.as_string(conn))}")
 
-    # 获取查询结果
-    rows = cursor.fetchall()
-
-    print(f"执行的 sql: {format(stmt.as_string(conn))}")
-
-    # 获取列名
-    colnames = [desc[0] for desc in cursor.description]
+            # 获取列名
+            colnames = [desc[0] for desc in cursor.description]
 
     # 将结果转换为列表并返回
-    data = [dict(zip(colnames, row)) for row in rows]
-
-    # 关闭游标和连接
-    cursor.close()
-    conn.close()
-
-    return data
+    return [dict(zip(colnames, row)) for row in rows]
 
 
 # 使用示例
@@ -7,8 +7,9 @@ create table tbl_xwlb (
     abstract varchar(255) comment '内容标签，用空格分隔',
     content text comment '摘要',
     video_url varchar(255) comment '详细内容',
-    index date_index(date)
+    unique key uk_date_id(date, id)
 ) comment '新闻联播';
+-- 已有的表: alter table tbl_xwlb drop index date_index, add unique key uk_date_id(date, id);
 
 drop table if exists tbl_jdft;
 create table tbl_jdft
@@ -6,8 +6,10 @@ create table tbl_xwlb (
     tags varchar(255),
     abstract varchar(255),
     content text,
-    video_url varchar(255)
+    video_url varchar(255),
+    unique (date, id)
 );
+-- 已有的表: alter table tbl_xwlb add unique (date, id);
 
 alter table tbl_xwlb modify column id com
 
@@ -0,0 +1,42 @@
+-- 本地 SQLite 存储目标 (sqlite/sqlite.py 启动时执行)，表结构与 mysql.sql 相同
+-- *_fts 是全文索引，索引字段切分后的二元组 (见 sqlite.to_ngrams)，rowid 与原表相同，由 sqlite.py 维护
+-- 索引不保存切分后的内容 (content='')，删除时需要传入原来的值
+
+-- 新闻联播
+create table if not exists tbl_xwlb (
+    id        integer,       -- 序号
+    date      varchar(25),   -- 日期
+    image_url varchar(255),  -- 图像 url
+    tags      varchar(255),  -- 内容标签，用空格分隔
+    abstract  varchar(255),  -- 摘要
+    content   text,          -- 详细内容
+    video_url varchar(255),  -- 视频完整url
+    unique (date, id)
+);
+create virtual table if not exists tbl_xwlb_fts using fts5(tags, abstract, content, content='');
+
+-- 焦点访谈
+create table if not exists tbl_jdft (
+    date      varchar(25),   -- 日期
+    title     varchar(255),  -- 标题
+    tags      varchar(255),  -- 内容标签，用空格分隔
+    image_url varchar(255),  -- 图片地址
+    content   text,          -- 详细内容
+    video_url varchar(255),  -- 视频完整url
+    guid      varchar(255),  -- 内容 id
+    primary key (date)
+);
+create virtual table if not exists tbl_jdft_fts using fts5(title, tags, content, content='');
+
+-- 今日说法
+create table if not exists tbl_jrsf (
+    date      varchar(25),   -- 日期
+    title     varchar(255),  -- 标题
+    tags      varchar(255),  -- 内容标签，用空格分隔
+    image_url varchar(255),  -- 图片地址
+    content   text,          -- 详细内容
+    video_url varchar(255),  -- 视频完整url
+    guid      varchar(255),  -- 内容 id
+    primary key (date)
+);
+create virtual table if not exists tbl_jrsf_fts using fts5(title, tags, content, content='');
@@ -0,0 +1,233 @@
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from common.config import get_value_from_yaml_or_env
+from common.ngram import is_single_cjk, to_ngrams
+from common.sink import Sink
+
+log = logging.getLogger(__name__)
+
+"""
+    本地 SQLite 存储目标，不需要数据库服务，表结构见 sql/sqlite.sql
+    - WAL 模式，写入时每 sqlite.batch_size 条执行一次 executemany，一天的数据在一个事务中替换
+    - 全文索引使用 FTS5，切分方式见 common/ngram.py，查询时用同样的方式切分成短语，两个字的词也能命中索引
+    - 修改切分方式后需要重新生成索引: python ../sqlite/sqlite.py rebuild 表名
+    用法 (在程序目录下执行):
+        PYTHONPATH=.. python ../sqlite/sqlite.py search tbl_xwlb 国家安全 稀土 --start 20240101
+"""
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sql", "sqlite.sql")
+
+# 建立全文索引的字段
+FTS_COLUMNS = {
+    "tbl_xwlb": ("tags", "abstract", "content"),
+    "tbl_jrsf": ("title", "tags", "content"),
+    "tbl_jdft": ("title", "tags", "content"),
+}
+
+def to_match(query: str) -> str:
+    """
+    把空格分隔的关键词转成 FTS5 查询，每个关键词是一个短语，多个关键词同时出现才匹配。
+    最后是单个汉字时按前缀查询 (匹配以这个字开头的二元组和段尾的单字)。
+    """
+    phrases = []
+    for keyword in query.split():
+        tokens = to_ngrams(keyword, query=True)
+        if not tokens:
+            continue
+        phrase = '"{}"'.format(tokens)
+        last = tokens.rsplit(" ", 1)[-1]
+        phrases.append(phrase + " *" if is_single_cjk(last) else phrase)
+    if not phrases:
+        raise ValueError(f"没有可以查询的关键词: {query!r}")
+    return " AND ".join(phrases)
+
+
+def key_columns(columns) -> List[str]:
+    """
+    表的唯一键: 新闻联播每天多条，按 (date, id) 区分；今日说法、焦点访谈每天一条，按 date 区分。
+    """
+    return ["date", "id"] if "id" in columns else ["date"]
+
+
+class SqliteStore:
+    """
+    一个数据库文件，一个连接，所有线程共用，写入和查询都加锁。
+    """
+
+    def __init__(self, db_path: str, batch_size: int = 1000):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("pragma journal_mode = wal")
+            # WAL 模式下 normal 不会损坏数据库，断电时最多丢失最后几个事务
+            self._conn.execute("pragma synchronous = normal")
+            with open(SCHEMA_FILE, encoding="utf-8") as f:
+                self._conn.executescript(f.read())
+
+    def _dates_filter(self, dates: List[str]) -> tuple:
+        return "date in ({})".format(", ".join("?" * len(dates))), dates
+
+    def write(self, table_name: str, records: List[Dict[str, Any]], date: Optional[str] = None) -> None:
+        """
+        在一个事务中写入记录并更新全文索引。
+
+        参数:
+            table_name (str): 数据表名。
+            records (List[Dict[str, Any]]): 要写入的记录。
+            date (str): 传入时先删除这一天的全部数据 (替换一天)，否则按唯一键插入或更新。
+
+        返回:
+            None
+        """
+        dates = [date] if date else sorted({str(record["date"]) for record in records})
+        fts_columns = FTS_COLUMNS[table_name]
+        start = time.perf_counter()
+        with self._lock, self._conn:
+            for i in range(0, len(dates), 500):
+                where, params = self._dates_filter(dates[i:i + 500])
+                # 先从索引中删除这些日期的旧记录
+                self._index(table_name, self._conn.execute(
+                    f"select rowid, {', '.join(fts_columns)} from {table_name} where {where}", params), delete=True)
+                if date:
+                    self._conn.execute(f"delete from {table_name} where {where}", params)
+
+            if records:
+                columns = list(records[0].keys())
+                keys = key_columns(columns)
+                updates = ", ".join(f"{col} = excluded.{col}" for col in columns if col not in keys)
+                upsert_query = (f"insert into {table_name} ({', '.join(columns)}) "
+                                f"values ({', '.join('?' * len(columns))}) "
+                                f"on conflict ({', '.join(keys)}) do update set {updates}")
+                for i in range(0, len(records), self.batch_size):
+                    self._conn.executemany(upsert_query, [tuple(record[col] for col in columns)
+                                                          for record in records[i:i + self.batch_size]])
+
+            # 按日期重新索引这些记录
+            for i in range(0, len(dates), 500):
+                where, params = self._dates_filter(dates[i:i + 500])
+                self._index(table_name, self._conn.execute(
+                    f"select rowid, {', '.join(fts_columns)} from {table_name} where {where}", params))
+        log.info("写入 %s: %d 条记录 (%d 天)，耗时 %.3fs", table_name, len(records), len(dates),
+                 time.perf_counter() - start)
+
+    def search(self, table_name: str, query: str, start: Optional[str] = None, end: Optional[str] = None,
+               limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        全文查询，按日期倒序返回匹配的记录。
+
+        参数:
+            table_name (str): 数据表名。
+            query (str): 空格分隔的关键词，所有关键词都出现时匹配。
+            start (str): 开始日期 (包含)，格式为 yyyymmdd。
+            end (str): 结束日期 (包含)，格式为 yyyymmdd。
+            limit (int): 最多返回的条数。
+
+        返回:
+            List[Dict[str, Any]]: 匹配的记录。
+        """
+        conditions, params = [f"{table_name}_fts match ?"], [to_match(query)]
+        if start:
+            conditions.append("t.date >= ?")
+            params.append(start)
+        if end:
+            conditions.append("t.date <= ?")
+            params.append(end)
+        order = "t.date desc, t.id" if table_name == "tbl_xwlb" else "t.date desc"
+        with self._lock:
+            rows = self._conn.execute(
+                f"select t.* from {table_name}_fts join {table_name} t on t.rowid = {table_name}_fts.rowid "
+                f"where {' and '.join(conditions)} order by {order} limit ?", (*params, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_day(self, table_name: str, date: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(f"select * from {table_name} where date = ? order by rowid", (date,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def rebuild_index(self, table_name: str) -> int:
+        """
+        重新生成整张表的全文索引 (如修改了切分方式)，返回记录数。
+        """
+        fts_columns = FTS_COLUMNS[table_name]
+        with self._lock, self._conn:
+            self._conn.execute(f"insert into {table_name}_fts ({table_name}_fts) values ('delete-all')")
+            count = self._index(table_name, self._conn.execute(
+                f"select rowid, {', '.join(fts_columns)} from {table_name}"))
+            self._conn.execute(f"insert into {table_name}_fts ({table_name}_fts) values ('optimize')")
+        return count
+
+    def _index(self, table_name: str, rows, delete: bool = False) -> int:
+        """
+        把 (rowid, 字段...) 加入索引；delete 为 True 时从索引中删除，字段需要是写入索引时的值。
+        """
+        fts_columns = FTS_COLUMNS[table_name]
+        command = "'delete'" if delete else "null"
+        params = [(row[0], *(to_ngrams(value) for value in tuple(row)[1:])) for row in rows]
+        self._conn.executemany(
+            f"insert into {table_name}_fts ({table_name}_fts, rowid, {', '.join(fts_columns)}) "
+            f"values ({command}, {', '.join('?' * (len(fts_columns) + 1))})", params)
+        return len(params)
+
+
+_store = None
+_lock = threading.Lock()
+
+
+def get_store() -> SqliteStore:
+    global _store
+    if _store is None:
+        with _lock:
+            if _store is None:
+                _store = SqliteStore(get_value_from_yaml_or_env("sqlite.db"),
+                                     int(get_value_from_yaml_or_env("sqlite.batch_size") or 1000))
+    return _store
+
+
+class SqliteSink(Sink):
+    """
+    存储目标 sqlite，一次写入在一个事务中完成，出错时抛出异常。
+    """
+
+    def target(self) -> str:
+        return os.path.abspath(get_value_from_yaml_or_env("sqlite.db"))
+
+    def replace_day(self, table_name: str, date: str, records: List[Dict[str, Any]]) -> None:
+        get_store().write(table_name, records, date)
+
+    def upsert(self, table_name: str, records: List[Dict[str, Any]]) -> None:
+        get_store().write(table_name, records)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="本地 SQLite 全文查询")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    search_parser = subparsers.add_parser("search", help="按关键词查询")
+    search_parser.add_argument("table", choices=list(FTS_COLUMNS))
+    search_parser.add_argument("keywords", nargs="+")
+    search_parser.add_argument("--start", help="开始日期 yyyymmdd")
+    search_parser.add_argument("--end", help="结束日期 yyyymmdd")
+    search_parser.add_argument("--limit", type=int, default=20)
+    rebuild_parser = subparsers.add_parser("rebuild", help="重新生成全文索引")
+    rebuild_parser.add_argument("table", choices=list(FTS_COLUMNS))
+    args = parser.parse_args()
+
+    if args.command == "search":
+        begin = time.perf_counter()
+        results = get_store().search(args.table, " ".join(args.keywords), args.start, args.end, args.limit)
+        for item in results:
+            print(item["date"], item.get("id", ""), item.get("abstract") or item.get("title"))
+        log.info("查询到 %d 条，耗时 %.1fms", len(results), (time.perf_counter() - begin) * 1000)
+    else:
+        log.info("重新生成 %s 的全文索引: %d 条记录", args.table, get_store().rebuild_index(args.table))
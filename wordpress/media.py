@@ -0,0 +1,232 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, Iterable, Iterator, Optional
+
+from common import http_client, image, metrics
+from common.config import get_value_from_yaml_or_env
+
+"""
+    上传到 WordPress 的图片记录 (媒体台账)
+    - 按图片 url 和内容的 sha256 记录 media_id，已经上传过的 url 不再下载，内容相同的图片不再上传
+    - 配置了 wordpress.image_variant 时上传本地生成的缩略图 (common/image.py)，不再下载原图；
+      没有缩略图时边下载边计算 hash，原样上传，Content-Type 使用图片的真实类型
+    - 多张图片用有上限的线程池并发上传
+"""
+
+log = logging.getLogger(__name__)
+
+# 文件头对应的图片类型，下载的响应没有正确的 Content-Type 时使用
+_MAGIC = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"RIFF", "image/webp"),
+)
+
+
+def get_auth_header() -> Dict[str, str]:
+    username = get_value_from_yaml_or_env("wordpress.username")
+    password = get_value_from_yaml_or_env("wordpress.password")
+    return {'Authorization': 'Basic {}'.format(
+        b64encode('{}:{}'.format(username, password).encode('utf-8')).decode('utf-8'))}
+
+
+def guess_content_type(image_url: str, header: Optional[str], head: bytes) -> str:
+    """
+    按响应头、文件头、扩展名的顺序确定图片类型。
+    """
+    if header and header.split(";")[0].strip().startswith("image/"):
+        return header.split(";")[0].strip()
+    for magic, content_type in _MAGIC:
+        if head.startswith(magic) and (content_type != "image/webp" or head[8:12] == b"WEBP"):
+            return content_type
+    return mimetypes.guess_type(image_url.split("?")[0])[0] or "application/octet-stream"
+
+
+class MediaLedger:
+
+    def __init__(self, db_path: str, site: str):
+        self.site = site
+        self._lock = threading.Lock()
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("pragma journal_mode = wal")
+            self._conn.execute("create table if not exists media ("
+                               "site text not null, url text not null, sha256 text not null, "
+                               "media_id integer not null, content_type text, uploaded_at real not null, "
+                               "primary key (site, url))")
+            self._conn.execute("create index if not exists idx_media_sha256 on media (site, sha256)")
+        self.stats = {"url_hits": 0, "hash_hits": 0, "uploaded": 0, "failed": 0}
+        # 同一内容同时只有一个线程上传，其他线程等它完成后直接使用记录的 media_id
+        self._hash_locks: Dict[str, threading.Lock] = {}
+
+    def hash_lock(self, sha256: str) -> threading.Lock:
+        with self._lock:
+            return self._hash_locks.setdefault(sha256, threading.Lock())
+
+    def find_by_url(self, url: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute("select media_id from media where site = ? and url = ?",
+                                     (self.site, url)).fetchone()
+        return row[0] if row else None
+
+    def find_by_hash(self, sha256: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute("select media_id from media where site = ? and sha256 = ? limit 1",
+                                     (self.site, sha256)).fetchone()
+        return row[0] if row else None
+
+    def record(self, url: str, sha256: str, media_id: int, content_type: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("insert or replace into media (site, url, sha256, media_id, content_type, uploaded_at) "
+                               "values (?, ?, ?, ?, ?, ?)",
+                               (self.site, url, sha256, media_id, content_type, time.time()))
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger() -> MediaLedger:
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = MediaLedger(get_value_from_yaml_or_env("wordpress.media_db"),
+                                      get_value_from_yaml_or_env("wordpress.media"))
+    return _ledger
+
+
+@metrics.timed("wordpress_upload_image")
+def upload_image(image_url: str, local_path: Optional[str] = None) -> int:
+    """
+    上传图片到 WordPress 并返回 media_id，已经上传过的图片直接返回记录的 media_id。
+
+    参数:
+        image_url (str): 图片的 URL
+        local_path (str): 这张图片在本地的缩略图，传入时上传缩略图，不下载原图
+
+    返回:
+        int: 上传图片的 media_id
+    """
+    ledger = get_ledger()
+    media_id = ledger.find_by_url(image_url)
+    if media_id is not None:
+        ledger.count("url_hits")
+        return media_id
+
+    image_name = image_url.split("?")[0].split("/")[-1]
+    if local_path is not None:
+        try:
+            f = open(local_path, "rb")
+        except FileNotFoundError:
+            # 缩略图在生成后被淘汰，下载原图
+            log.warning("缩略图不存在，上传原图 %s", image_url)
+        else:
+            with f:
+                # 文件名使用缩略图的扩展名
+                return _upload(ledger, image_url, os.path.splitext(image_name)[0] + os.path.splitext(local_path)[1],
+                               iter(lambda: f.read(64 * 1024), b""), None)
+
+    # 边下载边计算 hash，内容写入临时文件 (小图片在内存中)，不解码图片
+    response = http_client.get(image_url, stream=True)
+    if response.status_code != 200:
+        response.close()
+        raise Exception(f"无法下载图片: {response.status_code} {image_url}")
+    with response:
+        return _upload(ledger, image_url, image_name, response.iter_content(chunk_size=64 * 1024),
+                       response.headers.get("Content-Type"))
+
+
+def _upload(ledger: MediaLedger, image_url: str, image_name: str, chunks: Iterator[bytes],
+            content_type: Optional[str]) -> int:
+    digest = hashlib.sha256()
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as buffer:
+        head = b""
+        for chunk in chunks:
+            if len(head) < 16:
+                head += chunk[:16]
+            digest.update(chunk)
+            buffer.write(chunk)
+        sha256 = digest.hexdigest()
+        content_type = guess_content_type(image_name, content_type, head)
+
+        # 内容相同的图片 (如不同 url 的同一张图) 不再上传
+        with ledger.hash_lock(sha256):
+            media_id = ledger.find_by_hash(sha256)
+            if media_id is not None:
+                ledger.count("hash_hits")
+                ledger.record(image_url, sha256, media_id, content_type)
+                return media_id
+
+            buffer.seek(0)
+            media_id = _post_media(buffer, image_name, content_type)
+            ledger.record(image_url, sha256, media_id, content_type)
+            ledger.count("uploaded")
+    log.info("上传图片 %s (%s)，media_id: %s", image_name, content_type, media_id)
+    return media_id
+
+
+def _post_media(data: BinaryIO, image_name: str, content_type: str) -> int:
+    headers = {
+        "Content-Disposition": f"attachment; filename={image_name}",
+        "Content-Type": content_type,
+        **get_auth_header()
+    }
+    # 文件对象作为 data 时 requests 分块读取发送
+    upload = http_client.post(get_value_from_yaml_or_env("wordpress.media"), headers=headers, data=data)
+    if upload.status_code not in [200, 201]:
+        raise Exception(f"上传图片失败: {upload.status_code}, {upload.text}")
+    return upload.json().get("id")
+
+
+def upload_images(image_urls: Iterable[str], workers: int = None) -> Dict[str, Optional[int]]:
+    """
+    并发上传多张图片，返回 {url: media_id}，上传失败的图片为 None。
+    """
+    urls = list(dict.fromkeys(image_urls))
+    workers = workers or int(get_value_from_yaml_or_env("wordpress.upload_workers") or 4)
+    # 还没有上传过的图片使用缩略图，图片阶段已经生成过的直接读取本地文件
+    variant = get_value_from_yaml_or_env("wordpress.image_variant")
+    local_paths: Dict[str, str] = {}
+    if variant:
+        ledger = get_ledger()
+        pending = [url for url in urls if ledger.find_by_url(url) is None]
+        if pending:
+            local_paths = {url: paths[variant] for url, paths in image.process_images(pending).items()
+                           if variant in paths}
+
+    def upload(url: str) -> Optional[int]:
+        try:
+            return upload_image(url, local_paths.get(url))
+        except Exception as e:
+            get_ledger().count("failed")
+            log.error("上传图片失败 %s: %s", url, e)
+            return None
+
+    if not urls:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(min(workers, len(urls)), 1), thread_name_prefix="wp_media") as executor:
+        return dict(zip(urls, executor.map(metrics.bind(upload), urls)))
+
+
+def log_stats() -> None:
+    if _ledger is not None:
+        log.info("WordPress 图片: 按 url 跳过 %d 张，按内容跳过 %d 张，上传 %d 张，失败 %d 张",
+                 _ledger.stats["url_hits"], _ledger.stats["hash_hits"],
+                 _ledger.stats["uploaded"], _ledger.stats["failed"])
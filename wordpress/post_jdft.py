@@ -1,14 +1,16 @@
-from datetime import datetime, timedelta
-from io import BytesIO
+import argparse
+from datetime import datetime
+
+import logging
 
 import pytz
-import requests
-import json
 from base64 import b64encode
-from PIL import Image
 
-from config import get_value_from_yaml_or_env
+from common import http_client, metrics
+from common.config import get_value_from_yaml_or_env
+from common.time import get_current_time
 from mySql.mySql import get_data_from_MySql
+from wordpress import media
 
 username = get_value_from_yaml_or_env("wordpress.username")
 password = get_value_from_yaml_or_env("wordpress.password")
@@ -16,76 +18,31 @@ auth_header = {
     'Authorization': 'Basic {}'.format(b64encode('{}:{}'.format(username, password).encode('utf-8')).decode('utf-8'))}
 
 
-def add_posts_to_wordpress():
+def add_posts_to_wordpress(date: str):
     url = get_value_from_yaml_or_env('wordpress.posts')
-    data = get_data_from_MySql('tbl_jdft', '20241125')
-    date = datetime.now(pytz.timezone('UTC')).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    data = get_data_from_MySql('tbl_jdft', date)
+    post_date = datetime.now(pytz.timezone('UTC')).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    # 先并发上传所有图片，已经上传过的图片不会重复上传
+    media_ids = media.upload_images(item['image_url'] for item in data)
     for item in data:
-        # 首先上传一幅图片
-        image_url: str = item['image_url']
-        media_id = upload_image_to_wordpress(image_url)
-
+        media_id = media_ids.get(item['image_url']) or 0
         post = {
             'title': item['title'],
             'status': 'publish',
             'content': item['content'] + "<a target=\"_blank\" href='" + item['video_url'] + "'>参考链接</a>",
             'categories': 6,
-            'date': date,
+            'date': post_date,
             "featured_media": media_id,
         }
-        response = requests.post(url, headers=auth_header, json=post)
+        with metrics.span("wordpress_create_post", program="jdft"):
+            response = http_client.post(url, headers=auth_header, json=post)
         print(response.text)
 
 
-def upload_image_to_wordpress(image_url: str):
-    """
-        上传图片到 WordPress 并返回 media_id
-
-        参数:
-            image_url (str): 图片的 URL
-            wordpress_site_url (str): WordPress 网站的 URL
-            username (str): 用户名
-            password (str): 应用密码
-
-        返回:
-            int: 上传图片的 media_id
-    """
-    # 获取图片数据
-    response = requests.get(image_url)
-    if response.status_code != 200:
-        raise Exception("无法下载图片")
-
-    # image_data = BytesIO(response.content)
-    img = Image.open(BytesIO(response.content))
-    buffer = BytesIO()
-    img.save(buffer, format=img.format)
-    buffer.seek(0)
-
-    image_name = image_url.split("/")[-1]
-
-    # WordPress 媒体 API URL
-    media_url = get_value_from_yaml_or_env("wordpress.media")
-
-    # 请求头
-    headers = {
-        "Content-Disposition": f"attachment; filename={image_name}",
-        "Content-Type": "image/jpg",
-        **auth_header
-    }
-
-    # 发送 POST 请求上传图片
-    response = requests.post(media_url,
-                             headers=headers,
-                             data=buffer)
-
-    if response.status_code not in [200, 201]:
-        raise Exception(f"上传图片失败: {response.status_code}, {response.text}")
-
-    media_id = response.json().get("id")
-    print(f'media_id: {media_id}')
-    return media_id
-
-
 if __name__ == '__main__':
-    add_posts_to_wordpress()
-    # upload_image_to_wordpress('')
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="发布到 WordPress")
+    parser.add_argument("--date", default=get_current_time()[0], help="日期 yyyymmdd，默认今天")
+    add_posts_to_wordpress(parser.parse_args().date)
+    http_client.log_stats()
+    media.log_stats()
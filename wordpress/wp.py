@@ -1,12 +1,13 @@
-import requests
 import json
 import random
 from googletrans import Translator
 from requests.auth import HTTPBasicAuth
 
+from common import http_client
+
 
 def post_creator(sourceURL, wpBaseURL, sourceLang, targetLang, postStatus):
-    response_API = requests.get(sourceURL)
+    response_API = http_client.get(sourceURL)
     data = response_API.text
     parse_json = json.loads(data)
     get_article_title = parse_json['title']
@@ -39,7 +40,7 @@ def post_creator(sourceURL, wpBaseURL, sourceLang, targetLang, postStatus):
         "featured_media": random_image_list
     })
 
-    response = requests.request(
+    response = http_client.request(
         "POST",
         WP_url,
         data=payload,
@@ -0,0 +1,123 @@
+import argparse
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import List, Set
+
+from common import http_client, sink, video_info
+from common.config import get_value_from_yaml_or_env
+from mySql.mySql import log_pool_stats
+from xwlb import get_sections, db_name
+
+"""
+    回填历史新闻联播
+    用法: python backfill.py 20240101 20240331 [--workers 4]
+    多天并发抓取，每天抓取完成后整体写入数据库，并把日期记录到 checkpoint 文件，
+    中断后重新执行会跳过已经完成的日期。
+    并发请求数受 http.max_concurrency / http.per_host_concurrency 限制。
+"""
+
+log = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """
+    已完成日期的记录文件，每行一个日期，只追加。
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._lock = threading.Lock()
+        self.done: Set[str] = set()
+        if os.path.exists(file_path):
+            with open(file_path, "r") as f:
+                self.done = {line.strip() for line in f if line.strip()}
+
+    def mark(self, date: str) -> None:
+        with self._lock:
+            with open(self.file_path, "a") as f:
+                f.write(date + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.done.add(date)
+
+
+def date_range(start: str, end: str) -> List[str]:
+    start_date = datetime.strptime(start, "%Y%m%d")
+    end_date = datetime.strptime(end, "%Y%m%d")
+    return [(start_date + timedelta(days=i)).strftime("%Y%m%d") for i in range((end_date - start_date).days + 1)]
+
+
+def backfill_day(date: str) -> int:
+    # 任意一节失败都抛出异常，这一天不记录到 checkpoint，下次重新抓取
+    sections = get_sections(date, skip_failed=False)
+    if len(sections) == 0:
+        raise Exception(f"{date} 没有获取到数据")
+    # 各个存储目标在自己的事务中写入 (mysql 为 MySqlSink + mysql_session，出错时抛出异常)，
+    # 不是 required 的目标失败时 replace_day 只返回结果，这里同样当作失败，下次重新回填
+    results = sink.replace_day(db_name, date, sections)
+    failed = [name for name, result in results.items() if result not in ("ok", "unchanged")]
+    if failed:
+        raise sink.SinkError(f"{date} 写入 {', '.join(failed)} 失败")
+    return len(sections)
+
+
+def backfill(start: str, end: str, workers: int = None, checkpoint_file: str = None) -> None:
+    """
+    回填 [start, end] 之间的所有日期。
+
+    参数:
+        start (str): 开始日期，格式为 yyyymmdd。
+        end (str): 结束日期 (包含)，格式为 yyyymmdd。
+        workers (int): 同时抓取的天数，默认读取 xwlb.backfill_workers。
+        checkpoint_file (str): 已完成日期的记录文件，默认读取 xwlb.backfill_checkpoint。
+
+    返回:
+        None
+    """
+    workers = workers or int(get_value_from_yaml_or_env("xwlb.backfill_workers") or 1)
+    checkpoint = Checkpoint(checkpoint_file or get_value_from_yaml_or_env("xwlb.backfill_checkpoint"))
+
+    dates = [date for date in date_range(start, end) if date not in checkpoint.done]
+    log.info("共 %d 天需要回填，跳过已完成的 %d 天", len(dates), len(date_range(start, end)) - len(dates))
+
+    begin = time.perf_counter()
+    done, failed = 0, []
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="backfill") as executor:
+        futures = {executor.submit(backfill_day, date): date for date in dates}
+        for future in as_completed(futures):
+            date = futures[future]
+            try:
+                count = future.result()
+                checkpoint.mark(date)
+                done += 1
+                minutes = (time.perf_counter() - begin) / 60
+                log.info("%s 完成，%d 条 (%d/%d，%.1f 天/分钟)", date, count, done, len(dates),
+                         done / max(minutes, 1e-9))
+            except Exception as e:
+                failed.append(date)
+                log.error("%s 失败: %s", date, e)
+
+    minutes = (time.perf_counter() - begin) / 60
+    log.info("回填结束: 完成 %d 天，失败 %d 天，耗时 %.1f 分钟，%.1f 天/分钟",
+             done, len(failed), minutes, done / max(minutes, 1e-9))
+    if failed:
+        log.info("失败的日期: %s", " ".join(sorted(failed)))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="回填历史新闻联播")
+    parser.add_argument("start", help="开始日期 yyyymmdd")
+    parser.add_argument("end", help="结束日期 yyyymmdd (包含)")
+    parser.add_argument("--workers", type=int, default=None, help="同时抓取的天数")
+    parser.add_argument("--checkpoint", default=None, help="已完成日期的记录文件")
+    args = parser.parse_args()
+
+    backfill(args.start, args.end, args.workers, args.checkpoint)
+    http_client.log_stats()
+    video_info.log_stats()
+    log_pool_stats()
@@ -1,82 +1,156 @@
-import json
+import argparse
 import logging
 import re
-from typing import List, Dict
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple
 
 import datetime
 import pytz
-import requests
 from lxml import etree
 
 from common.config import get_value_from_yaml_or_env
 from common.push import Messenger
-from mongo.mongo import insert_to_mongo, delete_from_mongo
-from mySql.mySql import delete_from_mysql, insert_to_mysql
-from parse_html import parse_html
-from common.time import get_current_time, get_yesterday_time
-from pg.pg import insert_to_pg, delete_from_pg
+from mongo.mongo import insert_to_mongo
+from mySql.mySql import log_pool_stats
+from common import archive, digest, http_client, metrics, sink, video_info
+from common.parse_html import fetch_html, parse_html
+from common.time import get_yesterday_time
+from common.video_info import TagLookupError, get_tags
 
 log = logging.getLogger(__name__)
 
 db_name = "tbl_xwlb"
 
-
-def get_sections(date: str) -> List[Dict[str, str]]:
+# 预编译的 XPath，避免每次调用重新编译；<li> 之后的路径都相对当前节点，不再从根节点重新查找
+_li_xpath = etree.XPath('/html/body/li')
+_li_image_xpath = etree.XPath('div/a/img/@src')
+_li_link_xpath = etree.XPath('a/@href')
+# 简介(摘要)
+_abstract_xpath = etree.XPath('//*[@id="page_body"]/div[1]/div[2]/div[1]/div[2]/text()')
+# 主要内容
+_content_xpath = etree.XPath('//*[@id="content_area"]//text()')
+_guid_pattern = re.compile(r'var guid = "(.*?)";')
+
+
+def extract_items(html: etree._Element) -> List[Tuple[int, str, str]]:
+    """
+    从一天的列表页中提取每一节的 (序号, 图片, 链接)，只遍历一次 <li>。
+    第 1 个是全部内容，从第 2 个开始才是每一段具体信息。
+    """
+    items = []
+    for i, li in enumerate(_li_xpath(html)):
+        items.append((i, 'http:' + _li_image_xpath(li)[0], _li_link_xpath(li)[0]))
+    return items
+
+
+def extract_section(sub_html: etree._Element) -> Tuple[str, str]:
+    """
+    从一节的页面中提取 (摘要, 主要内容)。
+    """
+    return ''.join(_abstract_xpath(sub_html)), ''.join(_content_xpath(sub_html))
+
+
+def extract_guid(text: str) -> Optional[str]:
+    """
+    从页面原文中提取 pid，不需要把解析后的整棵树重新序列化。
+    """
+    match = _guid_pattern.search(text)
+    return match.group(1) if match else None
+
+
+def get_sections(date: str, skip_failed: bool = False) -> List[Dict[str, str]]:
+    """
+    获取指定日期新闻联播的每一节内容。
+
+    参数:
+        date (str): 日期，格式为 yyyymmdd。
+        skip_failed (bool): 为 False 时任意一节获取失败都在其他章节获取完后抛出异常；
+            为 True 时跳过获取失败的章节，返回的结果不完整，只能用 sink.upsert(partial=True) 写入，
+            不能用 sink.replace_day (会删除失败章节已有的数据)。
+
+    返回:
+        List[Dict[str, str]]: 按 id 排序的章节列表。
+    """
     # 访问主站
     xwlb_url = get_value_from_yaml_or_env("xwlb.day_url").format(date)
-    html = parse_html(xwlb_url)
-
-    # 构建XPath表达式并计算 <div> 下的 <li> 元素数量，统计有多少个子章节。
-    count_xpath = 'count(//html/body/li)'
-    count = int(html.xpath(count_xpath))
+    items = extract_items(parse_html(xwlb_url))
     log.info("获取网页信息成功")
 
+    # 并发数从配置文件读取，<= 1 时串行获取
+    workers = int(get_value_from_yaml_or_env("xwlb.workers") or 1)
+    start = time.perf_counter()
+    if workers <= 1 or len(items) <= 1:
+        results = [get_section_or_none(date, *item) for item in items]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(items)), thread_name_prefix="xwlb") as executor:
+            # map 按提交顺序返回结果，保证与 id 顺序一致
+            results = list(executor.map(metrics.bind(lambda item: get_section_or_none(date, *item)), items))
+
     # 存储获取到的信息 (链接、标题、主要内容)
     # [{id: 1, url: '', title: '', content: ''}]
-    sections = []
-
-    # 循环获取每个视频的链接，第 1 个是全部内容，从第 2 个开始才是每一段具体信息
-    for i in range(1, count + 1):
-        # 获取图片
-        image_xpath = '//html/body/li[{}]/div/a/img/@src'.format(i)
-        image_url = 'http:' + html.xpath(image_xpath)[0]
-
-        # 循环访问每个节视频的链接,获取信息
-        section_xpath = '//html/body/li[{}]/a/@href'.format(i)
-        section_url = html.xpath(section_xpath)[0]
-        sub_html = parse_html(section_url)
-        # 简介(摘要)
-        abstracts_xpath = '//*[@id="page_body"]/div[1]/div[2]/div[1]/div[2]/text()'
-        # abstracts_xpath = '//*[@id="page_body"]/div[1]/div[2]/div[2]/div[2]/div/ul/li[1]/p/text()'
-        abstracts = sub_html.xpath(abstracts_xpath)
-        # 主要内容
-        content_xpath = '//*[@id="content_area"]//text()'
-        content = sub_html.xpath(content_xpath)
-        # 根据 pid 获取内容 tag
-        pattern = r'var guid = "(.*?)";'
-        match = re.search(pattern, etree.tostring(sub_html, encoding="unicode"))
-
-        tags = ''
-        if match:
-            pid = match.group(1)
-            # 根据 pid 获取内容 tag
-            pid_text = requests.get(get_value_from_yaml_or_env("xwlb.tag_url").format(pid)).text
-            tags = json.loads(pid_text)['tag']
-
-        sections.append({
-            "id": i - 1,
-            "date": date,
-            "image_url": image_url,
-            "tags": tags,
-            "abstract": ''.join(abstracts),
-            "content": ''.join(content),
-            "video_url": section_url
-        })
-    log.info("获取 %d 条数据", len(sections))
+    results = [result for result in results if result is not None]
+
+    # 所有章节的 pid 一起查询标签，标签获取失败的章节和页面获取失败的章节一样处理
+    try:
+        tags = get_tags([pid for _, pid in results if pid])
+    except TagLookupError as e:
+        if not skip_failed:
+            raise
+        log.error("%s，跳过这些章节", e)
+        tags = e.tags
+        results = [(section, pid) for section, pid in results if not pid or pid in tags]
+    sections = [section for section, _ in results]
+    for section, pid in results:
+        if pid:
+            section["tags"] = tags[pid]
+    log.info("获取 %d/%d 条数据，耗时 %.2fs (workers=%d)",
+             len(sections), len(items), time.perf_counter() - start, workers)
+    if not skip_failed and len(sections) < len(items):
+        raise Exception(f"{date} 有 {len(items) - len(sections)} 节获取失败")
     return sections
 
 
-def push_to_dingtalk(sections: List[Dict[str, str]]) -> None:
+def get_section_or_none(date: str, section_id: int, image_url: str,
+                        section_url: str) -> Optional[Tuple[Dict[str, str], Optional[str]]]:
+    """
+    获取一节内容和 pid，失败时记录日志并返回 None，不影响其他章节。
+    """
+    start = time.perf_counter()
+    try:
+        section = get_section(date, section_id, image_url, section_url)
+        log.info("第 %d 节获取成功，耗时 %.2fs", section_id, time.perf_counter() - start)
+        return section
+    except Exception:
+        log.exception("第 %d 节获取失败，耗时 %.2fs: %s", section_id, time.perf_counter() - start, section_url)
+        return None
+
+
+def get_section(date: str, section_id: int, image_url: str, section_url: str) -> Tuple[Dict[str, str], Optional[str]]:
+    """
+    获取一节内容，标签由调用方根据返回的 pid 批量查询。
+    """
+    # 访问每个节视频的链接,获取信息
+    text, sub_html = fetch_html(section_url)
+    abstract, content = extract_section(sub_html)
+    # 页面中的 pid，用于获取内容 tag
+    pid = extract_guid(text)
+
+    return {
+        "id": section_id,
+        "date": date,
+        "image_url": image_url,
+        "tags": '',
+        "abstract": abstract,
+        "content": content,
+        "video_url": section_url
+    }, pid
+
+
+def push_to_dingtalk(sections: List[Dict[str, str]], date: str) -> Future:
+    """
+    放入钉钉发送队列后立即返回，不等待发送完成，需要结果时调用返回值的 result()。
+    """
     section_format = '[{}. 摘要：{}]([完整版视频链接]({}))![图片]({})'
     all_text = []
     for section in sections:
@@ -86,16 +160,30 @@ def push_to_dingtalk(sections: List[Dict[str, str]]) -> None:
                                               section["image_url"]))
 
     text = '\n'.join(all_text)
+    # 这一天推送过相同的内容时不再推送
+    if not digest.should_push(db_name, date, text):
+        log.info("%s 推送内容没有变化，跳过", get_title(date))
+        future = Future()
+        future.set_result([])
+        return future
+
+    def done(f: Future) -> None:
+        if f.exception() is None:
+            digest.record_push(db_name, date, text)
+            log.info("推送 dingtalk 成功，共 %d 条消息", len(f.result()))
+        else:
+            log.error("推送 dingtalk 失败: %s", f.exception())
+
     m = Messenger()
-    m.send_md(title, text)
-    log.info("推送 dingtalk 成功")
+    future = m.send(get_title(date), text)
+    future.add_done_callback(done)
+    return future
 
 
-def write_to_file(sections: List[Dict[str, str]]) -> None:
-    file_name = "./content/" + title + "共{}条".format(len(sections)) + ".json"
-    with open(file_name, "w") as f:
-        f.write(json.dumps(sections, indent=4, ensure_ascii=False))
-    log.info("写入文件成功")
+def write_to_file(sections: List[Dict[str, str]], date: str) -> None:
+    # 追加到按天压缩的归档 archive.dir/表名.jsonl.gz，旧的 json 文件用 python -m common.archive convert 转换
+    archive.get_archive(db_name).write_day(date, sections)
+    log.info("写入归档成功")
 
 
 def write_to_mongo(sections: List[Dict[str, str]]) -> None:
@@ -103,23 +191,34 @@ def write_to_mongo(sections: List[Dict[str, str]]) -> None:
     log.info("写入 mongo 成功")
 
 
-# 调用函数获取当前时间
-# date, iso_time = get_current_time()
-date, iso_time = get_yesterday_time()
-# 推送标题
-title = date + "新闻联播"
+def get_title(date: str) -> str:
+    # 推送标题
+    return date + "新闻联播"
+
 
 if __name__ == '__main__':
-    sections = get_sections(date)
-    # for i in range(len(sections)):
-    #     print(sections[i])
-    # write_to_file(sections)
-    # delete_from_mongo(db_name, date)
-    # write_to_mongo(sections)
-
-    # delete_from_pg(db_name, date)
-    # insert_to_pg(db_name, sections)
-
-    delete_from_mysql(db_name, date)
-    insert_to_mysql(db_name, sections)
-    log.info("写入 mysql 成功")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="获取新闻联播")
+    parser.add_argument("--date", default=get_yesterday_time()[0], help="日期 yyyymmdd，默认昨天")
+    parser.add_argument("--skip-failed", action="store_true",
+                        help="跳过获取失败的章节，只写入获取成功的章节，不删除这一天已有的数据；"
+                             "按天整体重写的存储目标 (file、archive、ngram、tags) 不写入，等下次完整获取")
+    args = parser.parse_args()
+    date = args.date
+
+    with metrics.trace("xwlb", date=date):
+        sections = get_sections(date, skip_failed=args.skip_failed)
+        # for i in range(len(sections)):
+        #     print(sections[i])
+        # write_to_file(sections, date)
+
+        if args.skip_failed:
+            # 结果可能不完整，只插入或更新，不删除失败章节已有的数据；按天重写的目标会删除，跳过
+            sink.upsert(db_name, sections, partial=True)
+        else:
+            # 并发写入 sinks.enabled 中的所有存储目标，每个目标在一个事务中替换这一天的数据
+            sink.replace_day(db_name, date, sections)
+    http_client.log_stats()
+    video_info.log_stats()
+    digest.log_stats()
+    log_pool_stats()